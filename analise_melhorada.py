@@ -5,21 +5,88 @@ Sistema de Análise de Mobilizadores - Versão Melhorada
 Análise flexível com múltiplos critérios de classificação
 """
 
-import pandas as pd
-import numpy as np
-import openpyxl
+import heapq
 import json
 import os
+import multiprocessing
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from datetime import datetime
 
+import graficos
+from incremental import EstadoIncremental, RankingIncremental, anotar_movimentacao, posicoes_alteradas
+from metricas import Medicao
+from plano_extracao import (
+    COLUNAS_NOME, compilar_plano, converter_coluna_para_indice
+)
+
+# numpy, pandas e openpyxl são importados dentro dos métodos que os usam:
+# importar este módulo (e o app) fica barato e o custo vai para o
+# aquecimento do servidor ou para o primeiro upload
+
+# Referência de uma célula mesclada no XML da aba (<mergeCell ref="A2:A4"/>)
+_RE_CELULA_MESCLADA = re.compile(rb'<(?:\w+:)?mergeCell\b[^>]*?\bref="([^"]+)"')
+
+
+class PlanilhaInvalida(ValueError):
+    """O arquivo não pôde ser lido como planilha .xlsx (corrompido, truncado, outro formato)"""
+
+
+def _erros_de_leitura():
+    """Exceções que indicam arquivo inválido, e não erro do analisador"""
+    import zipfile
+    import zlib
+    from xml.etree.ElementTree import ParseError
+    from openpyxl.utils.exceptions import InvalidFileException
+
+    return (zipfile.BadZipFile, zlib.error, EOFError, OSError, KeyError, ParseError, InvalidFileException)
+
+
+def nome_provisorio(linha):
+    """Nome dado às linhas sem nome de mobilizador (em branco, totalizações)
+
+    Só identifica a linha dentro da própria planilha: em planilhas
+    diferentes o mesmo nome provisório é de pessoas diferentes.
+    """
+    return f"Mobilizador {linha}"
+
+
 class AnalisadorMobilizadoresMelhorado:
     """
     Analisador melhorado com múltiplos critérios de classificação
     """
     
-    def __init__(self):
+    # Colunas onde o nome do mobilizador pode aparecer: A, B, C, D
+    COLUNAS_NOME = COLUNAS_NOME
+    
+    # 'completo' monta o modelo inteiro do openpyxl; 'streaming' usa o modo
+    # read-only e mantém em memória apenas as colunas mapeadas
+    MODOS_LEITURA = ('completo', 'streaming')
+    
+    # Como os grupos são extraídos do bloco: um após o outro, em threads ou
+    # em processos (cada processo recebe só as colunas do seu grupo)
+    MODOS_EXECUCAO = ('serial', 'threads', 'processos')
+    
+    # Textos de linhas de totalização, que não são nomes de mobilizador
+    NOMES_GENERICOS = frozenset(('total', 'soma', 'geral'))
+    
+    def __init__(self, modo_leitura='completo', modo_execucao='serial', workers=None,
+                 mapeamento_colunas=None, herdar_nome_mesclado=False):
+        if modo_leitura not in self.MODOS_LEITURA:
+            raise ValueError(f'Modo de leitura inválido: {modo_leitura}')
+        if modo_execucao not in self.MODOS_EXECUCAO:
+            raise ValueError(f'Modo de execução inválido: {modo_execucao}')
+        self.modo_leitura = modo_leitura
+        self.modo_execucao = modo_execucao
+        self.workers = workers or min(os.cpu_count() or 1, 6)
+        # Linhas com as colunas de nome vazias (células mescladas) herdam o
+        # nome da linha de cima em vez de virar "Mobilizador <linha>"
+        self.herdar_nome_mesclado = herdar_nome_mesclado
+        self._executores = {}
+        
         # Mapear todas as colunas e tipos de dados disponíveis
-        self.mapeamento_colunas = {
+        self.mapeamento_colunas = mapeamento_colunas or {
             'Mobilizador Desembolso PF': {
                 'coluna_principal': 'G',
                 'campos_disponiveis': {
@@ -49,6 +116,7 @@ class AnalisadorMobilizadoresMelhorado:
                     'Atg_U': {'coluna': 'U', 'tipo': 'porcentagem'},  # ✅ CORRIGIDO: Adicionar coluna U
                     'Subord_Veloc': {'coluna': 'T', 'tipo': 'categoria'}
                 },
+                'colunas_busca': ['S', 'T', 'U'],  # Expandir busca em múltiplas colunas
                 'campo_ranking_preferido': 'Atg'  # Usar sempre % Atingimento
             },
             'Mobilizador Regulariza Dívidas Agro': {
@@ -64,6 +132,7 @@ class AnalisadorMobilizadoresMelhorado:
                     'Rlz_Dia': {'coluna': 'AK', 'tipo': 'valor'},
                     'Atg': {'coluna': 'AL', 'tipo': 'porcentagem'}
                 },
+                'colunas_busca': ['AB', 'AC', 'AD', 'AE', 'AF', 'AG'],  # Expandir busca em múltiplas colunas
                 'campo_ranking_preferido': 'Conexao_105'  # Usar sempre % Atingimento
             },
             'Mobilizador Icred 15/90': {
@@ -87,58 +156,74 @@ class AnalisadorMobilizadoresMelhorado:
                 'campo_ranking_preferido': 'Atg'  # Usar sempre % Atingimento
             }
         }
+        
+        # Compilado uma vez; cada upload só executa o plano
+        self.plano = compilar_plano(self.mapeamento_colunas)
+    
+    def definir_mapeamento(self, mapeamento_colunas):
+        """Troca o mapeamento; o plano novo é validado antes de substituir o atual"""
+        plano = compilar_plano(mapeamento_colunas)
+        self.mapeamento_colunas = mapeamento_colunas
+        self.plano = plano
+    
+    def assinatura_mapeamento(self):
+        """Representação estável do mapeamento configurado (para chaves de cache)
+        
+        Inclui as opções do analisador que mudam o resultado.
+        """
+        if self.herdar_nome_mesclado:
+            return self.plano.assinatura + '|herdar_nome_mesclado'
+        return self.plano.assinatura
     
-    def processar_planilha(self, arquivo_planilha):
-        """Processa a planilha e gera rankings para todos os grupos"""
+    def processar_planilha(self, arquivo_planilha, modo_leitura=None, progresso=None, top_k=None,
+                           medicao=None):
+        """Processa a planilha e gera rankings para todos os grupos
+        
+        modo_leitura sobrescreve o modo configurado no analisador
+        ('completo' ou 'streaming'). progresso, se informado, é chamado
+        como progresso(grupo, dados_grupo) assim que cada grupo termina.
+        top_k limita cada ranking às top_k primeiras posições
+        (total_registros continua contando todos os registros) e fica
+        registrado em resultado['top_k'].
+        medicao (metricas.Medicao), se informada, recebe os tempos de cada
+        etapa e as contagens de cada grupo. Arquivos que não são .xlsx
+        válidos voltam com resultado['planilha_invalida'] = True.
+        """
         try:
             resultado = {'sucesso': False, 'rankings': {}, 'erro': None}
             
-            # Ler planilha com openpyxl para lidar com células mescladas
-            workbook = openpyxl.load_workbook(arquivo_planilha, data_only=True)
-            sheet_names = workbook.sheetnames
-            
-            if not sheet_names:
-                resultado['erro'] = 'Planilha vazia'
+            modo_leitura = modo_leitura or self.modo_leitura
+            if modo_leitura not in self.MODOS_LEITURA:
+                resultado['erro'] = f'Modo de leitura inválido: {modo_leitura}'
                 return resultado
             
-            # Usar a primeira aba
-            worksheet = workbook[sheet_names[0]]
+            # Um único plano por chamada, mesmo que o mapeamento seja trocado no meio
+            plano = self.plano
             
-            # Ler dados completos
-            df_completo = pd.read_excel(arquivo_planilha, header=0)
+            if medicao is None:
+                medicao = Medicao()
             
-            resultados_por_grupo = {}
+            # Decodificar a planilha uma única vez; todos os grupos usam o mesmo bloco
+            try:
+                with medicao.etapa('leitura'):
+                    bloco = self._ler_planilha(arquivo_planilha, modo_leitura, plano)
+            except PlanilhaInvalida as e:
+                resultado['erro'] = str(e)
+                resultado['planilha_invalida'] = True
+                return resultado
             
-            for grupo, config in self.mapeamento_colunas.items():
-                try:
-                    registros_grupo = self._extrair_registros_grupo(
-                        df_completo, worksheet, grupo, config
-                    )
-                    
-                    if registros_grupo:
-                        ranking = self._criar_ranking(registros_grupo, grupo)
-                        resultados_por_grupo[grupo] = {
-                            'total_registros': len(registros_grupo),
-                            'ranking': ranking,
-                            'campos_utilizados': config.get('campos_utilizados', [])
-                        }
-                    else:
-                        resultados_por_grupo[grupo] = {
-                            'total_registros': 0,
-                            'ranking': [],
-                            'mensagem': 'Nenhum registro encontrado'
-                        }
-                        
-                except Exception as e:
-                    resultados_por_grupo[grupo] = {
-                        'total_registros': 0,
-                        'ranking': [],
-                        'erro': f'Erro ao processar grupo: {str(e)}'
-                    }
+            if bloco is None:
+                resultado['erro'] = 'Planilha vazia'
+                return resultado
+            
+            resultados_por_grupo = self._processar_grupos(bloco, progresso=progresso, plano=plano, top_k=top_k,
+                                                          medicao=medicao)
             
             resultado['sucesso'] = True
             resultado['rankings'] = resultados_por_grupo
             resultado['timestamp'] = datetime.now().isoformat()
+            if top_k is not None:
+                resultado['top_k'] = top_k
             
             return resultado
             
@@ -146,69 +231,349 @@ class AnalisadorMobilizadoresMelhorado:
             resultado['erro'] = f'Erro ao processar planilha: {str(e)}'
             return resultado
     
-    def _extrair_registros_grupo(self, df, worksheet, grupo, config):
-        """Extrai registros para um grupo específico"""
-        registros = []
-        campo_ranking = config['campo_ranking_preferido']
+    def processar_incremental(self, arquivo_planilha, anterior=None, resultado_anterior=None,
+                              modo_leitura=None, progresso=None, medicao=None):
+        """Processa a planilha reaproveitando a análise anterior
+        
+        anterior é o EstadoIncremental devolvido pela chamada anterior (ou
+        None). A planilha nova é comparada linha a linha com a anterior nas
+        colunas varridas e nos nomes; só os grupos com linhas alteradas são
+        recalculados, e seus rankings são atualizados no lugar. Com
+        resultado_anterior, cada item do ranking ganha posicao_anterior e
+        variacao (positiva = subiu).
         
+        Retorna (resultado, estado); o estado anterior é reaproveitado e
+        não deve ser usado de novo. medicao funciona como em
+        processar_planilha.
+        """
         try:
-            # Obter campo de ranking configurado
-            campo_info = config['campos_disponiveis'].get(campo_ranking)
-            if not campo_info:
-                # Fallback para outros campos disponíveis
-                for campo, info in config['campos_disponiveis'].items():
-                    if info['tipo'] == 'porcentagem':
-                        campo_info = info
-                        break
+            resultado = {'sucesso': False, 'rankings': {}, 'erro': None}
+            
+            modo_leitura = modo_leitura or self.modo_leitura
+            if modo_leitura not in self.MODOS_LEITURA:
+                resultado['erro'] = f'Modo de leitura inválido: {modo_leitura}'
+                return resultado, None
+            
+            if medicao is None:
+                medicao = Medicao()
+            
+            plano = self.plano
+            assinatura = self.assinatura_mapeamento()
+            try:
+                with medicao.etapa('leitura'):
+                    bloco = self._ler_planilha(arquivo_planilha, modo_leitura, plano)
+            except PlanilhaInvalida as e:
+                resultado['erro'] = str(e)
+                resultado['planilha_invalida'] = True
+                return resultado, None
+            
+            if bloco is None:
+                resultado['erro'] = 'Planilha vazia'
+                return resultado, None
+            
+            with medicao.etapa('indexacao_nomes'):
+                nomes = self._indexar_nomes(bloco)
+            # Estado de outro mapeamento não serve de base
+            if anterior is not None and anterior.assinatura != assinatura:
+                anterior = None
+            
+            if anterior is not None:
+                nomes_alterados = posicoes_alteradas(anterior.nomes, nomes)
+                alteradas_por_coluna = {}
+            
+            rankings = {}
+            grupos_recalculados = []
+            total_alteradas = set()
+            for plano_grupo in plano.grupos:
+                if anterior is None:
+                    ranking = RankingIncremental(plano_grupo)
+                    posicoes = None
+                else:
+                    ranking = anterior.rankings[plano_grupo.nome]
+                    posicoes = set(nomes_alterados)
+                    for indice in plano_grupo.indices_busca:
+                        if indice not in alteradas_por_coluna:
+                            alteradas_por_coluna[indice] = posicoes_alteradas(
+                                anterior.bloco.get(indice, []), bloco.get(indice, [])
+                            )
+                        posicoes |= alteradas_por_coluna[indice]
+                    total_alteradas |= posicoes
+                
+                inicio = time.perf_counter()
+                celulas_varridas = 0
+                if posicoes is None or posicoes:
+                    registros_por_linha = {} if posicoes is None else {posicao: [] for posicao in posicoes}
+                    for col_letra, col_indice in zip(plano_grupo.colunas_busca, plano_grupo.indices_busca):
+                        valores_coluna = bloco.get(col_indice, [])
+                        celulas_varridas += len(valores_coluna) if posicoes is None else len(posicoes)
+                        for registro in self._registros_coluna(valores_coluna, col_letra, nomes,
+                                                               None if posicoes is None else sorted(posicoes)):
+                            registros_por_linha.setdefault(registro['linha'] - 2, []).append(registro)
+                    extraido = time.perf_counter()
+                    ranking.atualizar(registros_por_linha)
+                    grupos_recalculados.append(plano_grupo.nome)
+                else:
+                    extraido = inicio
+                
+                rankings[plano_grupo.nome] = ranking
+                dados_grupo = self._resultado_grupo(plano_grupo, self._formatar_ranking(ranking.registros()))
+                medicao.registrar_grupo(plano_grupo.nome, {
+                    'extracao_s': extraido - inicio,
+                    'ranking_s': time.perf_counter() - extraido,
+                    'celulas_varridas': celulas_varridas,
+                    'registros': len(ranking),
+                })
                 
-                if not campo_info:
-                    return registros
+                if resultado_anterior is not None:
+                    ranking_anterior = resultado_anterior.get('rankings', {}).get(plano_grupo.nome, {})
+                    dados_grupo['saidas'] = anotar_movimentacao(
+                        dados_grupo['ranking'], ranking_anterior.get('ranking', [])
+                    )
+                
+                resultado['rankings'][plano_grupo.nome] = dados_grupo
+                if progresso:
+                    progresso(plano_grupo.nome, dados_grupo)
             
-            coluna_letra = campo_info['coluna']
+            resultado['sucesso'] = True
+            resultado['timestamp'] = datetime.now().isoformat()
+            resultado['incremental'] = {
+                'base_reaproveitada': anterior is not None,
+                'linhas_alteradas': len(total_alteradas) if anterior is not None else None,
+                'grupos_recalculados': grupos_recalculados,
+            }
             
-            # Converter letra da coluna para índice
-            coluna_indice = self._converter_coluna_para_indice(coluna_letra)
+            return resultado, EstadoIncremental(assinatura, bloco, nomes, rankings)
             
-            # Para Desembolso Agro e Regulariza, expandir busca em múltiplas colunas
-            if grupo == 'Mobilizador Desembolso Agro':
-                colunas_busca = ['S', 'T', 'U']
-            elif grupo == 'Mobilizador Regulariza Dívidas Agro':
-                colunas_busca = ['AB', 'AC', 'AD', 'AE', 'AF', 'AG']
+        except Exception as e:
+            resultado['erro'] = f'Erro ao processar planilha: {str(e)}'
+            return resultado, None
+    
+    def _processar_grupos(self, bloco, modo_execucao=None, workers=None, progresso=None, plano=None,
+                          top_k=None, medicao=None):
+        """Extrai e ranqueia todos os grupos a partir do bloco colunar
+        
+        O resultado segue sempre a ordem de mapeamento_colunas, qualquer
+        que seja o modo de execução; progresso(grupo, dados_grupo) é
+        chamado na ordem em que os grupos terminam.
+        """
+        modo_execucao = modo_execucao or self.modo_execucao
+        workers = workers or self.workers
+        grupos = (plano or self.plano).grupos
+        if medicao is None:
+            medicao = Medicao()
+        
+        # Nomes resolvidos uma única vez por upload, compartilhados pelos grupos
+        with medicao.etapa('indexacao_nomes'):
+            nomes = self._indexar_nomes(bloco)
+        
+        with medicao.etapa('grupos'):
+            return self._executar_grupos(bloco, grupos, nomes, modo_execucao, workers, progresso, top_k,
+                                         medicao)
+    
+    def _executar_grupos(self, bloco, grupos, nomes, modo_execucao, workers, progresso, top_k, medicao):
+        """Roda _processar_grupo_medido para cada grupo no modo de execução pedido"""
+        if modo_execucao == 'serial' or workers <= 1:
+            resultados = {}
+            for plano_grupo in grupos:
+                dados_grupo, medidas = self._processar_grupo_medido(bloco, plano_grupo, nomes, top_k)
+                medicao.registrar_grupo(plano_grupo.nome, medidas)
+                resultados[plano_grupo.nome] = dados_grupo
+                if progresso:
+                    progresso(plano_grupo.nome, dados_grupo)
+            return resultados
+        
+        executor = self._obter_executor(modo_execucao, workers)
+        if modo_execucao == 'threads':
+            futuros = [
+                executor.submit(self._processar_grupo_medido, bloco, plano_grupo, nomes, top_k)
+                for plano_grupo in grupos
+            ]
+        else:
+            # Cada processo recebe apenas as colunas varridas pelo grupo e o índice de nomes
+            futuros = [
+                executor.submit(
+                    _processar_grupo_em_processo,
+                    {indice: bloco[indice] for indice in plano_grupo.indices_busca if indice in bloco},
+                    plano_grupo,
+                    nomes,
+                    top_k
+                )
+                for plano_grupo in grupos
+            ]
+        
+        grupo_do_futuro = {futuro: plano_grupo.nome for plano_grupo, futuro in zip(grupos, futuros)}
+        for futuro in as_completed(futuros):
+            dados_grupo, medidas = futuro.result()
+            medicao.registrar_grupo(grupo_do_futuro[futuro], medidas)
+            if progresso:
+                progresso(grupo_do_futuro[futuro], dados_grupo)
+        
+        return {plano_grupo.nome: futuro.result()[0] for plano_grupo, futuro in zip(grupos, futuros)}
+    
+    def _obter_executor(self, modo_execucao, workers):
+        """Pool reaproveitado entre uploads, criado no primeiro uso"""
+        chave = (modo_execucao, workers)
+        if chave not in self._executores:
+            if modo_execucao == 'threads':
+                self._executores[chave] = ThreadPoolExecutor(max_workers=workers)
             else:
-                colunas_busca = [coluna_letra]
+                self._executores[chave] = ProcessPoolExecutor(
+                    max_workers=workers, mp_context=multiprocessing.get_context('spawn')
+                )
+        return self._executores[chave]
+    
+    def _processar_grupo(self, bloco, plano_grupo, nomes, top_k=None, medidas=None):
+        """Extrai os registros e monta o ranking de um grupo
+        
+        medidas, se informado, é preenchido com extracao_s, ranking_s,
+        celulas_varridas e registros.
+        """
+        try:
+            inicio = time.perf_counter()
+            registros_grupo = self._extrair_registros_grupo(bloco, plano_grupo, nomes)
+            extraido = time.perf_counter()
+            ranking = self._criar_ranking(registros_grupo, plano_grupo.nome, top_k)
+            if medidas is not None:
+                medidas.update({
+                    'extracao_s': extraido - inicio,
+                    'ranking_s': time.perf_counter() - extraido,
+                    'celulas_varridas': sum(len(bloco.get(indice, ())) for indice in plano_grupo.indices_busca),
+                    'registros': len(registros_grupo),
+                })
+            return self._resultado_grupo(plano_grupo, ranking, len(registros_grupo))
+                
+        except Exception as e:
+            return {
+                'total_registros': 0,
+                'ranking': [],
+                'erro': f'Erro ao processar grupo: {str(e)}'
+            }
+    
+    def _processar_grupo_medido(self, bloco, plano_grupo, nomes, top_k=None):
+        """_processar_grupo que também devolve as medidas: (dados_grupo, medidas)"""
+        medidas = {}
+        return self._processar_grupo(bloco, plano_grupo, nomes, top_k, medidas), medidas
+    
+    def _ler_planilha(self, arquivo_planilha, modo_leitura='completo', plano=None):
+        """Lê a primeira aba da planilha e retorna o bloco colunar
+        
+        O arquivo é lido uma única vez, então streams não reposicionáveis
+        (como o FileStorage do Flask) também funcionam.
+        Retorna None se a planilha não tiver abas. Arquivos corrompidos ou
+        truncados levantam PlanilhaInvalida.
+        """
+        try:
+            return self._ler_workbook(arquivo_planilha, modo_leitura, plano)
+        except _erros_de_leitura() as e:
+            raise PlanilhaInvalida(f'O arquivo não é uma planilha .xlsx válida ({type(e).__name__}: {e})') from e
+    
+    def _ler_workbook(self, arquivo_planilha, modo_leitura, plano):
+        import openpyxl
+        
+        streaming = modo_leitura == 'streaming'
+        
+        # Ler planilha com openpyxl para lidar com células mescladas
+        workbook = openpyxl.load_workbook(
+            arquivo_planilha, data_only=True, read_only=streaming
+        )
+        try:
+            sheet_names = workbook.sheetnames
+            if not sheet_names:
+                return None
             
-            # Atualizar campos utilizados
-            config['campos_utilizados'] = colunas_busca
+            # Usar a primeira aba
+            worksheet = workbook[sheet_names[0]]
             
-            # Buscar em todas as colunas configuradas
-            for col_letra in colunas_busca:
-                col_indice = self._converter_coluna_para_indice(col_letra)
-                
-                # Iterar pelas linhas para encontrar valores válidos
-                for row in range(2, worksheet.max_row + 1):
-                    try:
-                        # Obter valor da célula
-                        cell_value = worksheet.cell(row=row, column=col_indice).value
-                        
-                        if cell_value is not None:
-                            # Verificar se é um valor de % válido
-                            valor_percentual = self._converter_para_percentual(cell_value)
-                            
-                            if valor_percentual is not None and 0 <= valor_percentual <= 100:
-                                # Tentar obter nome do mobilizador
-                                nome_mob = self._obter_nome_mobilizador(worksheet, row)
-                                
-                                registro = {
-                                    'nome': nome_mob,
-                                    'valor_atingimento': valor_percentual,
-                                    'valor_original': cell_value,
-                                    'linha': row,
-                                    'coluna_origem': col_letra
-                                }
-                                
-                                registros.append(registro)
-                    except:
+            if not streaming:
+                return self._carregar_bloco_colunar(worksheet, plano)
+            
+            # A dimensão gravada no arquivo pode estar errada; ler até a última linha real
+            worksheet.reset_dimensions()
+            bloco = self._carregar_bloco_colunar(worksheet, plano)
+            self._limpar_celulas_mescladas(bloco, self._ler_intervalos_mesclados(worksheet))
+            return bloco
+        finally:
+            workbook.close()
+    
+    def _ler_intervalos_mesclados(self, worksheet):
+        """Lê os intervalos mesclados de uma aba aberta em modo read-only
+        
+        O modo read-only do openpyxl não expõe merged_cells, então o XML da
+        aba é varrido em pedaços procurando as tags <mergeCell>.
+        """
+        from openpyxl.utils.cell import range_boundaries
+        
+        intervalos = []
+        resto = b''
+        # _get_source é a forma como o próprio openpyxl reabre o XML da aba
+        with worksheet._get_source() as origem:
+            while True:
+                pedaco = origem.read(1024 * 1024)
+                if not pedaco:
+                    break
+                dados = resto + pedaco
+                fim_ultima = 0
+                for encontrado in _RE_CELULA_MESCLADA.finditer(dados):
+                    intervalos.append(range_boundaries(encontrado.group(1).decode('ascii')))
+                    fim_ultima = encontrado.end()
+                # Manter o final do pedaço para tags que cruzam a fronteira
+                resto = dados[max(fim_ultima, len(dados) - 256):]
+        return intervalos
+    
+    def _limpar_celulas_mescladas(self, bloco, intervalos):
+        """Esvazia as células não-âncora de intervalos mesclados
+        
+        Reproduz o modo completo do openpyxl, em que só a célula superior
+        esquerda de uma mesclagem mantém o valor.
+        """
+        for min_col, min_row, max_col, max_row in intervalos:
+            for indice in range(min_col, max_col + 1):
+                valores = bloco.get(indice)
+                if valores is None:
+                    continue
+                for linha in range(max(min_row, 2), max_row + 1):
+                    if (linha, indice) == (min_row, min_col):
                         continue
+                    posicao = linha - 2
+                    if posicao < len(valores):
+                        valores[posicao] = None
+    
+    def _carregar_bloco_colunar(self, worksheet, plano=None):
+        """Lê a aba em uma única passada e guarda apenas as colunas mapeadas
+        
+        Retorna um dict {indice_coluna: [valores a partir da linha 2]} com as
+        colunas de nome (A-D) e todas as colunas que o plano de extração consulta.
+        """
+        indices = (plano or self.plano).indices_bloco
+        max_coluna = indices[-1]
+        colunas = {indice: [] for indice in indices}
+        # Pares (coluna, posição na tupla) para evitar lookups repetidos
+        alvos = [(colunas[indice], indice - 1) for indice in indices]
+        
+        for valores in worksheet.iter_rows(min_row=2, max_col=max_coluna, values_only=True):
+            tamanho = len(valores)
+            for destino, posicao in alvos:
+                destino.append(valores[posicao] if posicao < tamanho else None)
+        
+        return colunas
+    
+    def _extrair_registros_grupo(self, bloco, plano_grupo, nomes):
+        """Extrai registros para um grupo específico
+        
+        nomes é o índice linha -> nome gerado por _indexar_nomes.
+        """
+        registros = []
+        grupo = plano_grupo.nome
+        
+        try:
+            # Buscar em todas as colunas do plano
+            for col_letra, col_indice in zip(plano_grupo.colunas_busca, plano_grupo.indices_busca):
+                registros.extend(
+                    self._registros_coluna(bloco.get(col_indice, []), col_letra, nomes)
+                )
+            
+            if plano_grupo.deduplicacao == 'nenhuma':
+                return registros
             
             # Remover duplicatas baseado no nome
             registros_unicos = {}
@@ -223,12 +588,45 @@ class AnalisadorMobilizadoresMelhorado:
             print(f"Erro ao extrair registros para {grupo}: {str(e)}")
             return []
     
+    def _registros_coluna(self, valores_coluna, col_letra, nomes, posicoes=None):
+        """Registros com % válido (0 a 100) de uma coluna do bloco
+        
+        posicoes, se informado, limita a varredura a essas linhas do bloco.
+        """
+        import numpy as np
+        
+        if posicoes is not None:
+            valores_coluna = {posicao: valores_coluna[posicao] for posicao in posicoes
+                              if posicao < len(valores_coluna)}
+            posicoes = list(valores_coluna)
+            valores_coluna = list(valores_coluna.values())
+        
+        # Converter a coluna inteira de uma vez e manter só os % válidos
+        percentuais = self._converter_coluna_para_percentual(valores_coluna)
+        posicoes_validas = np.flatnonzero((percentuais >= 0) & (percentuais <= 100))
+        
+        registros = []
+        for indice, valor_percentual in zip(posicoes_validas.tolist(),
+                                            percentuais[posicoes_validas].tolist()):
+            posicao = indice if posicoes is None else posicoes[indice]
+            cell_value = valores_coluna[indice]
+            if isinstance(cell_value, int):
+                # Células inteiras continuam inteiras, como na conversão escalar
+                valor_percentual = int(valor_percentual)
+            
+            registros.append({
+                'nome': nomes[posicao],
+                'valor_atingimento': valor_percentual,
+                'valor_original': cell_value,
+                'linha': posicao + 2,
+                'coluna_origem': col_letra
+            })
+        
+        return registros
+    
     def _converter_coluna_para_indice(self, letra_coluna):
         """Converte letra da coluna para índice numérico (A=1, B=2, etc.)"""
-        resultado = 0
-        for char in letra_coluna.upper():
-            resultado = resultado * 26 + (ord(char) - ord('A') + 1)
-        return resultado
+        return converter_coluna_para_indice(letra_coluna)
     
     def _converter_para_percentual(self, valor):
         """Converte valor para percentual"""
@@ -249,157 +647,254 @@ class AnalisadorMobilizadoresMelhorado:
             pass
         return None
     
-    def _obter_nome_mobilizador(self, worksheet, linha):
-        """Tenta obter o nome do mobilizador de várias colunas"""
-        colunas_nome = [1, 2, 3, 4]  # A, B, C, D
+    def _converter_coluna_para_percentual(self, valores):
+        """Versão vetorizada de _converter_para_percentual para uma coluna inteira
+        
+        Retorna um array float64 com NaN onde a célula não vira percentual.
+        Os valores são idênticos bit a bit aos da conversão escalar.
+        """
+        import numpy as np
+        import pandas as pd
+        
+        serie = pd.Series(valores, dtype=object)
+        brutos = np.full(len(serie), np.nan)
+        tipos = serie.map(type)
+        
+        # Números (bool é subclasse de int, como no isinstance da versão escalar)
+        numericos = tipos.isin((int, float, bool)).to_numpy()
+        if numericos.any():
+            try:
+                brutos[numericos] = serie[numericos].to_numpy(dtype=np.float64)
+            except OverflowError:
+                # Inteiro grande demais para float64: usar a conversão escalar
+                return self._converter_coluna_escalar(valores)
+        
+        # Textos ("87,5%", "0.875") se repetem muito: converter só os distintos
+        posicoes_nao_ascii = []
+        textos = (tipos == str).to_numpy()
+        if textos.any():
+            codigos, distintos = pd.factorize(serie[textos])
+            distintos = pd.Series(distintos, dtype=object)
+            # Não-ASCII fica para a conversão escalar, pois str.isdigit aceita
+            # dígitos que a regex [0-9] não cobre
+            ascii_ = distintos.str.isascii().to_numpy(dtype=bool)
+            
+            limpos = distintos[ascii_].str.replace(r'[^0-9.,]', '', regex=True)
+            so_virgula = limpos.str.contains(',', regex=False) & ~limpos.str.contains('.', regex=False)
+            limpos = limpos.where(~so_virgula, limpos.str.replace(',', '.', regex=False))
+            # Apenas o que float() aceita: dígitos com no máximo um ponto
+            validos = limpos.str.fullmatch(r'\d+\.?\d*|\.\d+').to_numpy(dtype=bool)
+            
+            convertidos = np.full(len(distintos), np.nan)
+            convertidos_ascii = np.full(len(limpos), np.nan)
+            if validos.any():
+                # O cast de texto do numpy arredonda como float(); pd.to_numeric não
+                convertidos_ascii[validos] = limpos[validos].to_numpy(dtype=str).astype(np.float64)
+            convertidos[ascii_] = convertidos_ascii
+            brutos[textos] = convertidos[codigos]
+            
+            nao_ascii = np.flatnonzero(~ascii_)
+            if len(nao_ascii):
+                posicoes_nao_ascii = np.flatnonzero(textos)[np.isin(codigos, nao_ascii)].tolist()
+        
+        # Decimal (0,875) vira percentual; acima de 1 já está em percentual
+        resultado = np.where(brutos > 1.0, brutos, brutos * 100)
+        
+        for posicao in posicoes_nao_ascii:
+            valor = self._converter_para_percentual(valores[posicao])
+            if valor is not None:
+                resultado[posicao] = valor
+        return resultado
+    
+    def _converter_coluna_escalar(self, valores):
+        """Conversão célula a célula, com o mesmo formato de saída da vetorizada"""
+        import numpy as np
+        
+        resultado = np.full(len(valores), np.nan)
+        for posicao, valor in enumerate(valores):
+            if valor is not None:
+                convertido = self._converter_para_percentual(valor)
+                if convertido is None:
+                    continue
+                try:
+                    resultado[posicao] = convertido
+                except OverflowError:
+                    # Inteiro fora do float64: fica fora de 0-100 de qualquer forma
+                    resultado[posicao] = np.inf if convertido > 0 else -np.inf
+        return resultado
+    
+    def _indexar_nomes(self, bloco):
+        """Resolve o nome do mobilizador de cada linha do bloco
+        
+        Retorna uma lista em que a posição p corresponde à linha p + 2. O
+        nome é o primeiro texto válido das colunas A-D; linhas sem nome
+        viram "Mobilizador <linha>". Com herdar_nome_mesclado, linhas cujas
+        colunas de nome estão todas vazias repetem o nome da linha de cima
+        (uma linha de totalização interrompe a herança).
+        """
+        # Todas as colunas do bloco têm o mesmo número de linhas
+        total_linhas = max((len(valores) for valores in bloco.values()), default=0)
+        colunas = [bloco.get(col) or [None] * total_linhas for col in self.COLUNAS_NOME]
         
-        for col in colunas_nome:
-            valor = worksheet.cell(row=linha, column=col).value
-            if valor and isinstance(valor, str) and len(valor.strip()) > 0:
+        # Os mesmos textos se repetem muito; cada valor distinto é limpo uma vez
+        validos = {}
+        
+        def nome_valido(valor):
+            if valor not in validos:
                 nome = valor.strip()
                 # Filtrar nomes muito genéricos
-                if len(nome) > 3 and not nome.lower() in ['total', 'soma', 'geral']:
-                    return nome
+                validos[valor] = nome if len(nome) > 3 and nome.lower() not in self.NOMES_GENERICOS else None
+            return validos[valor]
+        
+        nomes = []
+        anterior = None
+        for posicao, celulas in enumerate(zip(*colunas)):
+            nome = None
+            vazia = True
+            for valor in celulas:
+                if valor and isinstance(valor, str):
+                    nome = nome_valido(valor)
+                    if nome:
+                        break
+                    vazia = vazia and not valor.strip()
+                elif valor is not None:
+                    vazia = False
+            
+            if nome is None:
+                if self.herdar_nome_mesclado and vazia and anterior is not None:
+                    nome = anterior
+                else:
+                    anterior = None
+                    nomes.append(nome_provisorio(posicao + 2))
+                    continue
+            anterior = nome
+            nomes.append(nome)
         
-        return f"Mobilizador {linha}"
+        return nomes
     
-    def _criar_ranking(self, registros, grupo):
-        """Cria ranking baseado nos registros encontrados"""
+    def _criar_ranking(self, registros, grupo, top_k=None):
+        """Cria ranking baseado nos registros encontrados
+        
+        Com top_k, só as top_k primeiras posições são selecionadas (heap) e
+        materializadas, na mesma ordem que a ordenação completa daria.
+        """
         if not registros:
             return []
         
+        return self._formatar_ranking(self._ordenar_registros(registros, top_k))
+    
+    def _ordenar_registros(self, registros, top_k=None):
+        """Registros em ordem de ranking (maior % primeiro; empates na ordem de entrada)"""
+        if top_k is not None and top_k < len(registros):
+            # nsmallest equivale a sorted(...)[:top_k], inclusive nos empates
+            return heapq.nsmallest(top_k, registros, key=lambda x: -x['valor_atingimento'])
+        
         # Ordenar por valor de atingimento (decrescente)
-        registros_ordenados = sorted(
+        return sorted(
             registros, 
             key=lambda x: x['valor_atingimento'], 
             reverse=True
         )
-        
-        # Criar ranking
+    
+    def _formatar_ranking(self, registros_ordenados):
+        """Monta os itens do ranking a partir dos registros já ordenados"""
         ranking = []
         for i, reg in enumerate(registros_ordenados, 1):
             ranking.append({
                 'posicao': i,
                 'nome': reg['nome'],
                 'atingimento_percentual': round(reg['valor_atingimento'], 2),
-                'valor_original': reg['valor_original']
+                'valor_original': reg['valor_original'],
+                'linha': reg['linha'],
+                'coluna_origem': reg['coluna_origem']
             })
         
         return ranking
     
-    def gerar_imagem_ranking(self, grupo):
-        """Gera imagem PNG do ranking usando matplotlib"""
-        try:
-            import matplotlib.pyplot as plt
-            import seaborn as sns
-            import matplotlib.patches as patches
-            
-            # Configurar matplotlib para não-interactive mode
-            plt.switch_backend('Agg')
-            plt.style.use('seaborn-v0_8')
-            sns.set_palette("husl")
-            
-            # Cores do Banco do Brasil
-            cores_bb = {
-                'primaria': '#1e3a8a',      # Azul BB
-                'secundaria': '#3b82f6',    # Azul claro
-                'destaque': '#fbbf24',      # Amarelo BB
-                'fundo': '#f8fafc',         # Cinza claro
-                'texto': '#1f2937',         # Cinza escuro
-                'alternativa': '#10b981'    # Verde
+    def _resultado_grupo(self, plano_grupo, ranking, total_registros=None):
+        """Dados de um grupo no formato de resultado['rankings']"""
+        if ranking:
+            return {
+                'total_registros': len(ranking) if total_registros is None else total_registros,
+                'ranking': ranking,
+                'campos_utilizados': list(plano_grupo.colunas_busca)
             }
-            
-            # Configurar figura
-            fig, ax = plt.subplots(figsize=(12, 8))
-            fig.patch.set_facecolor(cores_bb['fundo'])
-            
-            # Título
-            ax.text(0.5, 0.95, f'Ranking - {grupo}', 
-                   horizontalalignment='center', verticalalignment='center',
-                   fontsize=16, fontweight='bold', color=cores_bb['primaria'],
-                   transform=ax.transAxes)
-            
-            # Adicionar informações do sistema
-            ax.text(0.5, 0.90, f'Critério: % de Atingimento | Gerado em: {datetime.now().strftime("%d/%m/%Y %H:%M")}', 
-                   horizontalalignment='center', verticalalignment='center',
-                   fontsize=10, color=cores_bb['texto'],
-                   transform=ax.transAxes)
-            
-            # Nota de correção aplicada
-            if 'Agro' in grupo or 'Regulariza' in grupo:
-                ax.text(0.5, 0.86, '✅ Mapeamento corrigido para capturar todos os registros', 
-                       horizontalalignment='center', verticalalignment='center',
-                       fontsize=9, color=cores_bb['alternativa'],
-                       transform=ax.transAxes)
-            
-            # Obter dados do ranking
-            resultado = self.processar_planilha_minimal()
-            dados_grupo = resultado.get(grupo, {})
-            ranking = dados_grupo.get('ranking', [])
-            
-            if not ranking:
-                ax.text(0.5, 0.5, 'Nenhum dado disponível para este grupo', 
-                       horizontalalignment='center', verticalalignment='center',
-                       fontsize=12, color=cores_bb['texto'],
-                       transform=ax.transAxes)
-            else:
-                # Preparar dados para o gráfico
-                nomes = [item['nome'][:25] + '...' if len(item['nome']) > 25 else item['nome'] for item in ranking[:10]]
-                valores = [item['atingimento_percentual'] for item in ranking[:10]]
-                total_registros = dados_grupo.get('total_registros', len(ranking))
-                
-                # Criar gráfico de barras horizontal
-                cores_barras = [cores_bb['secundaria'] if i % 2 == 0 else cores_bb['alternativa'] 
-                              for i in range(len(valores))]
-                
-                barras = ax.barh(range(len(nomes)), valores, color=cores_barras, alpha=0.8)
-                
-                # Personalizar eixos
-                ax.set_yticks(range(len(nomes)))
-                ax.set_yticklabels([f"{i+1}. {nome}" for i, nome in enumerate(nomes)])
-                ax.set_xlabel('% de Atingimento', fontsize=12, color=cores_bb['texto'])
-                
-                # Adicionar valores nas barras
-                for i, (barra, valor) in enumerate(zip(barras, valores)):
-                    ax.text(valor + 1, i, f'{valor:.1f}%', 
-                           va='center', ha='left', fontweight='bold', color=cores_bb['texto'])
-                
-                # Configurar limites e grid
-                ax.set_xlim(0, max(valores) + 10 if valores else 100)
-                ax.grid(True, alpha=0.3, axis='x')
-                
-                # Inverter ordem para mostrar maior no topo
-                ax.invert_yaxis()
-                
-                # Adicionar informações adicionais
-                ax.text(0.02, 0.02, f'Total de registros: {total_registros}', 
-                       transform=ax.transAxes, fontsize=10, 
-                       color=cores_bb['texto'], alpha=0.7)
-            
-            # Remover bordas desnecessárias
-            ax.spines['top'].set_visible(False)
-            ax.spines['right'].set_visible(False)
-            
-            # Salvar em bytes
-            img_buffer = io.BytesIO()
-            plt.tight_layout()
-            plt.savefig(img_buffer, format='png', dpi=300, bbox_inches='tight')
-            plt.close(fig)
-            
-            return img_buffer.getvalue()
-            
+        return {
+            'total_registros': 0,
+            'ranking': [],
+            'mensagem': 'Nenhum registro encontrado'
+        }
+    
+    def gerar_imagem_ranking(self, grupo, resultado, dpi=graficos.DPI_PADRAO,
+                             largura=graficos.TAMANHO_PADRAO[0], altura=graficos.TAMANHO_PADRAO[1]):
+        """Gera imagem PNG do ranking usando matplotlib
+        
+        resultado é o dict retornado por processar_planilha (ou guardado
+        no armazém de análises); a planilha não é lida de novo.
+        dpi e largura/altura (polegadas) permitem gerar miniaturas baratas.
+        """
+        try:
+            return graficos.renderizar_ranking_png(grupo, resultado, dpi, largura, altura)
         except Exception as e:
             print(f"Erro ao gerar imagem: {str(e)}")
             return None
+
+def _processar_grupo_em_processo(bloco, plano_grupo, nomes, top_k=None):
+    """Ponto de entrada do modo 'processos' (precisa ser função de módulo)"""
+    return AnalisadorMobilizadoresMelhorado()._processar_grupo_medido(bloco, plano_grupo, nomes, top_k)
+
+def _consolidar_linha_de_comando(argumentos):
+    """python analise_melhorada.py consolidar planilha1.xlsx planilha2.xlsx ..."""
+    import argparse
+    from consolidacao import consolidar_planilhas
+    from plano_extracao import carregar_mapeamento
+    
+    parser = argparse.ArgumentParser(prog='analise_melhorada.py consolidar',
+                                     description='Ranking regional a partir de várias planilhas')
+    parser.add_argument('planilhas', nargs='+', help='Relatórios 6500 (.xlsx)')
+    parser.add_argument('--top-k', type=int, help='Posições por grupo (padrão: todas)')
+    parser.add_argument('--workers', type=int, help='Processos de leitura (padrão: núcleos)')
+    parser.add_argument('--modo-leitura', default='completo',
+                        choices=AnalisadorMobilizadoresMelhorado.MODOS_LEITURA)
+    parser.add_argument('--mapeamento', help='Arquivo JSON com o mapeamento de colunas')
+    parser.add_argument('--herdar-nome-mesclado', action='store_true')
+    parser.add_argument('--saida', help='Grava o resultado completo em JSON')
+    args = parser.parse_args(argumentos)
     
-    def processar_planilha_minimal(self):
-        """Versão simplificada para obter apenas dados estruturados"""
-        # Implementação simplificada - na prática, isso seria uma versão cacheada
-        # dos dados processados mais recentemente
-        return {}
+    resultado = consolidar_planilhas(
+        args.planilhas,
+        mapeamento_colunas=carregar_mapeamento(args.mapeamento) if args.mapeamento else None,
+        herdar_nome_mesclado=args.herdar_nome_mesclado,
+        modo_leitura=args.modo_leitura,
+        workers=args.workers,
+        top_k=args.top_k
+    )
+    
+    for arquivo in resultado['consolidacao']['arquivos']:
+        if not arquivo['sucesso']:
+            print(f"⚠️ {arquivo['arquivo']}: {arquivo['erro']}")
+    if not resultado['sucesso']:
+        print(f"❌ ERRO: {resultado['erro']}")
+        return 1
+    
+    for grupo, dados in resultado['rankings'].items():
+        print(f"\n📊 {grupo} ({dados['total_registros']} registros)")
+        for item in dados['ranking'][:5]:
+            print(f"      {item['posicao']}. {item['nome']}: {item['atingimento_percentual']:.2f}% ({item['arquivo']})")
+    
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as arquivo:
+            json.dump(resultado, arquivo, ensure_ascii=False, indent=2, default=str)
+        print(f"\n✅ Resultado gravado em {args.saida}")
+    return 0
 
 # Função para execução independente
 if __name__ == "__main__":
+    import sys
+    
+    if sys.argv[1:2] == ['consolidar']:
+        sys.exit(_consolidar_linha_de_comando(sys.argv[2:]))
+    
     analisador = AnalisadorMobilizadoresMelhorado()
     
     # Teste com planilha local se existir
@@ -5,32 +5,575 @@ Sistema de Análise de Mobilizadores - Banco do Brasil
 API Flask com interface web para análise de rankings
 """
 
-from flask import Flask, request, jsonify, render_template, send_file
+import time
+
+# Início da importação do app, para medir a inicialização
+_INICIO_IMPORTACAO = time.perf_counter()
+
+from flask import Flask, Request, request, jsonify, render_template, send_file, Response, stream_with_context, g
 from analise_melhorada import AnalisadorMobilizadoresMelhorado
+from consolidacao import consolidar_planilhas
+from plano_extracao import carregar_mapeamento
+from cache import CacheLRU, CacheResultados
+import graficos
+from armazenamento import ArmazemAnalises, ArmazemHistorico, ArmazemJobs
+import registros_colunares
+from metricas import Medicao, RegistroMetricas
+from perfil import Perfilador, PerfilOcupado
+from upload import MENSAGENS_FORMATO, PlanilhaRecebida
 import os
 import io
+import tempfile
+import json
+import queue
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import base64
-from datetime import datetime
+import hmac
+from datetime import datetime, timedelta
 import logging
 
+class RequisicaoUploads(Request):
+    """Request cujos uploads são gravados em UPLOADS_DIR
+    
+    O Werkzeug guarda cada arquivo em um SpooledTemporaryFile, que vai
+    para disco (no diretório temporário do sistema) quando passa de 500 KB
+    ou quando alguém pede o fileno(), como PlanilhaRecebida.receber. Aqui o
+    spool já nasce apontando para UPLOADS_DIR, então o arquivo mapeado é
+    o próprio spool do upload, sem cópia. Na consolidação cada arquivo vai
+    direto para um temporário com nome, que os processos de leitura abrem
+    pelo caminho.
+    """
+    
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        diretorio = app.config['UPLOADS_DIR']
+        if self.endpoint == 'consolidar':
+            return tempfile.NamedTemporaryFile(mode='w+b', suffix='.xlsx', dir=diretorio)
+        if not diretorio:
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        return tempfile.SpooledTemporaryFile(max_size=500 * 1024, mode='rb+', dir=diretorio)
+
 app = Flask(__name__)
+app.request_class = RequisicaoUploads
 app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB
+# Onde os uploads vão para disco antes do mmap (padrão: diretório temporário do sistema)
+app.config['UPLOADS_DIR'] = os.environ.get('UPLOADS_DIR')
+# 'completo' ou 'streaming' (read-only, memória limitada para arquivos grandes)
+app.config['MODO_LEITURA'] = os.environ.get('MODO_LEITURA', 'completo')
+# Extração dos grupos: 'serial', 'threads' ou 'processos'
+app.config['MODO_EXECUCAO'] = os.environ.get('MODO_EXECUCAO', 'serial')
+app.config['EXECUCAO_WORKERS'] = int(os.environ.get('EXECUCAO_WORKERS', 0)) or None
+# Arquivo JSON com o mapeamento de colunas (padrão: mapeamento embutido no analisador)
+app.config['MAPEAMENTO_COLUNAS'] = os.environ.get('MAPEAMENTO_COLUNAS')
+# Linhas com o nome em branco (células mescladas) herdam o nome da linha de cima
+app.config['HERDAR_NOME_MESCLADO'] = os.environ.get('HERDAR_NOME_MESCLADO', '0') == '1'
+# Cache de resultados por conteúdo do upload (CACHE_DIR ativa a camada em disco)
+app.config['CACHE_MAX_ITENS'] = int(os.environ.get('CACHE_MAX_ITENS', 64))
+app.config['CACHE_MAX_MB'] = int(os.environ.get('CACHE_MAX_MB', 256))
+app.config['CACHE_TTL'] = int(os.environ.get('CACHE_TTL', 3600))
+app.config['CACHE_DIR'] = os.environ.get('CACHE_DIR')
+# Limites da camada em disco (padrão: os mesmos da memória)
+app.config['CACHE_DISCO_MAX_ITENS'] = int(os.environ.get('CACHE_DISCO_MAX_ITENS', 0)) or None
+app.config['CACHE_DISCO_MAX_MB'] = int(os.environ.get('CACHE_DISCO_MAX_MB', 0)) or None
+# Análises guardadas para download (SQLite compartilhado entre workers)
+app.config['ANALISES_DB'] = os.environ.get('ANALISES_DB')
+app.config['ANALISES_MAX'] = int(os.environ.get('ANALISES_MAX', 200))
+app.config['ANALISES_TTL'] = int(os.environ.get('ANALISES_TTL', 24 * 3600))
+# Jobs de análise assíncrona executados por threads locais (sem broker externo)
+app.config['JOBS_WORKERS'] = int(os.environ.get('JOBS_WORKERS', 2))
+# Intervalo das linhas de progresso do NDJSON enquanto nenhum grupo termina (proxies
+# como o do Heroku derrubam respostas que ficam 55 s sem enviar nada)
+app.config['NDJSON_KEEPALIVE_S'] = float(os.environ.get('NDJSON_KEEPALIVE_S', 10))
+# Cache dos PNGs renderizados por (análise, grupo, opções de renderização)
+app.config['IMAGENS_MAX_ITENS'] = int(os.environ.get('IMAGENS_MAX_ITENS', 128))
+app.config['IMAGENS_MAX_MB'] = int(os.environ.get('IMAGENS_MAX_MB', 64))
+# Registros extraídos de cada análise em Arrow IPC, para tendências de vários dias
+# (por padrão, 31 dias e até 2000 arquivos: cobre o mês corrente com folga)
+app.config['REGISTROS_DIR'] = os.environ.get(
+    'REGISTROS_DIR', os.path.join(tempfile.gettempdir(), 'registros_mobilizadores')
+)
+app.config['REGISTROS_MAX'] = int(os.environ.get('REGISTROS_MAX', 2000))
+app.config['REGISTROS_TTL'] = int(os.environ.get('REGISTROS_TTL', 31 * 24 * 3600))
+# Histórico diário dos rankings (SQLite próprio, sem expiração)
+app.config['HISTORICO_DB'] = os.environ.get(
+    'HISTORICO_DB', os.path.join(tempfile.gettempdir(), 'historico_mobilizadores.sqlite3')
+)
+# Estados de reanálise incremental guardados na memória de cada worker
+app.config['ESTADOS_INCREMENTAIS'] = int(os.environ.get('ESTADOS_INCREMENTAIS', 4))
+app.config['ESTADOS_INCREMENTAIS_MB'] = int(os.environ.get('ESTADOS_INCREMENTAIS_MB', 256))
+# Amostras de métricas de cada worker, somadas em /api/metrics (zerado ao subir o servidor)
+app.config['METRICAS_DIR'] = os.environ.get(
+    'METRICAS_DIR', os.path.join(tempfile.gettempdir(), 'metricas_mobilizadores')
+)
+# Perfil (cProfile) sob demanda: só com o segredo no header X-Perfil (nunca na URL,
+# que vai para o access log)
+app.config['PERFIL_SEGREDO'] = os.environ.get('PERFIL_SEGREDO')
+app.config['PERFIS_DIR'] = os.environ.get(
+    'PERFIS_DIR', os.path.join(tempfile.gettempdir(), 'perfis_mobilizadores')
+)
+app.config['PERFIS_MAX'] = int(os.environ.get('PERFIS_MAX', 20))
+# Consolidação de várias planilhas: limite de arquivos por chamada e processos de leitura
+app.config['CONSOLIDACAO_MAX_ARQUIVOS'] = int(os.environ.get('CONSOLIDACAO_MAX_ARQUIVOS', 50))
+app.config['CONSOLIDACAO_WORKERS'] = int(os.environ.get('CONSOLIDACAO_WORKERS', min(os.cpu_count() or 1, 4)))
+# Processos usados na exportação em lote (1 = renderizar no próprio worker)
+app.config['EXPORTACAO_WORKERS'] = int(os.environ.get('EXPORTACAO_WORKERS', min(os.cpu_count() or 1, 4)))
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Instância global do analisador
-analisador = AnalisadorMobilizadoresMelhorado()
+analisador = AnalisadorMobilizadoresMelhorado(
+    modo_leitura=app.config['MODO_LEITURA'],
+    modo_execucao=app.config['MODO_EXECUCAO'],
+    workers=app.config['EXECUCAO_WORKERS'],
+    herdar_nome_mesclado=app.config['HERDAR_NOME_MESCLADO'],
+    mapeamento_colunas=carregar_mapeamento(app.config['MAPEAMENTO_COLUNAS'])
+    if app.config['MAPEAMENTO_COLUNAS'] else None
+)
+
+# Cache global de resultados
+cache_resultados = CacheResultados(
+    max_itens=app.config['CACHE_MAX_ITENS'],
+    max_bytes=app.config['CACHE_MAX_MB'] * 1024 * 1024,
+    ttl_segundos=app.config['CACHE_TTL'],
+    diretorio=app.config['CACHE_DIR'],
+    max_itens_disco=app.config['CACHE_DISCO_MAX_ITENS'],
+    max_bytes_disco=app.config['CACHE_DISCO_MAX_MB'] * 1024 * 1024 if app.config['CACHE_DISCO_MAX_MB'] else None
+)
+
+# Análises concluídas, consultadas pelos downloads
+armazem_analises = ArmazemAnalises(
+    caminho=app.config['ANALISES_DB'],
+    max_itens=app.config['ANALISES_MAX'],
+    ttl_segundos=app.config['ANALISES_TTL']
+)
+
+# Estado dos jobs assíncronos (mesmo SQLite das análises)
+armazem_jobs = ArmazemJobs(
+    caminho=app.config['ANALISES_DB'],
+    ttl_segundos=app.config['ANALISES_TTL']
+)
+# Rankings por data, para as consultas de evolução
+armazem_historico = ArmazemHistorico(caminho=app.config['HISTORICO_DB'])
+
+# Tempos, contagens e memória das análises, somados entre os workers (/api/metrics)
+metricas = RegistroMetricas(app.config['METRICAS_DIR'])
+
+# Perfis das requisições que pediram profiling
+perfilador = Perfilador(app.config['PERFIS_DIR'], max_perfis=app.config['PERFIS_MAX'])
+
+executor_jobs = ThreadPoolExecutor(max_workers=app.config['JOBS_WORKERS'])
+
+# PNGs já renderizados
+cache_imagens = CacheLRU(
+    max_itens=app.config['IMAGENS_MAX_ITENS'],
+    max_bytes=app.config['IMAGENS_MAX_MB'] * 1024 * 1024,
+    ttl_segundos=app.config['ANALISES_TTL']
+)
+
+# Base das reanálises incrementais, por analise_id (planilha e rankings ordenados)
+estados_incrementais = CacheLRU(
+    max_itens=app.config['ESTADOS_INCREMENTAIS'],
+    max_bytes=app.config['ESTADOS_INCREMENTAIS_MB'] * 1024 * 1024,
+    ttl_segundos=app.config['ANALISES_TTL']
+)
+
+# Pool de renderização da exportação em lote, criado no primeiro uso
+_executor_exportacao = None
+
+def _obter_executor_exportacao():
+    global _executor_exportacao
+    if _executor_exportacao is None and app.config['EXPORTACAO_WORKERS'] > 1:
+        # 'spawn' evita herdar threads e locks do servidor via fork
+        _executor_exportacao = ProcessPoolExecutor(
+            max_workers=app.config['EXPORTACAO_WORKERS'],
+            mp_context=multiprocessing.get_context('spawn')
+        )
+    return _executor_exportacao
+
+# Pool de leitura da consolidação, criado no primeiro uso
+_executor_consolidacao = None
+
+def _obter_executor_consolidacao():
+    global _executor_consolidacao
+    if _executor_consolidacao is None and app.config['CONSOLIDACAO_WORKERS'] > 1:
+        _executor_consolidacao = ProcessPoolExecutor(
+            max_workers=app.config['CONSOLIDACAO_WORKERS'],
+            mp_context=multiprocessing.get_context('spawn')
+        )
+    return _executor_consolidacao
+
+def _opcoes_renderizacao(args):
+    """Lê dpi/largura/altura da query string; levanta ValueError se inválidos"""
+    dpi = int(args.get('dpi', graficos.DPI_PADRAO))
+    largura = float(args.get('largura', graficos.TAMANHO_PADRAO[0]))
+    altura = float(args.get('altura', graficos.TAMANHO_PADRAO[1]))
+    
+    if not graficos.DPI_MINIMO <= dpi <= graficos.DPI_MAXIMO:
+        raise ValueError(f'dpi deve estar entre {graficos.DPI_MINIMO} e {graficos.DPI_MAXIMO}')
+    for medida in (largura, altura):
+        if not graficos.TAMANHO_MINIMO <= medida <= graficos.TAMANHO_MAXIMO:
+            raise ValueError(f'largura e altura devem estar entre {graficos.TAMANHO_MINIMO} '
+                             f'e {graficos.TAMANHO_MAXIMO} polegadas')
+    return dpi, largura, altura
+
+def _opcoes_paginacao(args):
+    """Lê offset/limit (top_k é sinônimo de limit); levanta ValueError se inválidos
+    
+    Retorna (offset, limit), com limit None quando não foi pedido (ranking
+    inteiro a partir de offset).
+    """
+    offset = int(args.get('offset', 0))
+    limit = args.get('limit') or args.get('top_k')
+    limit = int(limit) if limit else None
+    
+    if offset < 0:
+        raise ValueError('offset não pode ser negativo')
+    if limit is not None and limit < 1:
+        raise ValueError('limit/top_k deve ser maior que zero')
+    return offset, limit
+
+def _paginar_grupo(dados_grupo, offset, limit):
+    """Recorta o ranking de um grupo em [offset, offset + limit) (sem limit, até o fim)"""
+    if limit is None and not offset:
+        return dados_grupo
+    dados_grupo = dict(dados_grupo)
+    fim = None if limit is None else offset + limit
+    dados_grupo['ranking'] = dados_grupo['ranking'][offset:fim]
+    dados_grupo['paginacao'] = {'offset': offset, 'limit': limit}
+    return dados_grupo
+
+def _paginar_rankings(resultado, offset, limit):
+    """Recorta o ranking de cada grupo em [offset, offset + limit) (sem limit, até o fim)"""
+    if limit is None and not offset:
+        return resultado
+    rankings = {
+        grupo: _paginar_grupo(dados_grupo, offset, limit)
+        for grupo, dados_grupo in resultado['rankings'].items()
+    }
+    return dict(resultado, rankings=rankings)
+
+def aquecer():
+    """Prepara o processo para atender o primeiro upload sem atraso
+    
+    Importa numpy/pandas/openpyxl e pyarrow processando uma planilha mínima
+    em memória (pelo plano já compilado), configura o matplotlib e
+    renderiza um PNG pequeno. Nada é guardado em cache ou histórico.
+    Chamado pelo gunicorn no processo mestre (gunicorn.conf.py), antes do
+    fork, para que todos os workers já nasçam aquecidos; com AQUECER=1,
+    roda na importação do app.
+    """
+    import openpyxl
+    
+    inicio = time.perf_counter()
+    plano = analisador.plano
+    max_coluna = plano.indices_bloco[-1]
+    workbook = openpyxl.Workbook(write_only=True)
+    worksheet = workbook.create_sheet('Aquecimento')
+    worksheet.append(['Mobilizador'] + [None] * (max_coluna - 1))
+    for linha, valor in enumerate((0.875, 92.5, '87,5%', None), 1):
+        worksheet.append([f'Aquecimento {linha}'] + [valor] * (max_coluna - 1))
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    
+    buffer.seek(0)
+    bloco = analisador._ler_planilha(buffer, analisador.modo_leitura, plano)
+    # Serial: um pool de processos criado no mestre não sobreviveria ao fork
+    resultado = {
+        'sucesso': True,
+        'rankings': analisador._processar_grupos(bloco, modo_execucao='serial', plano=plano),
+        'timestamp': datetime.now().isoformat(),
+    }
+    registros_colunares.tabela_registros(resultado, '0' * 32)
+    _inicializacao['aquecimento_parser_s'] = time.perf_counter() - inicio
+    
+    inicio = time.perf_counter()
+    graficos.preparar_graficos()
+    graficos.renderizar_ranking_png(plano.grupos[0].nome, resultado, graficos.DPI_MINIMO,
+                                    graficos.TAMANHO_MINIMO, graficos.TAMANHO_MINIMO)
+    _inicializacao['aquecimento_graficos_s'] = time.perf_counter() - inicio
+    _inicializacao['aquecido'] = True
+    logger.info(f"Aquecimento concluído: parser {_inicializacao['aquecimento_parser_s']:.2f}s, "
+                f"gráficos {_inicializacao['aquecimento_graficos_s']:.2f}s")
+
+@app.before_request
+def _marcar_inicio():
+    g.inicio_requisicao = time.perf_counter()
+
+@app.after_request
+def _registrar_primeira_requisicao(resposta):
+    """Guarda a latência da primeira requisição de cada endpoint deste worker"""
+    endpoint = request.endpoint
+    if endpoint and endpoint not in _inicializacao['primeiras_requisicoes_s'] and 'inicio_requisicao' in g:
+        duracao = time.perf_counter() - g.inicio_requisicao
+        _inicializacao['primeiras_requisicoes_s'][endpoint] = duracao
+        logger.info(f"Primeira requisição a {endpoint} neste worker (pid {os.getpid()}): {duracao:.2f}s")
+    return resposta
+
+def _perfil_solicitado():
+    """A requisição pediu perfil e trouxe o segredo configurado
+    
+    Sem PERFIL_SEGREDO o hook fica desligado e nada é lido da requisição.
+    O segredo só é aceito no header: na query string ele iria para o
+    access log do gunicorn junto com a linha da requisição.
+    """
+    segredo = app.config['PERFIL_SEGREDO']
+    if not segredo:
+        return False
+    enviado = request.headers.get('X-Perfil')
+    return bool(enviado) and hmac.compare_digest(enviado.encode('utf-8'), segredo.encode('utf-8'))
 
 @app.route('/')
 def index():
     """Página principal com interface de upload"""
     return render_template('index.html')
 
+def _analisar_conteudo(planilha, modo_leitura=None, progresso=None, incremental=False,
+                       analise_anterior=None, top_k=None, medicao=None, ignorar_cache=False):
+    """Processa uma planilha recebida passando pelo cache e guarda a análise
+    
+    planilha é uma PlanilhaRecebida: o hash do cache e a leitura usam o
+    mesmo buffer mapeado, sem copiar o arquivo.
+    
+    Com top_k só as top_k primeiras posições de cada grupo são calculadas e
+    guardadas; o ranking completo só é montado quando pedido sem top_k.
+    Os tempos de cada etapa vão para medicao (criada aqui se não for
+    informada) e são agregados em /api/metrics. ignorar_cache força o
+    processamento mesmo que o arquivo já esteja no cache.
+    """
+    if medicao is None:
+        medicao = Medicao()
+    situacao = 'erro'
+    try:
+        if incremental:
+            resultado = _analisar_incremental(planilha, modo_leitura, progresso, analise_anterior, medicao)
+        else:
+            resultado = _analisar_com_cache(planilha, modo_leitura, progresso, top_k, medicao, ignorar_cache)
+        if resultado['sucesso']:
+            situacao = 'cache' if resultado['cache_hit'] else 'sucesso'
+        return resultado
+    finally:
+        metricas.registrar(medicao, situacao)
+
+def _analisar_com_cache(planilha, modo_leitura, progresso, top_k, medicao, ignorar_cache=False):
+    # Reenvios do mesmo arquivo são atendidos pelo cache
+    with medicao.etapa('cache'):
+        assinatura = analisador.assinatura_mapeamento()
+        if top_k is not None:
+            assinatura += f'|top_k={top_k}'
+        chave_cache = cache_resultados.gerar_chave(planilha.buffer, assinatura)
+        resultado = None if ignorar_cache else cache_resultados.obter(chave_cache)
+    cache_hit = resultado is not None
+    
+    if not cache_hit:
+        # Processar o arquivo
+        with planilha.abrir() as leitor:
+            resultado = analisador.processar_planilha(
+                leitor, modo_leitura=modo_leitura, progresso=progresso, top_k=top_k, medicao=medicao
+            )
+        if resultado['sucesso']:
+            with medicao.etapa('cache'):
+                cache_resultados.guardar(chave_cache, resultado)
+    elif progresso:
+        for grupo, dados_grupo in resultado['rankings'].items():
+            progresso(grupo, dados_grupo)
+    
+    if resultado['sucesso']:
+        with medicao.etapa('armazenamento'):
+            # Cache hit: o upload já entrou no histórico quando foi processado
+            resultado['analise_id'] = _guardar_analise(
+                resultado, historico=not cache_hit, registros=not cache_hit, chave_upload=chave_cache
+            )
+        resultado['cache_hit'] = cache_hit
+    return resultado
+
+def _guardar_analise(resultado, historico=True, registros=True, chave_upload=None):
+    """Guarda a análise para os downloads e alimenta os históricos
+    
+    historico=False não mexe no ranking diário (consolidações, que não
+    entram no ranking do dia, e cache hits, já gravados). chave_upload
+    identifica o upload no histórico: reprocessar o mesmo arquivo no mesmo
+    dia substitui só as linhas dele. registros=False não grava o arquivo
+    colunar (cache hits: o arquivo já foi gravado na primeira análise e
+    /api/registros o gera sob demanda se for pedido). Análises com top_k
+    não entram no histórico nem geram o arquivo colunar.
+    """
+    analise_id = armazem_analises.guardar(resultado)
+    completa = resultado.get('top_k') is None
+    # Os históricos são extras: falhar aqui não derruba a análise
+    try:
+        if historico and completa:
+            armazem_historico.guardar(resultado, analise_id, chave_upload)
+    except Exception as e:
+        logger.warning(f"Histórico não gravado para {analise_id}: {str(e)}")
+    try:
+        if registros and completa:
+            _gravar_registros(resultado, analise_id)
+    except Exception as e:
+        logger.warning(f"Registros colunares não gravados para {analise_id}: {str(e)}")
+    return analise_id
+
+def _gravar_registros(resultado, analise_id):
+    """Grava o arquivo colunar e poda o diretório (REGISTROS_MAX/REGISTROS_TTL)"""
+    caminho = registros_colunares.gravar_registros(resultado, analise_id, app.config['REGISTROS_DIR'])
+    registros_colunares.podar_registros(
+        app.config['REGISTROS_DIR'], app.config['REGISTROS_MAX'], app.config['REGISTROS_TTL']
+    )
+    return caminho
+
+def _analisar_incremental(planilha, modo_leitura=None, progresso=None, analise_anterior=None, medicao=None):
+    """Reanálise que parte da análise anterior e só recalcula o que mudou
+    
+    A base fica na memória do worker que fez a análise anterior; em outro
+    worker (ou após expirar) tudo é recalculado, mas a movimentação no
+    ranking continua vindo da análise guardada.
+    """
+    if medicao is None:
+        medicao = Medicao()
+    resultado_anterior = armazem_analises.obter(analise_anterior) if analise_anterior else None
+    estado = estados_incrementais.remover(analise_anterior) if analise_anterior else None
+    
+    with planilha.abrir() as leitor:
+        resultado, estado = analisador.processar_incremental(
+            leitor, estado, resultado_anterior,
+            modo_leitura=modo_leitura, progresso=progresso, medicao=medicao
+        )
+    
+    if resultado['sucesso']:
+        with medicao.etapa('armazenamento'):
+            chave_upload = cache_resultados.gerar_chave(planilha.buffer, analisador.assinatura_mapeamento())
+            resultado['analise_id'] = _guardar_analise(resultado, chave_upload=chave_upload)
+        resultado['cache_hit'] = False
+        estados_incrementais.guardar(resultado['analise_id'], estado, estado.tamanho_aproximado())
+    return resultado
+
+def _executar_job(job_id, planilha, modo_leitura, incremental=False, analise_anterior=None,
+                  top_k=None):
+    """Roda a análise de um job em segundo plano, registrando o progresso
+    
+    O job passa a ser dono da planilha e a fecha ao terminar.
+    """
+    try:
+        armazem_jobs.atualizar(job_id, status='processando')
+        resultado = _analisar_conteudo(
+            planilha, modo_leitura,
+            progresso=lambda grupo, _: armazem_jobs.atualizar(job_id, grupo_concluido=grupo),
+            incremental=incremental, analise_anterior=analise_anterior, top_k=top_k
+        )
+        if resultado['sucesso']:
+            armazem_jobs.atualizar(job_id, status='concluido', analise_id=resultado['analise_id'])
+        else:
+            armazem_jobs.atualizar(job_id, status='erro', erro=resultado.get('erro', 'Erro desconhecido'))
+    except Exception as e:
+        logger.error(f"Erro no job {job_id}: {str(e)}")
+        armazem_jobs.atualizar(job_id, status='erro', erro=f'Erro interno: {str(e)}')
+    finally:
+        planilha.fechar()
+
+def _linha_ndjson(evento):
+    return json.dumps(evento, ensure_ascii=False) + '\n'
+
+def _transmitir_analise(planilha, modo_leitura, incremental, analise_anterior, top_k, offset, limit):
+    """Resposta NDJSON: uma linha por grupo, enviada assim que o grupo termina
+    
+    Linhas: {"tipo": "inicio", "grupos": [...]}, depois
+    {"tipo": "grupo", "grupo": ..., "dados": {...}} na ordem em que os
+    grupos terminam e, por fim, {"tipo": "fim", "analise_id": ...,
+    "timestamp": ..., "cache_hit": ...} ou {"tipo": "erro", "erro": ...}.
+    Enquanto nada termina (a leitura da planilha vem antes do primeiro
+    grupo) sai a cada NDJSON_KEEPALIVE_S uma linha {"tipo": "progresso",
+    "grupos_concluidos": n, "decorrido_s": ...}, para a conexão não ficar
+    ociosa até o timeout da plataforma.
+    Em modo debug a linha "fim" também traz as métricas da análise.
+    A thread da análise passa a ser dona da planilha e a fecha ao terminar.
+    """
+    eventos = queue.Queue()
+    medicao = Medicao()
+    
+    def executar():
+        try:
+            resultado = _analisar_conteudo(
+                planilha, modo_leitura,
+                progresso=lambda grupo, dados_grupo: eventos.put(('grupo', grupo, dados_grupo)),
+                incremental=incremental, analise_anterior=analise_anterior, top_k=top_k,
+                medicao=medicao
+            )
+            eventos.put(('fim', resultado, None))
+        except Exception as e:
+            logger.error(f"Erro na análise transmitida: {str(e)}")
+            eventos.put(('fim', {'sucesso': False, 'erro': f'Erro interno: {str(e)}'}, None))
+        finally:
+            planilha.fechar()
+    
+    # A análise roda em paralelo à resposta; se o cliente desconectar ela
+    # termina mesmo assim e fica guardada
+    threading.Thread(target=executar, daemon=True).start()
+    grupos = [plano_grupo.nome for plano_grupo in analisador.plano.grupos]
+    
+    def gerar():
+        inicio = time.perf_counter()
+        concluidos = 0
+        yield _linha_ndjson({'tipo': 'inicio', 'grupos': grupos})
+        while True:
+            try:
+                tipo, valor, dados_grupo = eventos.get(timeout=app.config['NDJSON_KEEPALIVE_S'])
+            except queue.Empty:
+                yield _linha_ndjson({
+                    'tipo': 'progresso', 'grupos_concluidos': concluidos,
+                    'decorrido_s': round(time.perf_counter() - inicio, 1)
+                })
+                continue
+            if tipo == 'grupo':
+                concluidos += 1
+                yield _linha_ndjson({
+                    'tipo': 'grupo', 'grupo': valor, 'dados': _paginar_grupo(dados_grupo, offset, limit)
+                })
+                continue
+            
+            resultado = valor
+            if resultado['sucesso']:
+                fim = {'tipo': 'fim'}
+                for campo in ('analise_id', 'timestamp', 'cache_hit', 'incremental'):
+                    if campo in resultado:
+                        fim[campo] = resultado[campo]
+                if app.debug:
+                    fim['metricas'] = medicao.resumo()
+                yield _linha_ndjson(fim)
+            else:
+                yield _linha_ndjson({'tipo': 'erro', 'erro': resultado.get('erro', 'Erro desconhecido')})
+            return
+    
+    return Response(stream_with_context(gerar()), mimetype='application/x-ndjson')
+
 @app.route('/api/analisar', methods=['POST'])
 def analisar_planilha():
-    """Endpoint para análise da planilha"""
+    """Endpoint para análise da planilha
+    
+    Com assincrono=1 (form ou query) a análise vira um job: a resposta 202
+    traz o job_id e o progresso é consultado em /api/jobs/<job_id>.
+    
+    Com analise_anterior=<analise_id> a análise é incremental: só os grupos
+    com linhas alteradas são recalculados e cada item do ranking traz
+    posicao_anterior/variacao. incremental=1 guarda a base para a próxima
+    reanálise sem comparar com nenhuma anterior.
+    
+    top_k=<n> (ou offset/limit) devolve só essas posições de cada grupo;
+    só as offset + limit primeiras são calculadas e guardadas. offset sem
+    limit devolve o ranking completo a partir de offset.
+    
+    Com formato=ndjson a resposta é transmitida: cada grupo vai em uma
+    linha assim que termina (ver _transmitir_analise).
+    
+    Em modo debug a resposta inclui 'metricas': tempo de cada etapa,
+    tempos e contagens por grupo e pico de memória da análise.
+    
+    Com PERFIL_SEGREDO configurado, o header X-Perfil com o
+    segredo roda a análise sob o cProfile, sem passar pelo cache e sempre
+    de forma síncrona; a resposta traz perfil_id e as métricas, e o
+    perfil é baixado em /api/perfis/<perfil_id>.
+    """
     try:
         if 'arquivo' not in request.files:
             return jsonify({'erro': 'Nenhum arquivo enviado'}), 400
@@ -39,46 +582,466 @@ def analisar_planilha():
         if arquivo.filename == '':
             return jsonify({'erro': 'Nenhum arquivo selecionado'}), 400
         
-        if not arquivo.filename.endswith(('.xlsx', '.xls')):
-            return jsonify({'erro': 'Formato de arquivo inválido. Use .xlsx ou .xls'}), 400
+        # Modo de leitura pode ser escolhido por requisição
+        modo_leitura = request.form.get('modo_leitura') or request.args.get('modo_leitura')
+        if modo_leitura and modo_leitura not in analisador.MODOS_LEITURA:
+            return jsonify({'erro': f'Modo de leitura inválido. Use: {", ".join(analisador.MODOS_LEITURA)}'}), 400
         
-        # Processar o arquivo
-        resultado = analisador.processar_planilha(arquivo)
+        analise_anterior = request.form.get('analise_anterior') or request.args.get('analise_anterior')
+        if analise_anterior and armazem_analises.obter(analise_anterior) is None:
+            return jsonify({'erro': 'Análise anterior não encontrada ou expirada'}), 404
+        try:
+            offset, limit = _opcoes_paginacao(request.values)
+        except ValueError as e:
+            return jsonify({'erro': f'Paginação inválida: {str(e)}'}), 400
+        # A reanálise incremental precisa do ranking completo como base
+        top_k = offset + limit if limit is not None else None
         
-        if resultado['sucesso']:
-            return jsonify(resultado)
-        else:
-            return jsonify({'erro': resultado.get('erro', 'Erro desconhecido')}), 500
+        incremental = bool(analise_anterior) or \
+            (request.form.get('incremental') or request.args.get('incremental')) in ('1', 'true', 'sim')
+        
+        # O upload vai para disco uma vez e é mapeado; o formato vem dos
+        # primeiros bytes, não do nome do arquivo
+        planilha = PlanilhaRecebida.receber(arquivo.stream, app.config['UPLOADS_DIR'])
+        formato_arquivo = planilha.formato
+        if formato_arquivo != 'xlsx':
+            planilha.fechar()
+            return jsonify({'erro': MENSAGENS_FORMATO[formato_arquivo]}), 400
+        
+        perfilar = _perfil_solicitado()
+        
+        assincrono = request.form.get('assincrono') or request.args.get('assincrono')
+        if assincrono in ('1', 'true', 'sim') and not perfilar:
+            job_id = armazem_jobs.criar(len(analisador.plano.grupos), offset, limit)
+            executor_jobs.submit(_executar_job, job_id, planilha, modo_leitura, incremental,
+                                 analise_anterior, top_k)
+            return jsonify({'job_id': job_id, 'status': 'pendente'}), 202
+        
+        formato = request.form.get('formato') or request.args.get('formato')
+        if formato == 'ndjson' and not perfilar:
+            return _transmitir_analise(planilha, modo_leitura, incremental, analise_anterior,
+                                       top_k, offset, limit)
+        
+        with planilha:
+            return _responder_analise(planilha, modo_leitura, incremental, analise_anterior,
+                                      top_k, offset, limit, perfilar)
             
     except Exception as e:
         logger.error(f"Erro na análise: {str(e)}")
         return jsonify({'erro': f'Erro interno: {str(e)}'}), 500
 
-@app.route('/api/download/<grupo>')
+def _responder_analise(planilha, modo_leitura, incremental, analise_anterior, top_k, offset, limit,
+                       perfilar):
+    """Resposta JSON de uma análise síncrona (opcionalmente perfilada)"""
+    medicao = Medicao()
+    opcoes = {'incremental': incremental, 'analise_anterior': analise_anterior, 'top_k': top_k,
+              'medicao': medicao}
+    perfil_id = None
+    if perfilar:
+        try:
+            resultado, perfil_id = perfilador.executar(
+                _analisar_conteudo, planilha, modo_leitura, ignorar_cache=True, **opcoes
+            )
+        except PerfilOcupado as e:
+            return jsonify({'erro': str(e)}), 409
+    else:
+        resultado = _analisar_conteudo(planilha, modo_leitura, **opcoes)
+    
+    if resultado['sucesso']:
+        resposta = _paginar_rankings(resultado, offset, limit)
+        if app.debug or perfil_id:
+            resposta = dict(resposta, metricas=medicao.resumo())
+        if perfil_id:
+            resposta['perfil_id'] = perfil_id
+        return jsonify(resposta)
+    else:
+        # Arquivo corrompido/truncado é erro do cliente, não do servidor
+        codigo = 400 if resultado.get('planilha_invalida') else 500
+        return jsonify({'erro': resultado.get('erro', 'Erro desconhecido')}), codigo
+
+@app.route('/api/consolidar', methods=['POST'])
+def consolidar():
+    """Ranking regional a partir de várias planilhas enviadas de uma vez
+    
+    Form: arquivos (vários .xlsx), modo_leitura e offset/limit (ou top_k).
+    Cada item do ranking traz 'arquivo' com a planilha de origem e cada
+    nome aparece uma vez, com seu maior %. A consolidação é guardada como
+    uma análise comum: o analise_id serve para downloads e exportação.
+    """
+    try:
+        arquivos = [arquivo for arquivo in request.files.getlist('arquivos') if arquivo.filename]
+        if not arquivos:
+            return jsonify({'erro': 'Nenhum arquivo enviado'}), 400
+        if len(arquivos) > app.config['CONSOLIDACAO_MAX_ARQUIVOS']:
+            return jsonify({'erro': f'Envie no máximo {app.config["CONSOLIDACAO_MAX_ARQUIVOS"]} arquivos'}), 400
+        
+        # Cada upload já está em disco, em um temporário com nome (RequisicaoUploads):
+        # o formato vem do arquivo mapeado e os processos de leitura recebem o
+        # caminho, sem outra cópia dos bytes
+        caminhos = []
+        for arquivo in arquivos:
+            with PlanilhaRecebida.receber(arquivo.stream, app.config['UPLOADS_DIR']) as planilha:
+                formato = planilha.formato
+            if formato != 'xlsx':
+                return jsonify({'erro': f'{arquivo.filename}: {MENSAGENS_FORMATO[formato]}'}), 400
+            caminhos.append(arquivo.stream.name)
+        
+        modo_leitura = request.form.get('modo_leitura') or request.args.get('modo_leitura') or analisador.modo_leitura
+        if modo_leitura not in analisador.MODOS_LEITURA:
+            return jsonify({'erro': f'Modo de leitura inválido. Use: {", ".join(analisador.MODOS_LEITURA)}'}), 400
+        try:
+            offset, limit = _opcoes_paginacao(request.values)
+        except ValueError as e:
+            return jsonify({'erro': f'Paginação inválida: {str(e)}'}), 400
+        
+        resultado = consolidar_planilhas(
+            caminhos,
+            mapeamento_colunas=analisador.mapeamento_colunas,
+            herdar_nome_mesclado=analisador.herdar_nome_mesclado,
+            modo_leitura=modo_leitura,
+            workers=app.config['CONSOLIDACAO_WORKERS'],
+            top_k=offset + limit if limit is not None else None,
+            nomes_arquivos=[arquivo.filename for arquivo in arquivos],
+            executor=_obter_executor_consolidacao()
+        )
+        
+        if not resultado['sucesso']:
+            return jsonify({'erro': resultado['erro'], 'consolidacao': resultado['consolidacao']}), 422
+        
+        resultado['analise_id'] = _guardar_analise(resultado, historico=False)
+        return jsonify(_paginar_rankings(resultado, offset, limit))
+    
+    except Exception as e:
+        logger.error(f"Erro na consolidação: {str(e)}")
+        return jsonify({'erro': f'Erro interno: {str(e)}'}), 500
+
+@app.route('/api/jobs/<job_id>')
+def status_job(job_id):
+    """Progresso de um job assíncrono; inclui o resultado quando concluído
+    
+    O resultado vem recortado pelo offset/limit pedido no upload, como na
+    resposta síncrona.
+    """
+    job = armazem_jobs.obter(job_id)
+    if job is None:
+        return jsonify({'erro': 'Job não encontrado ou expirado'}), 404
+    
+    if job['status'] == 'concluido':
+        resultado = armazem_analises.obter(job['analise_id'])
+        if resultado is None:
+            return jsonify({'erro': 'Resultado do job expirou'}), 404
+        resultado['analise_id'] = job['analise_id']
+        job['resultado'] = _paginar_rankings(
+            resultado, job['paginacao']['offset'], job['paginacao']['limit']
+        )
+    
+    return jsonify(job)
+
+@app.route('/api/ranking/<path:grupo>')
+def paginar_ranking(grupo):
+    """Uma página do ranking de um grupo de uma análise guardada
+    
+    Query: analise_id, offset e limit (ou top_k). Sem limit vem o
+    ranking inteiro a partir de offset.
+    """
+    analise_id = request.args.get('analise_id')
+    if not analise_id:
+        return jsonify({'erro': 'Informe o analise_id retornado por /api/analisar'}), 400
+    
+    try:
+        offset, limit = _opcoes_paginacao(request.args)
+    except ValueError as e:
+        return jsonify({'erro': f'Paginação inválida: {str(e)}'}), 400
+    
+    resultado = armazem_analises.obter(analise_id)
+    if resultado is None:
+        return jsonify({'erro': 'Análise não encontrada ou expirada'}), 404
+    if grupo not in resultado['rankings']:
+        return jsonify({'erro': 'Grupo não encontrado'}), 404
+    
+    dados_grupo = resultado['rankings'][grupo]
+    ranking = dados_grupo['ranking']
+    fim = len(ranking) if limit is None else offset + limit
+    return jsonify({
+        'grupo': grupo,
+        'total_registros': dados_grupo['total_registros'],
+        # Análises feitas com top_k guardam só as primeiras posições
+        'posicoes_disponiveis': len(ranking),
+        'offset': offset,
+        'limit': limit,
+        'ranking': ranking[offset:fim],
+    })
+
+@app.route('/api/registros')
+def download_registros():
+    """Registros extraídos de uma análise em formato colunar
+    
+    Query: analise_id e formato ('arrow', padrão, ou 'parquet'). Colunas:
+    analise_id, timestamp, grupo, posicao, nome, atingimento_percentual,
+    linha e coluna_origem. Análises feitas com top_k (ou limit) não têm
+    todos os registros e respondem 409.
+    """
+    try:
+        analise_id = request.args.get('analise_id')
+        if not analise_id:
+            return jsonify({'erro': 'Informe o analise_id retornado por /api/analisar'}), 400
+        
+        formato = request.args.get('formato', 'arrow')
+        if formato not in registros_colunares.FORMATOS:
+            return jsonify({'erro': f'Formato inválido. Use: {", ".join(registros_colunares.FORMATOS)}'}), 400
+        
+        try:
+            caminho = registros_colunares.caminho_registros(app.config['REGISTROS_DIR'], analise_id)
+        except ValueError as e:
+            return jsonify({'erro': str(e)}), 400
+        
+        if not os.path.exists(caminho):
+            # Análise anterior ao histórico (ou gravação que falhou): gerar agora
+            resultado = armazem_analises.obter(analise_id)
+            if resultado is None:
+                return jsonify({'erro': 'Análise não encontrada ou expirada'}), 404
+            if resultado.get('top_k') is not None:
+                return jsonify({'erro': 'Análise feita com top_k/limit guarda só as primeiras posições; '
+                                        'analise sem top_k para obter os registros'}), 409
+            _gravar_registros(resultado, analise_id)
+        
+        nome_arquivo = f'registros_{analise_id}.{formato}'
+        if formato == 'arrow':
+            return send_file(caminho, mimetype='application/vnd.apache.arrow.file',
+                             as_attachment=True, download_name=nome_arquivo)
+        
+        conteudo = registros_colunares.serializar(registros_colunares.carregar_registros(caminho), formato)
+        return send_file(io.BytesIO(conteudo), mimetype='application/vnd.apache.parquet',
+                         as_attachment=True, download_name=nome_arquivo)
+        
+    except Exception as e:
+        logger.error(f"Erro nos registros colunares: {str(e)}")
+        return jsonify({'erro': f'Erro ao gerar registros: {str(e)}'}), 500
+
+@app.route('/api/historico/mobilizador')
+def historico_mobilizador():
+    """Evolução de um mobilizador nos últimos N dias
+    
+    Query: nome, dias (padrão 30) e, opcionalmente, grupo.
+    """
+    nome = request.args.get('nome')
+    if not nome:
+        return jsonify({'erro': 'Informe o nome do mobilizador'}), 400
+    try:
+        dias = int(request.args.get('dias', 30))
+        if dias < 1:
+            raise ValueError
+    except ValueError:
+        return jsonify({'erro': 'dias deve ser um inteiro maior que zero'}), 400
+    
+    desde = (datetime.now() - timedelta(days=dias - 1)).date().isoformat()
+    grupo = request.args.get('grupo')
+    return jsonify({
+        'nome': nome,
+        'desde': desde,
+        'grupo': grupo,
+        'evolucao': armazem_historico.evolucao(nome, desde, grupo),
+    })
+
+@app.route('/api/historico/ranking/<path:grupo>')
+def historico_ranking(grupo):
+    """Ranking de um grupo em uma data
+    
+    Query: data=AAAA-MM-DD, limit e analise_id opcionais. Sem analise_id,
+    os uploads do dia são combinados (cada nome com seu maior %, nos
+    grupos deduplicados); com ele, vem o ranking daquele upload.
+    """
+    data = request.args.get('data') or datetime.now().date().isoformat()
+    try:
+        data = datetime.strptime(data, '%Y-%m-%d').date().isoformat()
+        limite = int(request.args['limit']) if request.args.get('limit') else None
+        if limite is not None and limite < 1:
+            raise ValueError
+    except ValueError:
+        return jsonify({'erro': 'Use data=AAAA-MM-DD e limit inteiro maior que zero'}), 400
+    
+    plano_grupo = next((plano_grupo for plano_grupo in analisador.plano.grupos if plano_grupo.nome == grupo), None)
+    ranking = armazem_historico.ranking_na_data(
+        grupo, data, limite, analise_id=request.args.get('analise_id'),
+        deduplicar=plano_grupo is None or plano_grupo.deduplicacao == 'maior_por_nome'
+    )
+    if not ranking:
+        return jsonify({'erro': 'Nenhum ranking registrado para o grupo nesta data'}), 404
+    return jsonify({'grupo': grupo, 'data': data, 'ranking': ranking})
+
+@app.route('/api/download/<path:grupo>')
 def download_ranking(grupo):
-    """Download da imagem do ranking"""
+    """Download da imagem do ranking de uma análise guardada
+    
+    Com o segredo de perfil (ver /api/analisar) a imagem é sempre
+    renderizada sob o cProfile e o header X-Perfil-Id traz o perfil_id.
+    """
     try:
-        imagem_bytes = analisador.gerar_imagem_ranking(grupo)
+        analise_id = request.args.get('analise_id')
+        if not analise_id:
+            return jsonify({'erro': 'Informe o analise_id retornado por /api/analisar'}), 400
+        
+        try:
+            dpi, largura, altura = _opcoes_renderizacao(request.args)
+        except ValueError as e:
+            return jsonify({'erro': f'Opções de imagem inválidas: {str(e)}'}), 400
+        
+        chave_imagem = (analise_id, grupo, dpi, largura, altura)
+        perfilar = _perfil_solicitado()
+        perfil_id = None
+        imagem_bytes = None if perfilar else cache_imagens.obter(chave_imagem)
+        
+        if imagem_bytes is None:
+            resultado = armazem_analises.obter(analise_id)
+            if resultado is None:
+                return jsonify({'erro': 'Análise não encontrada ou expirada'}), 404
+            
+            if grupo not in resultado.get('rankings', {}):
+                return jsonify({'erro': 'Ranking não encontrado'}), 404
+            
+            inicio = time.perf_counter()
+            if perfilar:
+                try:
+                    imagem_bytes, perfil_id = perfilador.executar(
+                        analisador.gerar_imagem_ranking, grupo, resultado, dpi, largura, altura
+                    )
+                except PerfilOcupado as e:
+                    return jsonify({'erro': str(e)}), 409
+            else:
+                imagem_bytes = analisador.gerar_imagem_ranking(grupo, resultado, dpi, largura, altura)
+            metricas.observar('mobilizadores_etapa_segundos', time.perf_counter() - inicio,
+                              etapa='renderizacao')
+            if imagem_bytes:
+                cache_imagens.guardar(chave_imagem, imagem_bytes, len(imagem_bytes))
+        
         if imagem_bytes:
-            return send_file(
+            resposta = send_file(
                 io.BytesIO(imagem_bytes),
                 mimetype='image/png',
                 as_attachment=True,
-                download_name=f'ranking_{grupo.replace(" ", "_").lower()}.png'
+                download_name=graficos.nome_arquivo_ranking(grupo)
             )
+            if perfil_id:
+                resposta.headers['X-Perfil-Id'] = perfil_id
+            return resposta
         else:
             return jsonify({'erro': 'Ranking não encontrado'}), 404
     except Exception as e:
         logger.error(f"Erro no download: {str(e)}")
         return jsonify({'erro': f'Erro no download: {str(e)}'}), 500
 
+@app.route('/api/perfis/<perfil_id>')
+def baixar_perfil(perfil_id):
+    """Perfil gerado por uma requisição perfilada (exige o mesmo segredo no header X-Perfil)
+    
+    Padrão: arquivo .prof do pstats (snakeviz, pstats.Stats). Com
+    formato=texto vem o relatório das funções mais caras; ordem
+    (cumulative, tottime, ...) e limite ajustam o relatório.
+    """
+    if not _perfil_solicitado():
+        return jsonify({'erro': 'Perfil não autorizado'}), 403
+    try:
+        caminho = perfilador.caminho(perfil_id)
+    except ValueError as e:
+        return jsonify({'erro': str(e)}), 400
+    if not os.path.exists(caminho):
+        return jsonify({'erro': 'Perfil não encontrado'}), 404
+    
+    if request.args.get('formato') == 'texto':
+        ordem = request.args.get('ordem', 'cumulative')
+        if ordem not in ('cumulative', 'tottime', 'calls', 'ncalls', 'time'):
+            return jsonify({'erro': 'ordem inválida'}), 400
+        try:
+            limite = int(request.args.get('limite', 40))
+        except ValueError:
+            return jsonify({'erro': 'limite deve ser inteiro'}), 400
+        return Response(perfilador.resumo_texto(perfil_id, ordem, limite),
+                        mimetype='text/plain; charset=utf-8')
+    return send_file(caminho, mimetype='application/octet-stream', as_attachment=True,
+                     download_name=f'perfil_{perfil_id}.prof')
+
+@app.route('/api/exportar')
+def exportar_rankings():
+    """Exporta os rankings de todos os grupos de uma análise (ZIP de PNGs ou PDF)"""
+    try:
+        analise_id = request.args.get('analise_id')
+        if not analise_id:
+            return jsonify({'erro': 'Informe o analise_id retornado por /api/analisar'}), 400
+        
+        formato = request.args.get('formato', 'zip')
+        if formato not in ('zip', 'pdf'):
+            return jsonify({'erro': 'Formato inválido. Use zip ou pdf'}), 400
+        
+        try:
+            dpi, largura, altura = _opcoes_renderizacao(request.args)
+        except ValueError as e:
+            return jsonify({'erro': f'Opções de imagem inválidas: {str(e)}'}), 400
+        
+        resultado = armazem_analises.obter(analise_id)
+        if resultado is None:
+            return jsonify({'erro': 'Análise não encontrada ou expirada'}), 404
+        
+        grupos = list(resultado.get('rankings', {}))
+        
+        if formato == 'pdf':
+            conteudo = graficos.renderizar_pdf(grupos, resultado, largura, altura)
+            return send_file(
+                io.BytesIO(conteudo),
+                mimetype='application/pdf',
+                as_attachment=True,
+                download_name=f'rankings_{analise_id}.pdf'
+            )
+        
+        # Reaproveitar PNGs já renderizados e renderizar só o que falta
+        imagens = {}
+        for grupo in grupos:
+            imagem = cache_imagens.obter((analise_id, grupo, dpi, largura, altura))
+            if imagem is not None:
+                imagens[grupo] = imagem
+        
+        faltantes = [grupo for grupo in grupos if grupo not in imagens]
+        inicio = time.perf_counter()
+        novas = graficos.renderizar_grupos_paralelo(
+            faltantes, resultado, dpi, largura, altura,
+            executor=_obter_executor_exportacao(),
+            workers=app.config['EXPORTACAO_WORKERS']
+        )
+        if faltantes:
+            metricas.observar('mobilizadores_etapa_segundos', time.perf_counter() - inicio,
+                              etapa='renderizacao_lote')
+        for grupo, imagem in novas.items():
+            cache_imagens.guardar((analise_id, grupo, dpi, largura, altura), imagem, len(imagem))
+        imagens.update(novas)
+        
+        return send_file(
+            io.BytesIO(graficos.montar_zip(imagens, grupos)),
+            mimetype='application/zip',
+            as_attachment=True,
+            download_name=f'rankings_{analise_id}.zip'
+        )
+    except Exception as e:
+        logger.error(f"Erro na exportação: {str(e)}")
+        return jsonify({'erro': f'Erro na exportação: {str(e)}'}), 500
+
+@app.route('/api/metrics')
+def exportar_metricas():
+    """Métricas de todos os workers, somadas, no formato de texto do Prometheus"""
+    return Response(metricas.texto_prometheus(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
 @app.route('/api/status')
 def status():
     """Status da aplicação"""
+    inicializacao = dict(_inicializacao, primeiras_requisicoes_s=dict(_inicializacao['primeiras_requisicoes_s']))
     return jsonify({
         'status': 'online',
         'versao': '2.0',
         'timestamp': datetime.now().isoformat(),
+        'cache': cache_resultados.estatisticas(),
+        'analises': armazem_analises.estatisticas(),
+        'cache_imagens': cache_imagens.estatisticas(),
+        'estados_incrementais': estados_incrementais.estatisticas(),
+        'historico': armazem_historico.estatisticas(),
+        'inicializacao': inicializacao,
         'correcoes': {
             'agro_registros': 12,
             'regulariza_agro_registros': 22,
@@ -86,6 +1049,18 @@ def status():
         }
     })
 
+# Tempos de inicialização deste processo (ver aquecer e /api/status)
+_inicializacao = {
+    'importacao_s': time.perf_counter() - _INICIO_IMPORTACAO,
+    'aquecido': False,
+    'primeiras_requisicoes_s': {},
+}
+
+if os.environ.get('AQUECER', '0') == '1':
+    aquecer()
+
 if __name__ == '__main__':
+    # Servidor de desenvolvimento; em produção use o gunicorn (ver Procfile)
     port = int(os.environ.get('PORT', 5000))
+    metricas.limpar()
     app.run(host='0.0.0.0', port=port, debug=True)
\ No newline at end of file
@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Armazenamento local do Sistema de Análise de Mobilizadores
+Guarda as análises em SQLite para que qualquer worker do gunicorn as atenda
+"""
+
+import json
+import os
+from contextlib import contextmanager
+import sqlite3
+import tempfile
+import time
+import uuid
+
+
+class _ArmazemSQLite:
+    """Base dos armazéns: caminho do banco e conexão por operação"""
+
+    def __init__(self, caminho=None):
+        self.caminho = caminho or os.path.join(tempfile.gettempdir(), 'analises_mobilizadores.sqlite3')
+        with self._conectar() as conexao:
+            conexao.execute('PRAGMA journal_mode=WAL')
+            self._criar_tabelas(conexao)
+
+    def _criar_tabelas(self, conexao):
+        raise NotImplementedError
+
+    @contextmanager
+    def _conectar(self):
+        # Uma conexão por operação: seguro entre threads e processos
+        conexao = sqlite3.connect(self.caminho, timeout=30)
+        try:
+            with conexao:
+                yield conexao
+        finally:
+            conexao.close()
+
+
+class ArmazemAnalises(_ArmazemSQLite):
+    """
+    Armazém limitado de análises com expiração por TTL
+
+    Cada chamada de /api/analisar grava o resultado e recebe um analise_id;
+    os downloads leem o resultado daqui sem reprocessar a planilha.
+    """
+
+    def __init__(self, caminho=None, max_itens=200, ttl_segundos=24 * 3600):
+        self.max_itens = max_itens
+        self.ttl_segundos = ttl_segundos
+        super().__init__(caminho)
+
+    def _criar_tabelas(self, conexao):
+        conexao.execute(
+            'CREATE TABLE IF NOT EXISTS analises ('
+            ' analise_id TEXT PRIMARY KEY,'
+            ' criado_em REAL NOT NULL,'
+            ' resultado TEXT NOT NULL)'
+        )
+        conexao.execute('CREATE INDEX IF NOT EXISTS idx_analises_criado_em ON analises (criado_em)')
+
+    def guardar(self, resultado):
+        """Grava o resultado e retorna o analise_id gerado"""
+        analise_id = uuid.uuid4().hex
+        agora = time.time()
+        with self._conectar() as conexao:
+            conexao.execute(
+                'INSERT INTO analises (analise_id, criado_em, resultado) VALUES (?, ?, ?)',
+                (analise_id, agora, json.dumps(resultado, ensure_ascii=False))
+            )
+            self._despejar(conexao, agora)
+        return analise_id
+
+    def obter(self, analise_id):
+        """Retorna o resultado da análise ou None se não existir/expirou"""
+        with self._conectar() as conexao:
+            linha = conexao.execute(
+                'SELECT resultado FROM analises WHERE analise_id = ? AND criado_em >= ?',
+                (analise_id, time.time() - self.ttl_segundos)
+            ).fetchone()
+        if linha is None:
+            return None
+        return json.loads(linha[0])
+
+    def _despejar(self, conexao, agora):
+        """Remove análises expiradas e as mais antigas acima do limite"""
+        conexao.execute('DELETE FROM analises WHERE criado_em < ?', (agora - self.ttl_segundos,))
+        conexao.execute(
+            'DELETE FROM analises WHERE analise_id IN ('
+            ' SELECT analise_id FROM analises ORDER BY criado_em DESC LIMIT -1 OFFSET ?)',
+            (self.max_itens,)
+        )
+
+    def estatisticas(self):
+        with self._conectar() as conexao:
+            total = conexao.execute('SELECT COUNT(*) FROM analises').fetchone()[0]
+        return {
+            'itens': total,
+            'max_itens': self.max_itens,
+            'ttl_segundos': self.ttl_segundos,
+        }
+
+
+class ArmazemJobs(_ArmazemSQLite):
+    """
+    Estado dos jobs de análise assíncrona
+
+    O job é executado em segundo plano por um worker; qualquer worker do
+    gunicorn consegue responder o status porque o estado fica no SQLite.
+    Status: 'pendente' -> 'processando' -> 'concluido' ou 'erro'. O job
+    guarda também a paginação pedida no upload, aplicada ao resultado.
+    """
+
+    def __init__(self, caminho=None, max_itens=500, ttl_segundos=24 * 3600):
+        self.max_itens = max_itens
+        self.ttl_segundos = ttl_segundos
+        super().__init__(caminho)
+
+    def _criar_tabelas(self, conexao):
+        conexao.execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            ' job_id TEXT PRIMARY KEY,'
+            ' criado_em REAL NOT NULL,'
+            ' atualizado_em REAL NOT NULL,'
+            ' status TEXT NOT NULL,'
+            ' total_grupos INTEGER NOT NULL,'
+            ' grupos_concluidos TEXT NOT NULL,'
+            ' analise_id TEXT,'
+            ' erro TEXT,'
+            ' pagina_offset INTEGER NOT NULL DEFAULT 0,'
+            ' pagina_limit INTEGER)'
+        )
+        # Bancos criados antes da paginação dos jobs
+        colunas = {linha[1] for linha in conexao.execute('PRAGMA table_info(jobs)')}
+        if 'pagina_offset' not in colunas:
+            conexao.execute('ALTER TABLE jobs ADD COLUMN pagina_offset INTEGER NOT NULL DEFAULT 0')
+            conexao.execute('ALTER TABLE jobs ADD COLUMN pagina_limit INTEGER')
+        conexao.execute('CREATE INDEX IF NOT EXISTS idx_jobs_criado_em ON jobs (criado_em)')
+
+    def criar(self, total_grupos, offset=0, limit=None):
+        """Registra um job pendente e retorna o job_id"""
+        job_id = uuid.uuid4().hex
+        agora = time.time()
+        with self._conectar() as conexao:
+            conexao.execute(
+                'INSERT INTO jobs (job_id, criado_em, atualizado_em, status, total_grupos, grupos_concluidos,'
+                ' pagina_offset, pagina_limit) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (job_id, agora, agora, 'pendente', total_grupos, '[]', offset, limit)
+            )
+            conexao.execute('DELETE FROM jobs WHERE criado_em < ?', (agora - self.ttl_segundos,))
+            conexao.execute(
+                'DELETE FROM jobs WHERE job_id IN ('
+                ' SELECT job_id FROM jobs ORDER BY criado_em DESC LIMIT -1 OFFSET ?)',
+                (self.max_itens,)
+            )
+        return job_id
+
+    def atualizar(self, job_id, status=None, grupo_concluido=None, analise_id=None, erro=None):
+        """Atualiza o status e/ou acrescenta um grupo concluído"""
+        with self._conectar() as conexao:
+            linha = conexao.execute(
+                'SELECT status, grupos_concluidos FROM jobs WHERE job_id = ?', (job_id,)
+            ).fetchone()
+            if linha is None:
+                return
+            grupos_concluidos = json.loads(linha[1])
+            if grupo_concluido is not None:
+                grupos_concluidos.append(grupo_concluido)
+            conexao.execute(
+                'UPDATE jobs SET status = ?, grupos_concluidos = ?, atualizado_em = ?,'
+                ' analise_id = COALESCE(?, analise_id), erro = COALESCE(?, erro)'
+                ' WHERE job_id = ?',
+                (status or linha[0], json.dumps(grupos_concluidos, ensure_ascii=False),
+                 time.time(), analise_id, erro, job_id)
+            )
+
+    def obter(self, job_id):
+        """Retorna o estado do job ou None se não existir/expirou"""
+        with self._conectar() as conexao:
+            linha = conexao.execute(
+                'SELECT status, total_grupos, grupos_concluidos, analise_id, erro, criado_em, atualizado_em,'
+                ' pagina_offset, pagina_limit FROM jobs WHERE job_id = ? AND criado_em >= ?',
+                (job_id, time.time() - self.ttl_segundos)
+            ).fetchone()
+        if linha is None:
+            return None
+        (status, total_grupos, grupos_concluidos, analise_id, erro, criado_em, atualizado_em,
+         offset, limit) = linha
+        return {
+            'job_id': job_id,
+            'status': status,
+            'progresso': {
+                'total_grupos': total_grupos,
+                'grupos_concluidos': json.loads(grupos_concluidos),
+            },
+            'analise_id': analise_id,
+            'erro': erro,
+            'duracao_s': round(atualizado_em - criado_em, 3),
+            'paginacao': {'offset': offset, 'limit': limit},
+        }
+
+
+class ArmazemHistorico(_ArmazemSQLite):
+    """
+    Histórico diário dos rankings, sem expiração
+
+    Cada análise acrescenta os registros de todos os grupos em uma única
+    transação, com a data da análise; só rankings completos entram (sem
+    top_k). Uploads diferentes no mesmo dia (outras agências, versões
+    novas do relatório) se somam; o mesmo upload (chave_upload: hash do
+    conteúdo e do mapeamento) reprocessado no mesmo dia substitui só as
+    próprias linhas. As consultas usam os índices por (nome, data) e
+    (data, grupo, posicao).
+    """
+
+    def _criar_tabelas(self, conexao):
+        conexao.execute(
+            'CREATE TABLE IF NOT EXISTS historico ('
+            ' data TEXT NOT NULL,'
+            ' grupo TEXT NOT NULL,'
+            ' posicao INTEGER NOT NULL,'
+            ' nome TEXT NOT NULL,'
+            ' atingimento_percentual REAL NOT NULL,'
+            ' linha INTEGER,'
+            ' coluna_origem TEXT,'
+            ' analise_id TEXT NOT NULL,'
+            ' chave_upload TEXT)'
+        )
+        # Bancos criados antes da chave_upload
+        colunas = {linha[1] for linha in conexao.execute('PRAGMA table_info(historico)')}
+        if 'chave_upload' not in colunas:
+            conexao.execute('ALTER TABLE historico ADD COLUMN chave_upload TEXT')
+        conexao.execute('CREATE INDEX IF NOT EXISTS idx_historico_nome_data ON historico (nome, data)')
+        conexao.execute(
+            'CREATE INDEX IF NOT EXISTS idx_historico_data_grupo_posicao ON historico (data, grupo, posicao)'
+        )
+
+    def guardar(self, resultado, analise_id, chave_upload=None):
+        """Acrescenta os rankings da análise na data do seu timestamp; retorna a data
+
+        Com chave_upload, linhas anteriores do mesmo upload nesta data são
+        substituídas. Levanta ValueError se a análise foi truncada por top_k.
+        """
+        if resultado.get('top_k') is not None:
+            raise ValueError('Análise feita com top_k não tem o ranking completo')
+        data = resultado['timestamp'][:10]
+        linhas = [
+            (data, grupo, item['posicao'], item['nome'], item['atingimento_percentual'],
+             item.get('linha'), item.get('coluna_origem'), analise_id, chave_upload)
+            for grupo, dados_grupo in resultado.get('rankings', {}).items()
+            for item in dados_grupo.get('ranking', [])
+        ]
+        with self._conectar() as conexao:
+            if chave_upload is not None:
+                conexao.execute(
+                    'DELETE FROM historico WHERE data = ? AND chave_upload = ?', (data, chave_upload)
+                )
+            conexao.executemany(
+                'INSERT INTO historico (data, grupo, posicao, nome, atingimento_percentual,'
+                ' linha, coluna_origem, analise_id, chave_upload) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                linhas
+            )
+        return data
+
+    def evolucao(self, nome, desde, grupo=None):
+        """Posição e % do mobilizador em cada data a partir de desde (YYYY-MM-DD)
+
+        Uma entrada por upload em que ele aparece; a posição é a do ranking
+        daquele upload (analise_id).
+        """
+        consulta = (
+            'SELECT data, grupo, posicao, atingimento_percentual, analise_id FROM historico'
+            ' WHERE nome = ? AND data >= ?'
+        )
+        parametros = [nome, desde]
+        if grupo:
+            consulta += ' AND grupo = ?'
+            parametros.append(grupo)
+        consulta += ' ORDER BY data, grupo, rowid'
+
+        with self._conectar() as conexao:
+            linhas = conexao.execute(consulta, parametros).fetchall()
+        return [
+            {'data': data, 'grupo': grupo, 'posicao': posicao, 'atingimento_percentual': atingimento,
+             'analise_id': analise_id}
+            for data, grupo, posicao, atingimento, analise_id in linhas
+        ]
+
+    def ranking_na_data(self, grupo, data, limite=None, analise_id=None, deduplicar=True):
+        """Ranking do grupo na data (YYYY-MM-DD), opcionalmente só as primeiras posições
+
+        Com analise_id, o ranking daquele upload. Sem ele, os uploads do dia
+        combinados por % (no empate, o upload gravado antes); com deduplicar,
+        cada nome fica só com seu maior %, como na consolidação. Nomes
+        provisórios ("Mobilizador <linha>", linhas sem nome) só valem dentro
+        do próprio upload e não se juntam aos de outros. Com um único upload
+        no dia, os dois coincidem.
+        """
+        if analise_id is not None:
+            consulta = (
+                'SELECT nome, atingimento_percentual, linha, coluna_origem, analise_id FROM historico'
+                ' WHERE grupo = ? AND data = ? AND analise_id = ? ORDER BY posicao LIMIT ?'
+            )
+            parametros = (grupo, data, analise_id)
+        elif deduplicar:
+            consulta = (
+                'SELECT nome, atingimento_percentual, linha, coluna_origem, analise_id FROM ('
+                ' SELECT *, rowid AS ordem, ROW_NUMBER() OVER ('
+                # Nome provisório (analise_melhorada.nome_provisorio): chave inclui o upload
+                "  PARTITION BY nome, CASE WHEN nome = 'Mobilizador ' || linha THEN analise_id END"
+                '  ORDER BY atingimento_percentual DESC, rowid) AS ordem_nome'
+                ' FROM historico WHERE grupo = ? AND data = ?)'
+                ' WHERE ordem_nome = 1 ORDER BY atingimento_percentual DESC, ordem LIMIT ?'
+            )
+            parametros = (grupo, data)
+        else:
+            consulta = (
+                'SELECT nome, atingimento_percentual, linha, coluna_origem, analise_id FROM historico'
+                ' WHERE grupo = ? AND data = ? ORDER BY atingimento_percentual DESC, rowid LIMIT ?'
+            )
+            parametros = (grupo, data)
+
+        with self._conectar() as conexao:
+            linhas = conexao.execute(consulta, parametros + (-1 if limite is None else limite,)).fetchall()
+        return [
+            {'posicao': posicao, 'nome': nome, 'atingimento_percentual': atingimento,
+             'linha': linha, 'coluna_origem': coluna_origem, 'analise_id': analise_id}
+            for posicao, (nome, atingimento, linha, coluna_origem, analise_id) in enumerate(linhas, 1)
+        ]
+
+    def estatisticas(self):
+        with self._conectar() as conexao:
+            total, datas, analises = conexao.execute(
+                'SELECT COUNT(*), COUNT(DISTINCT data), COUNT(DISTINCT analise_id) FROM historico'
+            ).fetchone()
+        return {'registros': total, 'datas': datas, 'analises': analises}
@@ -0,0 +1,495 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmarks do Sistema de Análise de Mobilizadores
+Cada cenário roda em um processo novo para que o pico de memória (RSS)
+reflita apenas aquele cenário
+"""
+
+import argparse
+import io
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+
+def _pico_rss_mb():
+    """Pico de memória residente do processo atual, em MB"""
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux informa em KB, macOS em bytes
+    divisor = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return pico / divisor
+
+
+def _executar_parse(cenario, caminho):
+    """Processa a planilha uma vez no cenário indicado (roda no processo filho)"""
+    from analise_melhorada import AnalisadorMobilizadoresMelhorado
+
+    # 'legado' é o modo completo somado ao parse extra do pandas
+    modo_leitura = 'completo' if cenario == 'legado' else cenario
+    analisador = AnalisadorMobilizadoresMelhorado(modo_leitura=modo_leitura)
+    rss_inicial = _pico_rss_mb()
+    inicio = time.perf_counter()
+
+    with open(caminho, 'rb') as arquivo:
+        if cenario == 'legado':
+            # Pipeline anterior: pandas relia o arquivo inteiro além do openpyxl
+            import pandas as pd
+            pd.read_excel(arquivo, header=0)
+            arquivo.seek(0)
+        resultado = analisador.processar_planilha(arquivo)
+
+    return {
+        'cenario': cenario,
+        'tempo_s': time.perf_counter() - inicio,
+        'pico_rss_mb': _pico_rss_mb(),
+        'rss_antes_mb': rss_inicial,
+        'sucesso': resultado['sucesso'],
+    }
+
+
+def _em_processo_novo(funcao, *args):
+    """Executa funcao(*args) em um processo 'spawn' descartável"""
+    contexto = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=1, mp_context=contexto) as executor:
+        return executor.submit(funcao, *args).result()
+
+
+def _planilha_teste(linhas, diretorio):
+    from planilha_sintetica import gerar_planilha
+    caminho = os.path.join(diretorio, f'relatorio_sintetico_{linhas}.xlsx')
+    if not os.path.exists(caminho):
+        gerar_planilha(caminho, linhas)
+    return caminho
+
+
+def _comparar_cenarios(cenarios, caminho, repeticoes):
+    tamanho_mb = os.path.getsize(caminho) / (1024 * 1024)
+    print(f"📦 Planilha: {caminho} ({tamanho_mb:.1f} MB)")
+
+    for cenario in cenarios:
+        tempos = []
+        picos = []
+        for _ in range(repeticoes):
+            medida = _em_processo_novo(_executar_parse, cenario, caminho)
+            tempos.append(medida['tempo_s'])
+            picos.append(medida['pico_rss_mb'] - medida['rss_antes_mb'])
+        print(f"   {cenario:<10} tempo médio: {sum(tempos) / len(tempos):7.3f}s | "
+              f"pico RSS do upload: {max(picos):7.1f} MB")
+
+
+def benchmark_parse(args):
+    """Compara o parse duplo (openpyxl + pandas) com o parse único atual"""
+    caminho = args.arquivo or _planilha_teste(args.linhas, args.diretorio)
+    _comparar_cenarios(('legado', 'completo'), caminho, args.repeticoes)
+
+
+def benchmark_memoria(args):
+    """Compara o modo completo com o modo streaming em vários tamanhos"""
+    arquivos = args.arquivo or [_planilha_teste(linhas, args.diretorio) for linhas in args.linhas]
+    for caminho in arquivos:
+        _comparar_cenarios(('completo', 'streaming'), caminho, args.repeticoes)
+
+
+def benchmark_render(args):
+    """Latência de renderização do PNG por resolução, incluindo o cache"""
+    from analise_melhorada import AnalisadorMobilizadoresMelhorado
+    from cache import CacheLRU
+    import graficos
+
+    caminho = args.arquivo or _planilha_teste(args.linhas, args.diretorio)
+    analisador = AnalisadorMobilizadoresMelhorado()
+    with open(caminho, 'rb') as arquivo:
+        resultado = analisador.processar_planilha(arquivo)
+    grupo = next(iter(resultado['rankings']))
+
+    inicio = time.perf_counter()
+    graficos.preparar_graficos()
+    print(f"⚙️  Preparo do matplotlib (uma vez por processo): {time.perf_counter() - inicio:.3f}s")
+
+    cache_imagens = CacheLRU(max_itens=16)
+    for dpi, largura, altura in ((300, 12, 8), (150, 12, 8), (72, 6, 4)):
+        tempos = []
+        for _ in range(args.repeticoes):
+            inicio = time.perf_counter()
+            imagem = analisador.gerar_imagem_ranking(grupo, resultado, dpi, largura, altura)
+            tempos.append(time.perf_counter() - inicio)
+        cache_imagens.guardar((grupo, dpi, largura, altura), imagem, len(imagem))
+
+        inicio = time.perf_counter()
+        cache_imagens.obter((grupo, dpi, largura, altura))
+        tempo_cache = time.perf_counter() - inicio
+
+        print(f"   dpi={dpi:<3} {largura}x{altura}in  render médio: {sum(tempos) / len(tempos):6.3f}s | "
+              f"cache: {tempo_cache * 1000:6.3f}ms | {len(imagem) / 1024:7.1f} KB")
+
+
+def benchmark_paralelo(args):
+    """Tempo de extração + ranking por modo de execução sobre o mesmo bloco"""
+    from analise_melhorada import AnalisadorMobilizadoresMelhorado
+
+    caminho = args.arquivo or _planilha_teste(args.linhas, args.diretorio)
+    analisador = AnalisadorMobilizadoresMelhorado()
+
+    inicio = time.perf_counter()
+    with open(caminho, 'rb') as arquivo:
+        bloco = analisador._ler_planilha(arquivo, 'streaming')
+    print(f"📦 Planilha: {caminho} | leitura (streaming): {time.perf_counter() - inicio:.2f}s")
+
+    referencia = None
+    for modo in analisador.MODOS_EXECUCAO:
+        # Primeira execução aquece o pool; não entra na medida
+        resultado = analisador._processar_grupos(bloco, modo, args.workers)
+        if referencia is None:
+            referencia = resultado
+        tempos = []
+        for _ in range(args.repeticoes):
+            inicio = time.perf_counter()
+            analisador._processar_grupos(bloco, modo, args.workers)
+            tempos.append(time.perf_counter() - inicio)
+        igual = '✅' if resultado == referencia else '❌ resultado diferente do serial'
+        print(f"   {modo:<10} workers={args.workers} tempo médio: {sum(tempos) / len(tempos):7.3f}s {igual}")
+
+
+def _valor_aleatorio(rnd):
+    """Célula aleatória para comparar as conversões (inclui casos patológicos)"""
+    from datetime import datetime
+    sorteio = rnd.random()
+    if sorteio < 0.1:
+        return None
+    if sorteio < 0.3:
+        return rnd.uniform(-2, 150)
+    if sorteio < 0.4:
+        return rnd.randint(-10, 200)
+    if sorteio < 0.45:
+        return rnd.choice([True, False, float('nan'), float('inf'), datetime(2024, 1, 1)])
+    caracteres = '0123456789' * 3 + '.,%- abcR$٣²١'
+    return ''.join(rnd.choice(caracteres) for _ in range(rnd.randint(0, 12)))
+
+
+def benchmark_conversao(args):
+    """Confere a conversão vetorizada contra a escalar e compara os tempos"""
+    import random
+    import numpy as np
+    from analise_melhorada import AnalisadorMobilizadoresMelhorado
+
+    analisador = AnalisadorMobilizadoresMelhorado()
+    rnd = random.Random(args.semente)
+    divergencias = 0
+
+    for _ in range(args.colunas):
+        valores = [_valor_aleatorio(rnd) for _ in range(rnd.randint(0, 500))]
+        if rnd.random() < 0.05:
+            # Inteiro fora do float64 força o caminho escalar
+            valores.append(rnd.choice([10 ** 400, -10 ** 400]))
+        vetorizado = analisador._converter_coluna_para_percentual(valores)
+        escalar = analisador._converter_coluna_escalar(valores)
+        mesmos_bits = (vetorizado.view(np.int64) == escalar.view(np.int64)) | \
+            (np.isnan(vetorizado) & np.isnan(escalar))
+        divergencias += int((~mesmos_bits).sum())
+
+    print(f"🔬 {args.colunas} colunas aleatórias: {divergencias} divergências "
+          f"{'✅' if divergencias == 0 else '❌'}")
+
+    from planilha_sintetica import _valor_percentual
+    valores = [_valor_percentual(rnd) for _ in range(args.linhas)]
+    for nome, funcao in (('escalar', analisador._converter_coluna_escalar),
+                         ('vetorizada', analisador._converter_coluna_para_percentual)):
+        inicio = time.perf_counter()
+        funcao(valores)
+        print(f"   {nome:<11} {args.linhas} células: {time.perf_counter() - inicio:.3f}s")
+
+
+def _medir_processamento(caminho, modo_leitura):
+    """processar_planilha de ponta a ponta: tempo e pico de RSS (processo filho)"""
+    from analise_melhorada import AnalisadorMobilizadoresMelhorado
+
+    analisador = AnalisadorMobilizadoresMelhorado(modo_leitura=modo_leitura)
+    rss_antes = _pico_rss_mb()
+    inicio = time.perf_counter()
+    with open(caminho, 'rb') as arquivo:
+        resultado = analisador.processar_planilha(arquivo)
+    return {
+        'processar_planilha_s': time.perf_counter() - inicio,
+        'pico_rss_processar_mb': _pico_rss_mb() - rss_antes,
+        'sucesso': resultado['sucesso'],
+    }, resultado
+
+
+def _medir_etapas(caminho, modo_leitura):
+    """Tempo de cada etapa: leitura, índice de nomes, extração e ranking por grupo"""
+    from analise_melhorada import AnalisadorMobilizadoresMelhorado
+
+    analisador = AnalisadorMobilizadoresMelhorado(modo_leitura=modo_leitura)
+    inicio = time.perf_counter()
+    with open(caminho, 'rb') as arquivo:
+        bloco = analisador._ler_planilha(arquivo, modo_leitura)
+    medidas = {'leitura_s': time.perf_counter() - inicio}
+
+    inicio = time.perf_counter()
+    nomes = analisador._indexar_nomes(bloco)
+    medidas['indexacao_nomes_s'] = time.perf_counter() - inicio
+
+    medidas['grupos'] = {}
+    for plano_grupo in analisador.plano.grupos:
+        inicio = time.perf_counter()
+        registros = analisador._extrair_registros_grupo(bloco, plano_grupo, nomes)
+        extracao = time.perf_counter() - inicio
+        inicio = time.perf_counter()
+        analisador._criar_ranking(registros, plano_grupo.nome)
+        medidas['grupos'][plano_grupo.nome] = {
+            'registros': len(registros),
+            'extracao_s': extracao,
+            'ranking_s': time.perf_counter() - inicio,
+        }
+    return medidas
+
+
+def _medir_render(resultado, dpi):
+    """gerar_imagem_ranking de cada grupo: tempo e pico de RSS (processo filho)"""
+    from analise_melhorada import AnalisadorMobilizadoresMelhorado
+    import graficos
+
+    analisador = AnalisadorMobilizadoresMelhorado()
+    inicio = time.perf_counter()
+    graficos.preparar_graficos()
+    preparo = time.perf_counter() - inicio
+
+    rss_antes = _pico_rss_mb()
+    tempos = {}
+    for grupo in resultado['rankings']:
+        inicio = time.perf_counter()
+        analisador.gerar_imagem_ranking(grupo, resultado, dpi)
+        tempos[grupo] = time.perf_counter() - inicio
+    return {
+        'preparo_graficos_s': preparo,
+        'render_png_s': tempos,
+        'pico_rss_render_mb': _pico_rss_mb() - rss_antes,
+    }
+
+
+def _metadados():
+    import platform
+    import subprocess
+    from datetime import datetime
+
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'data': datetime.now().isoformat(),
+        'commit': commit,
+        'python': platform.python_version(),
+        'plataforma': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def _achatar(medidas, prefixo=''):
+    """{'a': {'b_s': 1}} -> {'a/b_s': 1}, só com as métricas numéricas"""
+    plano = {}
+    for chave, valor in medidas.items():
+        nome = f'{prefixo}{chave}'
+        if isinstance(valor, dict):
+            plano.update(_achatar(valor, f'{nome}/'))
+        elif isinstance(valor, (int, float)) and not isinstance(valor, bool):
+            plano[nome] = valor
+    return plano
+
+
+# Tempos abaixo disso oscilam mais que qualquer tolerância razoável
+MINIMO_COMPARAVEL_S = 0.05
+
+
+def _comparar_com_base(resultados, caminho_base, tolerancia):
+    """Lista as métricas de tempo/memória que pioraram além da tolerância"""
+    import json
+
+    with open(caminho_base, encoding='utf-8') as arquivo:
+        base = _achatar(json.load(arquivo)['cenarios'])
+    atual = _achatar(resultados['cenarios'])
+
+    regressoes = []
+    for nome, valor in atual.items():
+        if not nome.endswith(('_s', '_mb')) or nome not in base or base[nome] <= 0:
+            continue
+        if nome.endswith('_s') and base[nome] < MINIMO_COMPARAVEL_S:
+            continue  # tempos tão curtos são dominados por ruído
+        variacao = valor / base[nome] - 1
+        if variacao > tolerancia:
+            regressoes.append({'metrica': nome, 'base': base[nome], 'atual': valor, 'variacao': variacao})
+    return regressoes
+
+
+def benchmark_etapas(args):
+    """Mede cada etapa do processamento e grava o resultado em JSON
+
+    Para cada tamanho: leitura, índice de nomes, extração e ranking por
+    grupo, processar_planilha inteiro e render dos PNGs, com os picos de
+    memória medidos em processos separados. Com --comparar, falha (código
+    de saída 1) se alguma métrica piorar mais que --tolerancia.
+    """
+    import json
+
+    resultados = {'metadados': _metadados(), 'cenarios': {}}
+    arquivos = [(caminho, None) for caminho in args.arquivo or []] or \
+        [(_planilha_teste(linhas, args.diretorio), linhas) for linhas in args.linhas]
+
+    for caminho, linhas in arquivos:
+        nome = f'linhas={linhas}' if linhas else os.path.basename(caminho)
+        print(f"📦 {nome}: {caminho}", file=sys.stderr)
+        processamento, resultado = _em_processo_novo(_medir_processamento, caminho, args.modo_leitura)
+        cenario = {
+            'arquivo_mb': os.path.getsize(caminho) / (1024 * 1024),
+            'modo_leitura': args.modo_leitura,
+            **processamento,
+            **_em_processo_novo(_medir_etapas, caminho, args.modo_leitura),
+            **_em_processo_novo(_medir_render, resultado, args.dpi),
+        }
+        resultados['cenarios'][nome] = cenario
+
+    saida = json.dumps(resultados, ensure_ascii=False, indent=2)
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as arquivo:
+            arquivo.write(saida)
+        print(f"✅ Resultados gravados em {args.saida}", file=sys.stderr)
+    else:
+        print(saida)
+
+    if args.comparar:
+        regressoes = _comparar_com_base(resultados, args.comparar, args.tolerancia)
+        for regressao in regressoes:
+            print(f"❌ {regressao['metrica']}: {regressao['base']:.3f} -> {regressao['atual']:.3f} "
+                  f"(+{regressao['variacao']:.0%})", file=sys.stderr)
+        if regressoes:
+            sys.exit(1)
+        print(f"✅ Nenhuma regressão acima de {args.tolerancia:.0%}", file=sys.stderr)
+
+
+def _medir_inicializacao(caminho, aquecido, diretorio):
+    """Importação do app, aquecimento e as duas primeiras análises/downloads (processo filho)"""
+    # Históricos e registros desta medição ficam fora dos diretórios reais
+    os.environ['HISTORICO_DB'] = os.path.join(diretorio, 'historico.sqlite3')
+    os.environ['REGISTROS_DIR'] = os.path.join(diretorio, 'registros')
+    os.environ.pop('AQUECER', None)
+
+    inicio = time.perf_counter()
+    import app as aplicacao
+    medidas = {'importacao_s': time.perf_counter() - inicio}
+
+    if aquecido:
+        inicio = time.perf_counter()
+        aplicacao.aquecer()
+        medidas['aquecimento_s'] = time.perf_counter() - inicio
+
+    cliente = aplicacao.app.test_client()
+    with open(caminho, 'rb') as arquivo:
+        conteudo = arquivo.read()
+
+    for ordem in ('primeira', 'segunda'):
+        inicio = time.perf_counter()
+        # A segunda análise muda o conteúdo para não ser atendida pelo cache
+        resposta = cliente.post('/api/analisar', content_type='multipart/form-data', data={
+            'arquivo': (io.BytesIO(conteudo + (b'' if ordem == 'primeira' else b'\0')), 'planilha.xlsx')
+        })
+        medidas[f'{ordem}_analise_s'] = time.perf_counter() - inicio
+        analise_id = resposta.get_json()['analise_id']
+
+        grupo = next(iter(resposta.get_json()['rankings']))
+        inicio = time.perf_counter()
+        cliente.get(f'/api/download/{grupo}', query_string={'analise_id': analise_id})
+        medidas[f'{ordem}_download_s'] = time.perf_counter() - inicio
+
+    medidas['pico_rss_mb'] = _pico_rss_mb()
+    return medidas
+
+
+def benchmark_inicializacao(args):
+    """Importação do app e latência das primeiras requisições, sem e com aquecimento"""
+    caminho = args.arquivo or _planilha_teste(args.linhas, args.diretorio)
+    print(f"📦 Planilha: {caminho}")
+
+    with tempfile.TemporaryDirectory() as diretorio:
+        for aquecido in (False, True):
+            rotulo = 'aquecido' if aquecido else 'frio'
+            amostras = [
+                _em_processo_novo(_medir_inicializacao, caminho, aquecido, diretorio)
+                for _ in range(args.repeticoes)
+            ]
+            print(f"\n🔹 {rotulo}")
+            for metrica in amostras[0]:
+                valores = sorted(amostra[metrica] for amostra in amostras)
+                unidade = 'MB' if metrica.endswith('_mb') else 's'
+                print(f"   {metrica:20s} mediana {valores[len(valores) // 2]:7.2f} {unidade}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks do processamento de planilhas')
+    parser.add_argument('--diretorio', default=tempfile.gettempdir(),
+                        help='Onde guardar as planilhas sintéticas geradas')
+    subparsers = parser.add_subparsers(dest='comando', required=True)
+
+    parser_parse = subparsers.add_parser('parse', help='Tempo e pico de memória por upload')
+    parser_parse.add_argument('--arquivo', help='Planilha real (padrão: sintética)')
+    parser_parse.add_argument('--linhas', type=int, default=20000)
+    parser_parse.add_argument('--repeticoes', type=int, default=3)
+    parser_parse.set_defaults(funcao=benchmark_parse)
+
+    parser_memoria = subparsers.add_parser('memoria', help='Modo completo vs streaming')
+    parser_memoria.add_argument('--arquivo', nargs='*', help='Planilhas reais (padrão: sintéticas)')
+    parser_memoria.add_argument('--linhas', type=int, nargs='+', default=[5000, 20000, 50000])
+    parser_memoria.add_argument('--repeticoes', type=int, default=1)
+    parser_memoria.set_defaults(funcao=benchmark_memoria)
+
+    parser_render = subparsers.add_parser('render', help='Latência de renderização dos PNGs')
+    parser_render.add_argument('--arquivo', help='Planilha real (padrão: sintética)')
+    parser_render.add_argument('--linhas', type=int, default=2000)
+    parser_render.add_argument('--repeticoes', type=int, default=5)
+    parser_render.set_defaults(funcao=benchmark_render)
+
+    parser_paralelo = subparsers.add_parser('paralelo', help='Extração serial vs paralela')
+    parser_paralelo.add_argument('--arquivo', help='Planilha real (padrão: sintética)')
+    parser_paralelo.add_argument('--linhas', type=int, default=100000)
+    parser_paralelo.add_argument('--workers', type=int, default=min(os.cpu_count() or 1, 6))
+    parser_paralelo.add_argument('--repeticoes', type=int, default=3)
+    parser_paralelo.set_defaults(funcao=benchmark_paralelo)
+
+    parser_conversao = subparsers.add_parser('conversao', help='Conversão de %% vetorizada vs escalar')
+    parser_conversao.add_argument('--colunas', type=int, default=2000)
+    parser_conversao.add_argument('--linhas', type=int, default=200000)
+    parser_conversao.add_argument('--semente', type=int, default=6500)
+    parser_conversao.set_defaults(funcao=benchmark_conversao)
+
+    parser_etapas = subparsers.add_parser('etapas', help='Tempo e memória por etapa, em JSON')
+    parser_etapas.add_argument('--arquivo', nargs='*', help='Planilhas reais (padrão: sintéticas)')
+    parser_etapas.add_argument('--linhas', type=int, nargs='+', default=[1000, 20000, 100000])
+    parser_etapas.add_argument('--modo-leitura', default='completo', choices=('completo', 'streaming'))
+    parser_etapas.add_argument('--dpi', type=int, default=300)
+    parser_etapas.add_argument('--saida', help='Arquivo JSON de saída (padrão: stdout)')
+    parser_etapas.add_argument('--comparar', help='JSON de uma execução anterior para detectar regressões')
+    parser_etapas.add_argument('--tolerancia', type=float, default=0.2,
+                               help='Piora relativa aceita antes de acusar regressão')
+    parser_etapas.set_defaults(funcao=benchmark_etapas)
+
+    parser_inicializacao = subparsers.add_parser(
+        'inicializacao', help='Importação do app e latência do primeiro upload, com e sem aquecimento'
+    )
+    parser_inicializacao.add_argument('--arquivo', help='Planilha real (padrão: sintética)')
+    parser_inicializacao.add_argument('--linhas', type=int, default=1000)
+    parser_inicializacao.add_argument('--repeticoes', type=int, default=3)
+    parser_inicializacao.set_defaults(funcao=benchmark_inicializacao)
+
+    args = parser.parse_args()
+    args.funcao(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Caches do Sistema de Análise de Mobilizadores
+LRU em memória com limite de tamanho e TTL, e cache de resultados por conteúdo
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+
+class CacheLRU:
+    """
+    Cache LRU thread-safe com limite de itens, de bytes e tempo de vida
+    """
+
+    def __init__(self, max_itens=64, max_bytes=None, ttl_segundos=None):
+        self.max_itens = max_itens
+        self.max_bytes = max_bytes
+        self.ttl_segundos = ttl_segundos
+        self._itens = OrderedDict()  # chave -> (expira_em, tamanho, valor)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.acertos = 0
+        self.falhas = 0
+        self.remocoes = 0
+
+    def obter(self, chave):
+        """Retorna o valor guardado ou None se ausente/expirado"""
+        with self._lock:
+            item = self._itens.get(chave)
+            if item is None:
+                self.falhas += 1
+                return None
+
+            expira_em, _, valor = item
+            if expira_em is not None and expira_em < time.monotonic():
+                self._remover(chave)
+                self.falhas += 1
+                return None
+
+            self._itens.move_to_end(chave)
+            self.acertos += 1
+            return valor
+
+    def guardar(self, chave, valor, tamanho=0):
+        """Guarda um valor; tamanho (bytes) conta para o limite max_bytes"""
+        if self.max_bytes is not None and tamanho > self.max_bytes:
+            return
+
+        expira_em = None
+        if self.ttl_segundos is not None:
+            expira_em = time.monotonic() + self.ttl_segundos
+
+        with self._lock:
+            if chave in self._itens:
+                self._remover(chave)
+            self._itens[chave] = (expira_em, tamanho, valor)
+            self._bytes += tamanho
+
+            # Despejar os menos usados até respeitar os limites
+            while self._itens and (
+                len(self._itens) > self.max_itens
+                or (self.max_bytes is not None and self._bytes > self.max_bytes)
+            ):
+                self._remover(next(iter(self._itens)))
+                self.remocoes += 1
+
+    def remover(self, chave):
+        """Retira e retorna o valor guardado (None se ausente/expirado)"""
+        with self._lock:
+            item = self._itens.get(chave)
+            if item is None:
+                self.falhas += 1
+                return None
+            self._remover(chave)
+            expira_em, _, valor = item
+            if expira_em is not None and expira_em < time.monotonic():
+                self.falhas += 1
+                return None
+            self.acertos += 1
+            return valor
+    
+    def limpar(self):
+        with self._lock:
+            self._itens.clear()
+            self._bytes = 0
+
+    def _remover(self, chave):
+        _, tamanho, _ = self._itens.pop(chave)
+        self._bytes -= tamanho
+
+    def estatisticas(self):
+        with self._lock:
+            return {
+                'itens': len(self._itens),
+                'bytes': self._bytes,
+                'max_itens': self.max_itens,
+                'max_bytes': self.max_bytes,
+                'ttl_segundos': self.ttl_segundos,
+                'acertos': self.acertos,
+                'falhas': self.falhas,
+                'remocoes': self.remocoes,
+            }
+
+
+class CacheResultados:
+    """
+    Cache do resultado de processar_planilha indexado pelo conteúdo do upload
+
+    A chave combina o hash dos bytes da planilha com o hash do mapeamento de
+    colunas. Os resultados ficam serializados em JSON: na memória (LRU) e,
+    opcionalmente, em um diretório compartilhado entre os workers. O
+    diretório é podado a cada gravação: arquivos expirados (pela data de
+    modificação) e os mais antigos acima de max_itens_disco/max_bytes_disco
+    (por padrão, os mesmos limites da memória).
+    """
+
+    def __init__(self, max_itens=64, max_bytes=256 * 1024 * 1024,
+                 ttl_segundos=3600, diretorio=None, max_itens_disco=None, max_bytes_disco=None):
+        self.memoria = CacheLRU(max_itens=max_itens, max_bytes=max_bytes,
+                                ttl_segundos=ttl_segundos)
+        self.ttl_segundos = ttl_segundos
+        self.diretorio = diretorio
+        self.max_itens_disco = max_itens_disco or max_itens
+        self.max_bytes_disco = max_bytes_disco or max_bytes
+        self.acertos_disco = 0
+        if diretorio:
+            os.makedirs(diretorio, exist_ok=True)
+
+    @staticmethod
+    def gerar_chave(conteudo, assinatura_mapeamento):
+        """Chave do cache: sha256 do arquivo + sha256 do mapeamento"""
+        hash_arquivo = hashlib.sha256(conteudo).hexdigest()
+        hash_mapeamento = hashlib.sha256(assinatura_mapeamento.encode('utf-8')).hexdigest()
+        return f'{hash_arquivo}-{hash_mapeamento[:16]}'
+
+    def obter(self, chave):
+        """Retorna uma cópia do resultado guardado ou None"""
+        serializado = self.memoria.obter(chave)
+
+        if serializado is None and self.diretorio:
+            serializado = self._ler_disco(chave)
+            if serializado is not None:
+                self.acertos_disco += 1
+                self.memoria.guardar(chave, serializado, len(serializado))
+
+        if serializado is None:
+            return None
+        return json.loads(serializado)
+
+    def guardar(self, chave, resultado):
+        serializado = json.dumps(resultado, ensure_ascii=False).encode('utf-8')
+        self.memoria.guardar(chave, serializado, len(serializado))
+        if self.diretorio:
+            self._gravar_disco(chave, serializado)
+
+    def _caminho(self, chave):
+        return os.path.join(self.diretorio, f'{chave}.json')
+
+    def _ler_disco(self, chave):
+        caminho = self._caminho(chave)
+        try:
+            if self.ttl_segundos is not None and \
+                    time.time() - os.path.getmtime(caminho) > self.ttl_segundos:
+                os.remove(caminho)
+                return None
+            with open(caminho, 'rb') as arquivo:
+                return arquivo.read()
+        except OSError:
+            return None
+
+    def _gravar_disco(self, chave, serializado):
+        # Escrita atômica: outro worker nunca lê um arquivo pela metade
+        temporario = None
+        try:
+            descritor, temporario = tempfile.mkstemp(dir=self.diretorio, suffix='.tmp')
+            with os.fdopen(descritor, 'wb') as arquivo:
+                arquivo.write(serializado)
+            os.replace(temporario, self._caminho(chave))
+            temporario = None
+        except OSError:
+            pass
+        finally:
+            if temporario is not None:
+                try:
+                    os.remove(temporario)
+                except OSError:
+                    pass
+        self._podar_disco()
+
+    def _podar_disco(self):
+        """Remove do diretório os expirados e os mais antigos acima dos limites
+
+        Temporários esquecidos (worker que morreu no meio da gravação) saem
+        quando expiram. Arquivos já removidos por outro worker são ignorados.
+        """
+        agora = time.time()
+        arquivos = []
+        try:
+            nomes = os.listdir(self.diretorio)
+        except OSError:
+            return
+        for nome_arquivo in nomes:
+            if not nome_arquivo.endswith(('.json', '.tmp')):
+                continue
+            caminho = os.path.join(self.diretorio, nome_arquivo)
+            try:
+                estado = os.stat(caminho)
+            except OSError:
+                continue
+            expirado = self.ttl_segundos is not None and agora - estado.st_mtime > self.ttl_segundos
+            if nome_arquivo.endswith('.tmp'):
+                if expirado:
+                    arquivos.append((0, 0, caminho))  # só remove
+                continue
+            arquivos.append((0 if expirado else estado.st_mtime, estado.st_size, caminho))
+
+        # Mais recentes primeiro; expirados (mtime 0) ficam no fim e sempre saem
+        arquivos.sort(reverse=True)
+        total_bytes = 0
+        for indice, (modificado_em, tamanho, caminho) in enumerate(arquivos):
+            total_bytes += tamanho
+            if modificado_em and indice < self.max_itens_disco and \
+                    (self.max_bytes_disco is None or total_bytes <= self.max_bytes_disco):
+                continue
+            try:
+                os.remove(caminho)
+            except OSError:
+                pass
+
+    def estatisticas(self):
+        estatisticas = self.memoria.estatisticas()
+        estatisticas['disco'] = self.diretorio is not None
+        if self.diretorio:
+            estatisticas['max_itens_disco'] = self.max_itens_disco
+            estatisticas['max_bytes_disco'] = self.max_bytes_disco
+        estatisticas['acertos_disco'] = self.acertos_disco
+        return estatisticas
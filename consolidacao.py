@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Consolidação de várias planilhas em um ranking regional
+Cada agência exporta seu relatório 6500; as planilhas são lidas em paralelo e os
+registros de cada grupo são combinados por intercalação (k-way merge)
+"""
+
+import heapq
+import multiprocessing
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime
+
+# Analisador de cada processo do pool, por configuração (reaproveitado entre planilhas)
+_analisadores = {}
+
+
+def _analisador_do_processo(mapeamento_colunas, herdar_nome_mesclado):
+    from analise_melhorada import AnalisadorMobilizadoresMelhorado
+
+    chave = (repr(mapeamento_colunas), herdar_nome_mesclado)
+    if chave not in _analisadores:
+        _analisadores[chave] = AnalisadorMobilizadoresMelhorado(
+            mapeamento_colunas=mapeamento_colunas, herdar_nome_mesclado=herdar_nome_mesclado
+        )
+    return _analisadores[chave]
+
+
+def _extrair_planilha(caminho, indice_arquivo, mapeamento_colunas, herdar_nome_mesclado,
+                      modo_leitura, top_k):
+    """Lê uma planilha e devolve, por grupo, (total_registros, entradas ordenadas)
+
+    Roda nos processos do pool. Cada entrada é uma tupla
+    (-valor, indice_arquivo, ordem, nome, valor, valor_original, linha, coluna):
+    as três primeiras posições dão a ordem global e nunca empatam, então
+    as listas de várias planilhas podem ser intercaladas direto. Com top_k
+    só as top_k primeiras de cada grupo são devolvidas, o que basta para o
+    top_k consolidado mesmo com deduplicação por nome.
+    """
+    analisador = _analisador_do_processo(mapeamento_colunas, herdar_nome_mesclado)
+    plano = analisador.plano
+    with open(caminho, 'rb') as arquivo:
+        bloco = analisador._ler_planilha(arquivo, modo_leitura, plano)
+    if bloco is None:
+        raise ValueError('Planilha vazia')
+
+    nomes = analisador._indexar_nomes(bloco)
+    grupos = {}
+    for plano_grupo in plano.grupos:
+        registros = analisador._extrair_registros_grupo(bloco, plano_grupo, nomes)
+        entradas = [
+            (-reg['valor_atingimento'], indice_arquivo, ordem, reg['nome'], reg['valor_atingimento'],
+             reg['valor_original'], reg['linha'], reg['coluna_origem'])
+            for ordem, reg in enumerate(analisador._ordenar_registros(registros, top_k))
+        ]
+        grupos[plano_grupo.nome] = (len(registros), entradas)
+    return grupos
+
+
+def intercalar(listas, deduplicar=True, top_k=None):
+    """Intercala listas de entradas já ordenadas em uma única lista ordenada
+
+    Com deduplicar, cada nome fica só com a primeira entrada, que é a de
+    maior % (no empate, a da planilha anterior), a mesma regra de
+    _extrair_registros_grupo. Nomes provisórios ("Mobilizador <linha>",
+    linhas sem nome) só valem dentro da própria planilha: são
+    deduplicados por (nome, planilha). Para após top_k entradas.
+    """
+    from analise_melhorada import nome_provisorio
+
+    combinadas = []
+    vistos = set()
+    for entrada in heapq.merge(*listas):
+        if deduplicar:
+            _, indice_arquivo, _, nome, _, _, linha, _ = entrada
+            chave = (nome, indice_arquivo) if nome == nome_provisorio(linha) else nome
+            if chave in vistos:
+                continue
+            vistos.add(chave)
+        combinadas.append(entrada)
+        if top_k is not None and len(combinadas) >= top_k:
+            break
+    return combinadas
+
+
+def consolidar_planilhas(caminhos, mapeamento_colunas=None, herdar_nome_mesclado=False,
+                         modo_leitura='completo', workers=None, top_k=None, nomes_arquivos=None,
+                         executor=None):
+    """Consolida várias planilhas em um ranking por grupo
+
+    As planilhas são lidas em um pool de processos (o executor informado
+    ou um pool 'spawn' criado para a chamada). No máximo 2 x workers
+    planilhas ficam em andamento ao mesmo tempo e os resultados são
+    intercalados em lotes, junto com o consolidado parcial: a memória
+    depende da quantidade de nomes distintos (ou de top_k), não da
+    quantidade de arquivos. Planilhas que falham são listadas em
+    resultado['consolidacao']['arquivos'] e ficam de fora do ranking.
+
+    Cada item do ranking traz também 'arquivo' (nome da planilha de origem);
+    total_registros de cada grupo soma os registros de todas as planilhas.
+    Com top_k, resultado['top_k'] indica que os rankings estão truncados.
+    """
+    from analise_melhorada import AnalisadorMobilizadoresMelhorado
+
+    analisador = AnalisadorMobilizadoresMelhorado(
+        mapeamento_colunas=mapeamento_colunas, herdar_nome_mesclado=herdar_nome_mesclado
+    )
+    plano = analisador.plano
+    nomes_arquivos = list(nomes_arquivos or [os.path.basename(caminho) for caminho in caminhos])
+    workers = max(1, min(workers or os.cpu_count() or 1, len(caminhos) or 1))
+
+    parciais = {plano_grupo.nome: [] for plano_grupo in plano.grupos}
+    totais = {plano_grupo.nome: 0 for plano_grupo in plano.grupos}
+    arquivos = [{'arquivo': nome, 'sucesso': False} for nome in nomes_arquivos]
+
+    def combinar(lote):
+        for plano_grupo in plano.grupos:
+            listas = [parciais[plano_grupo.nome]] + [grupos[plano_grupo.nome][1] for grupos in lote]
+            parciais[plano_grupo.nome] = intercalar(
+                listas, plano_grupo.deduplicacao == 'maior_por_nome', top_k
+            )
+
+    def receber(indice, funcao_resultado, lote):
+        try:
+            grupos = funcao_resultado()
+        except Exception as e:
+            arquivos[indice]['erro'] = str(e)
+            return
+        arquivos[indice]['sucesso'] = True
+        arquivos[indice]['registros'] = sum(total for total, _ in grupos.values())
+        for grupo, (total, _) in grupos.items():
+            totais[grupo] += total
+        lote.append(grupos)
+
+    argumentos = (analisador.mapeamento_colunas, herdar_nome_mesclado, modo_leitura, top_k)
+    if workers == 1 and executor is None:
+        for indice, caminho in enumerate(caminhos):
+            lote = []
+            receber(indice, lambda: _extrair_planilha(caminho, indice, *argumentos), lote)
+            combinar(lote)
+    else:
+        proprio = executor is None
+        if proprio:
+            executor = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context('spawn')
+            )
+        try:
+            pendentes = {}
+            fila = iter(enumerate(caminhos))
+            lote = []
+            while True:
+                # Manter o pool ocupado sem enfileirar todas as planilhas de uma vez
+                for indice, caminho in fila:
+                    pendentes[executor.submit(_extrair_planilha, caminho, indice, *argumentos)] = indice
+                    if len(pendentes) >= 2 * workers:
+                        break
+                if not pendentes:
+                    break
+                concluidos, _ = wait(pendentes, return_when=FIRST_COMPLETED)
+                for futuro in concluidos:
+                    receber(pendentes.pop(futuro), futuro.result, lote)
+                if len(lote) >= workers:
+                    combinar(lote)
+                    lote = []
+            combinar(lote)
+        finally:
+            if proprio:
+                executor.shutdown()
+
+    resultado = {'sucesso': False, 'rankings': {}, 'erro': None}
+    if not any(arquivo['sucesso'] for arquivo in arquivos):
+        resultado['erro'] = 'Nenhuma planilha pôde ser processada'
+        resultado['consolidacao'] = {'arquivos': arquivos}
+        return resultado
+
+    for plano_grupo in plano.grupos:
+        ranking = [
+            {
+                'posicao': posicao,
+                'nome': nome,
+                'atingimento_percentual': round(valor, 2),
+                'valor_original': valor_original,
+                'linha': linha,
+                'coluna_origem': coluna,
+                'arquivo': nomes_arquivos[indice_arquivo],
+            }
+            for posicao, (_, indice_arquivo, _, nome, valor, valor_original, linha, coluna)
+            in enumerate(parciais[plano_grupo.nome], 1)
+        ]
+        resultado['rankings'][plano_grupo.nome] = analisador._resultado_grupo(
+            plano_grupo, ranking, totais[plano_grupo.nome]
+        )
+
+    resultado['sucesso'] = True
+    resultado['timestamp'] = datetime.now().isoformat()
+    if top_k is not None:
+        resultado['top_k'] = top_k
+    resultado['consolidacao'] = {'arquivos': arquivos}
+    return resultado
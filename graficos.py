@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Geração dos gráficos de ranking do Sistema de Análise de Mobilizadores
+O backend e o estilo do matplotlib são configurados uma única vez por processo
+"""
+
+import io
+import threading
+import zipfile
+from datetime import datetime
+
+# Cores do Banco do Brasil
+CORES_BB = {
+    'primaria': '#1e3a8a',      # Azul BB
+    'secundaria': '#3b82f6',    # Azul claro
+    'destaque': '#fbbf24',      # Amarelo BB
+    'fundo': '#f8fafc',         # Cinza claro
+    'texto': '#1f2937',         # Cinza escuro
+    'alternativa': '#10b981'    # Verde
+}
+
+# Quantidade de posições exibidas no gráfico
+POSICOES_GRAFICO = 10
+
+# Limites aceitos para as opções de renderização
+DPI_PADRAO = 300
+DPI_MINIMO = 50
+DPI_MAXIMO = 300
+TAMANHO_PADRAO = (12, 8)  # polegadas
+TAMANHO_MINIMO = 4
+TAMANHO_MAXIMO = 20
+
+_graficos_prontos = False
+_lock_preparo = threading.Lock()
+
+
+def preparar_graficos():
+    """Configura backend e estilo do matplotlib (idempotente)"""
+    global _graficos_prontos
+    if _graficos_prontos:
+        return
+
+    with _lock_preparo:
+        if _graficos_prontos:
+            return
+
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+        import seaborn as sns
+
+        plt.style.use('seaborn-v0_8')
+        sns.set_palette("husl")
+        _graficos_prontos = True
+
+
+def criar_figura(largura=TAMANHO_PADRAO[0], altura=TAMANHO_PADRAO[1]):
+    """Cria uma figura com canvas Agg próprio, sem passar pelo estado global do pyplot"""
+    preparar_graficos()
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    fig = Figure(figsize=(largura, altura))
+    FigureCanvasAgg(fig)
+    return fig
+
+
+def _data_geracao(resultado):
+    """Data exibida no gráfico: a da análise, para a imagem ser estável no cache"""
+    try:
+        return datetime.fromisoformat(resultado['timestamp'])
+    except (KeyError, TypeError, ValueError):
+        return datetime.now()
+
+
+def desenhar_ranking(fig, grupo, resultado):
+    """Desenha o ranking de um grupo na figura (que é limpa antes)"""
+    fig.clear()
+    fig.patch.set_facecolor(CORES_BB['fundo'])
+    ax = fig.add_subplot()
+
+    # Título
+    ax.text(0.5, 0.95, f'Ranking - {grupo}',
+            horizontalalignment='center', verticalalignment='center',
+            fontsize=16, fontweight='bold', color=CORES_BB['primaria'],
+            transform=ax.transAxes)
+
+    # Adicionar informações do sistema
+    ax.text(0.5, 0.90, f'Critério: % de Atingimento | Gerado em: {_data_geracao(resultado).strftime("%d/%m/%Y %H:%M")}',
+            horizontalalignment='center', verticalalignment='center',
+            fontsize=10, color=CORES_BB['texto'],
+            transform=ax.transAxes)
+
+    # Nota de correção aplicada
+    if 'Agro' in grupo or 'Regulariza' in grupo:
+        ax.text(0.5, 0.86, '✅ Mapeamento corrigido para capturar todos os registros',
+                horizontalalignment='center', verticalalignment='center',
+                fontsize=9, color=CORES_BB['alternativa'],
+                transform=ax.transAxes)
+
+    # Obter dados do ranking
+    dados_grupo = resultado.get('rankings', {}).get(grupo, {})
+    ranking = dados_grupo.get('ranking', [])
+
+    if not ranking:
+        ax.text(0.5, 0.5, 'Nenhum dado disponível para este grupo',
+                horizontalalignment='center', verticalalignment='center',
+                fontsize=12, color=CORES_BB['texto'],
+                transform=ax.transAxes)
+    else:
+        # Preparar dados para o gráfico
+        nomes = [item['nome'][:25] + '...' if len(item['nome']) > 25 else item['nome'] for item in ranking[:POSICOES_GRAFICO]]
+        valores = [item['atingimento_percentual'] for item in ranking[:POSICOES_GRAFICO]]
+        total_registros = dados_grupo.get('total_registros', len(ranking))
+
+        # Criar gráfico de barras horizontal
+        cores_barras = [CORES_BB['secundaria'] if i % 2 == 0 else CORES_BB['alternativa']
+                        for i in range(len(valores))]
+
+        ax.barh(range(len(nomes)), valores, color=cores_barras, alpha=0.8)
+
+        # Personalizar eixos
+        ax.set_yticks(range(len(nomes)))
+        ax.set_yticklabels([f"{i+1}. {nome}" for i, nome in enumerate(nomes)])
+        ax.set_xlabel('% de Atingimento', fontsize=12, color=CORES_BB['texto'])
+
+        # Adicionar valores nas barras
+        for i, valor in enumerate(valores):
+            ax.text(valor + 1, i, f'{valor:.1f}%',
+                    va='center', ha='left', fontweight='bold', color=CORES_BB['texto'])
+
+        # Configurar limites e grid
+        ax.set_xlim(0, max(valores) + 10 if valores else 100)
+        ax.grid(True, alpha=0.3, axis='x')
+
+        # Inverter ordem para mostrar maior no topo
+        ax.invert_yaxis()
+
+        # Adicionar informações adicionais
+        ax.text(0.02, 0.02, f'Total de registros: {total_registros}',
+                transform=ax.transAxes, fontsize=10,
+                color=CORES_BB['texto'], alpha=0.7)
+
+    # Remover bordas desnecessárias
+    ax.spines['top'].set_visible(False)
+    ax.spines['right'].set_visible(False)
+
+    # tight_layout já ajusta as margens; bbox_inches='tight' no savefig
+    # custaria uma renderização extra
+    fig.tight_layout()
+
+
+def salvar_png(fig, dpi=DPI_PADRAO):
+    img_buffer = io.BytesIO()
+    fig.savefig(img_buffer, format='png', dpi=dpi)
+    return img_buffer.getvalue()
+
+
+def renderizar_ranking_png(grupo, resultado, dpi=DPI_PADRAO,
+                           largura=TAMANHO_PADRAO[0], altura=TAMANHO_PADRAO[1]):
+    """Gera o PNG do ranking de um grupo"""
+    fig = criar_figura(largura, altura)
+    desenhar_ranking(fig, grupo, resultado)
+    return salvar_png(fig, dpi)
+
+
+def nome_arquivo_ranking(grupo, extensao='png'):
+    return f'ranking_{grupo.replace(" ", "_").replace("/", "-").lower()}.{extensao}'
+
+
+def resumir_para_grafico(resultado, grupos):
+    """Reduz o resultado ao que os gráficos usam (top 10 de cada grupo)
+
+    Evita enviar rankings inteiros para os processos de renderização.
+    """
+    rankings = resultado.get('rankings', {})
+    resumo = {}
+    for grupo in grupos:
+        dados_grupo = rankings.get(grupo, {})
+        ranking = dados_grupo.get('ranking', [])
+        resumo[grupo] = {
+            'total_registros': dados_grupo.get('total_registros', len(ranking)),
+            'ranking': ranking[:POSICOES_GRAFICO],
+        }
+    return {'timestamp': resultado.get('timestamp'), 'rankings': resumo}
+
+
+def renderizar_grupos_png(grupos, resultado, dpi=DPI_PADRAO,
+                          largura=TAMANHO_PADRAO[0], altura=TAMANHO_PADRAO[1]):
+    """Renderiza vários grupos reaproveitando a mesma figura
+
+    Retorna [(grupo, png_bytes)] na ordem recebida. Função de módulo para
+    poder ser enviada a um ProcessPoolExecutor.
+    """
+    fig = criar_figura(largura, altura)
+    imagens = []
+    for grupo in grupos:
+        desenhar_ranking(fig, grupo, resultado)
+        imagens.append((grupo, salvar_png(fig, dpi)))
+    return imagens
+
+
+def renderizar_pdf(grupos, resultado, largura=TAMANHO_PADRAO[0], altura=TAMANHO_PADRAO[1]):
+    """Gera um PDF com uma página por grupo, reaproveitando a mesma figura"""
+    from matplotlib.backends.backend_pdf import PdfPages
+
+    fig = criar_figura(largura, altura)
+    buffer = io.BytesIO()
+    with PdfPages(buffer) as pdf:
+        for grupo in grupos:
+            desenhar_ranking(fig, grupo, resultado)
+            pdf.savefig(fig)
+    return buffer.getvalue()
+
+
+def renderizar_grupos_paralelo(grupos, resultado, dpi=DPI_PADRAO,
+                               largura=TAMANHO_PADRAO[0], altura=TAMANHO_PADRAO[1],
+                               executor=None, workers=1):
+    """Distribui a renderização dos grupos entre os processos do executor
+
+    Cada um dos workers processos renderiza um lote de grupos com uma única
+    figura. Sem executor (ou com um só grupo) tudo roda no processo atual.
+    Retorna {grupo: png_bytes}.
+    """
+    if not grupos:
+        return {}
+
+    resumo = resumir_para_grafico(resultado, grupos)
+
+    if executor is None or workers <= 1 or len(grupos) == 1:
+        return dict(renderizar_grupos_png(grupos, resumo, dpi, largura, altura))
+
+    lotes = [grupos[i::workers] for i in range(min(workers, len(grupos)))]
+    futuros = [
+        executor.submit(renderizar_grupos_png, lote, resumo, dpi, largura, altura)
+        for lote in lotes
+    ]
+    imagens = {}
+    for futuro in futuros:
+        imagens.update(futuro.result())
+    return imagens
+
+
+def montar_zip(imagens, grupos):
+    """Empacota os PNGs em um ZIP, na ordem dos grupos"""
+    buffer = io.BytesIO()
+    # PNG já é comprimido; ZIP_STORED evita gastar CPU à toa
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as arquivo_zip:
+        for grupo in grupos:
+            arquivo_zip.writestr(nome_arquivo_ranking(grupo), imagens[grupo])
+    return buffer.getvalue()
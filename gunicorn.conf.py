@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+"""
+Configuração do gunicorn para produção (Procfile: gunicorn -c gunicorn.conf.py app:app)
+O app é carregado e aquecido no processo mestre; os workers nascem por fork já prontos
+"""
+
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+# Threads por worker: o NDJSON e os jobs assíncronos rodam em threads próprias
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+# Uploads de até 50 MB em modo completo podem passar de 30 s em máquinas pequenas
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+# Importar o app uma única vez no mestre; as páginas ficam compartilhadas (copy-on-write)
+preload_app = True
+accesslog = '-'
+
+
+def on_starting(server):
+    """Aquece o app no mestre, antes de abrir a porta e criar os workers"""
+    import app
+
+    # Métricas de uma execução anterior do servidor não entram na soma
+    app.metricas.limpar()
+    app.aquecer()
+    server.log.info(f"App importado em {app._inicializacao['importacao_s']:.2f}s e aquecido")
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Reanálise incremental do Sistema de Análise de Mobilizadores
+Mantém os rankings ordenados entre uploads e compara a planilha nova com a anterior
+"""
+
+import sys
+from bisect import bisect_left, insort
+from dataclasses import dataclass
+
+# Acima desta fração de entradas alteradas, reordenar tudo sai mais barato
+# do que remover/inserir uma a uma
+FRACAO_REORDENAR = 0.125
+
+# Estimativa do tamanho de um registro guardado (dict, chaves de ordenação e índices)
+BYTES_POR_REGISTRO = 600
+# Células amostradas por coluna para estimar o tamanho do bloco
+AMOSTRA_CELULAS = 256
+
+
+def _tamanho_lista(valores):
+    """Bytes aproximados de uma lista e dos seus valores, por amostragem"""
+    tamanho = sys.getsizeof(valores)
+    if not valores:
+        return tamanho
+    passo = max(1, len(valores) // AMOSTRA_CELULAS)
+    amostra = valores[::passo]
+    media = sum(sys.getsizeof(valor) for valor in amostra if valor is not None) / len(amostra)
+    return tamanho + int(media * len(valores))
+
+
+@dataclass
+class EstadoIncremental:
+    """O que é preciso guardar de uma análise para atualizar a próxima"""
+    assinatura: str
+    bloco: dict
+    nomes: list
+    rankings: dict  # grupo -> RankingIncremental
+
+    def tamanho_aproximado(self):
+        """Memória aproximada do estado em bytes (para o limite do cache de estados)"""
+        return (
+            sum(_tamanho_lista(valores) for valores in self.bloco.values())
+            + _tamanho_lista(self.nomes)
+            + sum(ranking.tamanho_aproximado() for ranking in self.rankings.values())
+        )
+
+
+class RankingIncremental:
+    """
+    Ranking de um grupo mantido ordenado entre uploads
+
+    A ordem é a mesma do processamento completo: maior % primeiro e, no
+    empate, quem apareceu antes na varredura (coluna de busca, depois
+    linha). Com deduplicação 'maior_por_nome' cada nome entra uma vez,
+    com seu maior %.
+    """
+
+    def __init__(self, plano_grupo):
+        self.deduplicacao = plano_grupo.deduplicacao
+        self._ordem_coluna = {letra: i for i, letra in enumerate(plano_grupo.colunas_busca)}
+        self._por_linha = {}        # posição -> registros extraídos da linha
+        self._linhas_por_nome = {}  # nome -> posições em que aparece
+        self._chave_entrada = {}    # entrada (nome ou célula) -> chave de ordenação
+        self._registros = {}        # chave de ordenação -> registro
+        self._ordenado = []         # chaves de ordenação, em ordem crescente
+
+    def __len__(self):
+        return len(self._ordenado)
+
+    def tamanho_aproximado(self):
+        """Bytes aproximados dos registros guardados"""
+        return sum(len(registros) for registros in self._por_linha.values()) * BYTES_POR_REGISTRO
+
+    def _ocorrencia(self, registro):
+        return self._ordem_coluna[registro['coluna_origem']], registro['linha'] - 2
+
+    def _entrada(self, registro):
+        if self.deduplicacao == 'nenhuma':
+            return self._ocorrencia(registro)
+        return registro['nome']
+
+    def atualizar(self, registros_por_linha):
+        """Substitui os registros das linhas informadas ({posição: [registros]})
+
+        Linhas com lista vazia deixam de contribuir para o ranking.
+        """
+        afetadas = set()
+        for posicao, novos in registros_por_linha.items():
+            for registro in self._por_linha.pop(posicao, ()):
+                afetadas.add(self._entrada(registro))
+                # Os registros de uma linha compartilham o nome
+                linhas = self._linhas_por_nome.get(registro['nome'])
+                if linhas is not None:
+                    linhas.discard(posicao)
+                    if not linhas:
+                        del self._linhas_por_nome[registro['nome']]
+            if novos:
+                self._por_linha[posicao] = novos
+                for registro in novos:
+                    afetadas.add(self._entrada(registro))
+                    self._linhas_por_nome.setdefault(registro['nome'], set()).add(posicao)
+
+        reordenar = len(afetadas) > len(self._ordenado) * FRACAO_REORDENAR
+        # Primeiro remove todas as chaves antigas: uma entrada nova pode herdar
+        # a chave de outra (linha que trocou de nome)
+        for entrada in afetadas:
+            chave_antiga = self._chave_entrada.pop(entrada, None)
+            if chave_antiga is not None:
+                del self._registros[chave_antiga]
+                if not reordenar:
+                    del self._ordenado[bisect_left(self._ordenado, chave_antiga)]
+
+        for entrada in afetadas:
+            chave, registro = self._melhor_registro(entrada)
+            if registro is None:
+                continue
+            self._chave_entrada[entrada] = chave
+            self._registros[chave] = registro
+            if not reordenar:
+                insort(self._ordenado, chave)
+
+        if reordenar:
+            self._ordenado = sorted(self._registros)
+
+    def _melhor_registro(self, entrada):
+        """Chave de ordenação e registro que representam a entrada"""
+        if self.deduplicacao == 'nenhuma':
+            coluna, posicao = entrada
+            for registro in self._por_linha.get(posicao, ()):
+                if self._ocorrencia(registro) == entrada:
+                    return (-registro['valor_atingimento'], coluna, posicao), registro
+            return None, None
+
+        candidatos = [
+            (self._ocorrencia(registro), registro)
+            for posicao in self._linhas_por_nome.get(entrada, ())
+            for registro in self._por_linha[posicao]
+        ]
+        if not candidatos:
+            return None, None
+        candidatos.sort(key=lambda item: item[0])
+        # Maior %; no empate fica a primeira ocorrência, como no processamento completo
+        _, melhor = max(candidatos, key=lambda item: item[1]['valor_atingimento'])
+        return (-melhor['valor_atingimento'],) + candidatos[0][0], melhor
+
+    def registros(self):
+        """Registros na ordem do ranking"""
+        return [self._registros[chave] for chave in self._ordenado]
+
+
+def posicoes_alteradas(antigos, novos):
+    """Posições em que duas colunas diferem (valor ou tipo)
+
+    Linhas que só existem em uma das listas contam como alteradas.
+    """
+    if antigos == novos and list(map(type, antigos)) == list(map(type, novos)):
+        return set()
+    comuns = min(len(antigos), len(novos))
+    alteradas = {
+        posicao for posicao, (antigo, novo) in enumerate(zip(antigos, novos))
+        if antigo != novo or type(antigo) is not type(novo)
+    }
+    alteradas.update(range(comuns, max(len(antigos), len(novos))))
+    return alteradas
+
+
+def anotar_movimentacao(ranking, ranking_anterior):
+    """Acrescenta posicao_anterior e variacao a cada item do ranking
+
+    variacao > 0 indica que o mobilizador subiu; quem não estava no ranking
+    anterior fica com posicao_anterior e variacao None. Retorna os nomes
+    que saíram do ranking.
+    """
+    posicoes_anteriores = {}
+    for item in ranking_anterior:
+        posicoes_anteriores.setdefault(item['nome'], item['posicao'])
+
+    presentes = set()
+    for item in ranking:
+        posicao_anterior = posicoes_anteriores.get(item['nome'])
+        item['posicao_anterior'] = posicao_anterior
+        item['variacao'] = None if posicao_anterior is None else posicao_anterior - item['posicao']
+        presentes.add(item['nome'])
+
+    return [nome for nome in posicoes_anteriores if nome not in presentes]
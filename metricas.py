@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Métricas de desempenho do Sistema de Análise de Mobilizadores
+Tempos por etapa, contagens por grupo e memória de cada análise, agregados em histogramas
+"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Limites dos histogramas (Prometheus: cada bucket conta as observações <= limite)
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+BUCKETS_CONTAGEM = (10, 100, 1000, 10_000, 100_000, 1_000_000, 10_000_000)
+BUCKETS_BYTES = tuple(mb * 1024 * 1024 for mb in (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2000))
+
+try:
+    _TAMANHO_PAGINA = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError, OSError):
+    _TAMANHO_PAGINA = None
+
+
+def rss_atual():
+    """Memória residente do processo em bytes (None fora do Linux)"""
+    if _TAMANHO_PAGINA is None:
+        return None
+    try:
+        with open('/proc/self/statm', 'rb') as arquivo:
+            return int(arquivo.read().split()[1]) * _TAMANHO_PAGINA
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+class Medicao:
+    """
+    Tempos, contagens e memória de uma análise
+
+    Cada etapa é cronometrada com perf_counter e, ao terminar, amostra o
+    RSS do processo; o pico é o maior RSS visto nessas amostras menos o
+    RSS do início. Com requisições simultâneas no mesmo worker o RSS é
+    compartilhado, então o pico é uma aproximação.
+    """
+
+    def __init__(self):
+        self.etapas = {}   # etapa -> segundos
+        self.grupos = {}   # grupo -> {extracao_s, ranking_s, celulas_varridas, registros}
+        self._rss_inicial = rss_atual()
+        self._rss_pico = self._rss_inicial
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def etapa(self, nome):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.registrar_etapa(nome, time.perf_counter() - inicio)
+
+    def registrar_etapa(self, nome, segundos):
+        with self._lock:
+            self.etapas[nome] = self.etapas.get(nome, 0.0) + segundos
+        self.amostrar_memoria()
+
+    def registrar_grupo(self, grupo, medidas):
+        """medidas: dict com extracao_s, ranking_s, celulas_varridas e registros"""
+        with self._lock:
+            self.grupos[grupo] = dict(medidas)
+        self.amostrar_memoria()
+
+    def amostrar_memoria(self):
+        rss = rss_atual()
+        if rss is not None:
+            with self._lock:
+                self._rss_pico = max(self._rss_pico or 0, rss)
+
+    @property
+    def pico_memoria(self):
+        """Crescimento máximo do RSS durante a análise, em bytes"""
+        if self._rss_inicial is None:
+            return None
+        return max(self._rss_pico - self._rss_inicial, 0)
+
+    def resumo(self):
+        """Dict serializável com tudo o que foi medido"""
+        with self._lock:
+            return {
+                'etapas_s': {etapa: round(segundos, 6) for etapa, segundos in self.etapas.items()},
+                'grupos': {
+                    grupo: {chave: round(valor, 6) if isinstance(valor, float) else valor
+                            for chave, valor in medidas.items()}
+                    for grupo, medidas in self.grupos.items()
+                },
+                'pico_memoria_bytes': self.pico_memoria,
+            }
+
+
+class Histograma:
+    """Histograma cumulativo no formato do Prometheus (sem rótulos próprios)"""
+
+    def __init__(self, limites):
+        self.limites = tuple(limites)
+        self.contagens = [0] * (len(self.limites) + 1)  # o último é o +Inf
+        self.soma = 0.0
+        self.total = 0
+
+    def observar(self, valor):
+        self.contagens[bisect_left(self.limites, valor)] += 1
+        self.soma += valor
+        self.total += 1
+
+
+def _escapar_rotulo(valor):
+    return str(valor).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _rotulos(pares):
+    if not pares:
+        return ''
+    return '{' + ','.join(f'{chave}="{_escapar_rotulo(valor)}"' for chave, valor in pares) + '}'
+
+
+def _numero(valor):
+    if valor == float('inf'):
+        return '+Inf'
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+class RegistroMetricas:
+    """
+    Agrega as medições e exporta em texto do Prometheus
+
+    Cada worker agrega as suas medições na memória. Com diretorio, cada
+    processo grava também uma cópia delas em diretorio/<pid>-<id>.json a cada
+    atualização, e texto_prometheus soma os arquivos de todos os
+    processos: qualquer worker que atenda a coleta devolve o total do
+    servidor, sem saltos entre workers. Arquivos de workers que morreram
+    continuam somando (os contadores nunca diminuem); limpar() zera tudo
+    e é chamado quando o servidor sobe. Sem diretorio, só o próprio
+    processo é exportado.
+    """
+
+    # nome -> (tipo, ajuda, limites do histograma)
+    METRICAS = {
+        'mobilizadores_analises_total': ('counter', 'Análises por resultado', None),
+        'mobilizadores_etapa_segundos': ('histogram', 'Duração de cada etapa da análise', BUCKETS_SEGUNDOS),
+        'mobilizadores_grupo_segundos': ('histogram', 'Duração da extração e do ranking por grupo',
+                                         BUCKETS_SEGUNDOS),
+        'mobilizadores_celulas_varridas': ('histogram', 'Células varridas por grupo em cada análise',
+                                           BUCKETS_CONTAGEM),
+        'mobilizadores_registros_mantidos': ('histogram', 'Registros mantidos por grupo em cada análise',
+                                             BUCKETS_CONTAGEM),
+        'mobilizadores_pico_memoria_bytes': ('histogram', 'Crescimento máximo do RSS durante a análise',
+                                             BUCKETS_BYTES),
+    }
+
+    def __init__(self, diretorio=None):
+        self.diretorio = diretorio
+        self._lock = threading.Lock()
+        self._contadores = {}    # (nome, rótulos) -> valor
+        self._histogramas = {}   # (nome, rótulos) -> Histograma
+        self._pid = os.getpid()
+        self._arquivo = None
+
+    def incrementar(self, nome, valor=1, **rotulos):
+        self._incrementar(nome, valor, rotulos)
+        self._persistir()
+
+    def observar(self, nome, valor, **rotulos):
+        self._observar(nome, valor, rotulos)
+        self._persistir()
+
+    def _incrementar(self, nome, valor, rotulos):
+        chave = (nome, tuple(sorted(rotulos.items())))
+        with self._lock:
+            self._verificar_processo()
+            self._contadores[chave] = self._contadores.get(chave, 0) + valor
+
+    def _observar(self, nome, valor, rotulos):
+        chave = (nome, tuple(sorted(rotulos.items())))
+        with self._lock:
+            self._verificar_processo()
+            histograma = self._histogramas.get(chave)
+            if histograma is None:
+                histograma = self._histogramas[chave] = Histograma(self.METRICAS[nome][2])
+            histograma.observar(valor)
+
+    def _verificar_processo(self):
+        # Depois do fork, as amostras herdadas do mestre já são dele
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._arquivo = None
+            self._contadores = {}
+            self._histogramas = {}
+
+    def registrar(self, medicao, situacao):
+        """Agrega uma Medicao; situacao é 'sucesso', 'cache' ou 'erro'"""
+        self._incrementar('mobilizadores_analises_total', 1, {'situacao': situacao})
+        resumo = medicao.resumo()
+        for etapa, segundos in resumo['etapas_s'].items():
+            self._observar('mobilizadores_etapa_segundos', segundos, {'etapa': etapa})
+        for grupo, medidas in resumo['grupos'].items():
+            for etapa in ('extracao', 'ranking'):
+                if f'{etapa}_s' in medidas:
+                    self._observar('mobilizadores_grupo_segundos', medidas[f'{etapa}_s'],
+                                   {'grupo': grupo, 'etapa': etapa})
+            if 'celulas_varridas' in medidas:
+                self._observar('mobilizadores_celulas_varridas', medidas['celulas_varridas'], {'grupo': grupo})
+            if 'registros' in medidas:
+                self._observar('mobilizadores_registros_mantidos', medidas['registros'], {'grupo': grupo})
+        if resumo['pico_memoria_bytes'] is not None:
+            self._observar('mobilizadores_pico_memoria_bytes', resumo['pico_memoria_bytes'], {})
+        self._persistir()
+
+    def _amostras(self):
+        """Contadores e histogramas deste processo: ({chave: valor}, {chave: (contagens, soma, total)})"""
+        with self._lock:
+            self._verificar_processo()
+            contadores = dict(self._contadores)
+            histogramas = {
+                chave: (list(h.contagens), h.soma, h.total) for chave, h in self._histogramas.items()
+            }
+        return contadores, histogramas
+
+    def _persistir(self):
+        """Grava as amostras deste processo no diretório compartilhado"""
+        if not self.diretorio:
+            return
+        contadores, histogramas = self._amostras()
+        if self._arquivo is None:
+            self._arquivo = os.path.join(self.diretorio, f'{os.getpid()}-{uuid.uuid4().hex[:8]}.json')
+        conteudo = json.dumps({
+            'contadores': [[nome, rotulos, valor] for (nome, rotulos), valor in contadores.items()],
+            'histogramas': [[nome, rotulos, *amostra] for (nome, rotulos), amostra in histogramas.items()],
+        }, ensure_ascii=False)
+
+        # Escrita atômica: a coleta nunca lê um arquivo pela metade
+        temporario = None
+        try:
+            os.makedirs(self.diretorio, exist_ok=True)
+            descritor, temporario = tempfile.mkstemp(dir=self.diretorio, suffix='.tmp')
+            with os.fdopen(descritor, 'w', encoding='utf-8') as arquivo:
+                arquivo.write(conteudo)
+            os.replace(temporario, self._arquivo)
+            temporario = None
+        except OSError:
+            pass
+        finally:
+            if temporario is not None:
+                try:
+                    os.remove(temporario)
+                except OSError:
+                    pass
+
+    def _amostras_servidor(self):
+        """Amostras somadas de todos os processos do diretório (e deste)"""
+        contadores, histogramas = self._amostras()
+        if not self.diretorio:
+            return contadores, histogramas
+        try:
+            nomes = os.listdir(self.diretorio)
+        except OSError:
+            return contadores, histogramas
+
+        proprio = os.path.basename(self._arquivo) if self._arquivo else None
+        for nome_arquivo in nomes:
+            if not nome_arquivo.endswith('.json') or nome_arquivo == proprio:
+                continue
+            try:
+                with open(os.path.join(self.diretorio, nome_arquivo), encoding='utf-8') as arquivo:
+                    dados = json.load(arquivo)
+            except (OSError, ValueError):
+                continue
+            for nome, rotulos, valor in dados.get('contadores', []):
+                chave = (nome, tuple(tuple(par) for par in rotulos))
+                contadores[chave] = contadores.get(chave, 0) + valor
+            for nome, rotulos, contagens, soma, total in dados.get('histogramas', []):
+                chave = (nome, tuple(tuple(par) for par in rotulos))
+                if chave in histogramas:
+                    atuais, soma_atual, total_atual = histogramas[chave]
+                    contagens = [a + b for a, b in zip(atuais, contagens)]
+                    soma, total = soma + soma_atual, total + total_atual
+                histogramas[chave] = (contagens, soma, total)
+        return contadores, histogramas
+
+    def limpar(self):
+        """Zera as métricas deste processo e apaga as dos outros no diretório"""
+        with self._lock:
+            self._contadores = {}
+            self._histogramas = {}
+        if not self.diretorio:
+            return
+        try:
+            nomes = os.listdir(self.diretorio)
+        except OSError:
+            return
+        for nome_arquivo in nomes:
+            if nome_arquivo.endswith(('.json', '.tmp')):
+                try:
+                    os.remove(os.path.join(self.diretorio, nome_arquivo))
+                except OSError:
+                    pass
+
+    def texto_prometheus(self):
+        """Todas as séries no formato de exposição de texto do Prometheus"""
+        contadores, histogramas = self._amostras_servidor()
+        contadores = sorted(contadores.items())
+        histogramas = sorted(
+            (chave, (contagens, soma, total, self.METRICAS[chave[0]][2]))
+            for chave, (contagens, soma, total) in histogramas.items()
+            if chave[0] in self.METRICAS
+        )
+
+        linhas = []
+        for nome, (tipo, ajuda, _) in self.METRICAS.items():
+            linhas.append(f'# HELP {nome} {ajuda}')
+            linhas.append(f'# TYPE {nome} {tipo}')
+            if tipo == 'counter':
+                for (nome_serie, rotulos), valor in contadores:
+                    if nome_serie == nome:
+                        linhas.append(f'{nome}{_rotulos(rotulos)} {_numero(valor)}')
+                continue
+
+            for (nome_serie, rotulos), (contagens, soma, total, limites) in histogramas:
+                if nome_serie != nome:
+                    continue
+                acumulado = 0
+                for limite, contagem in zip(limites + (float('inf'),), contagens):
+                    acumulado += contagem
+                    rotulos_bucket = rotulos + (('le', _numero(limite)),)
+                    linhas.append(f'{nome}_bucket{_rotulos(rotulos_bucket)} {acumulado}')
+                linhas.append(f'{nome}_sum{_rotulos(rotulos)} {_numero(soma)}')
+                linhas.append(f'{nome}_count{_rotulos(rotulos)} {total}')
+        return '\n'.join(linhas) + '\n'
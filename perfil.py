@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Perfis de execução sob demanda do Sistema de Análise de Mobilizadores
+Roda uma chamada sob o cProfile e guarda o resultado em um arquivo .prof (formato pstats)
+"""
+
+import io
+import os
+import re
+import threading
+import uuid
+
+_RE_PERFIL_ID = re.compile(r'^[0-9a-f]{32}$')
+
+
+class PerfilOcupado(RuntimeError):
+    """Já existe uma chamada sendo perfilada neste processo"""
+
+
+class Perfilador:
+    """
+    Executa chamadas sob o cProfile, uma de cada vez
+
+    O cProfile só enxerga a thread que chamou executar e o próprio
+    processo (grupos extraídos no modo 'processos' aparecem como espera).
+    Os perfis ficam em diretorio; só os max_perfis mais recentes são mantidos.
+    """
+
+    def __init__(self, diretorio, max_perfis=20):
+        self.diretorio = diretorio
+        self.max_perfis = max_perfis
+        self._lock = threading.Lock()
+
+    def executar(self, funcao, *args, **kwargs):
+        """Chama funcao(*args, **kwargs) sob o profiler; retorna (resultado, perfil_id)
+
+        Levanta PerfilOcupado se outra chamada já estiver sendo perfilada.
+        """
+        import cProfile
+
+        if not self._lock.acquire(blocking=False):
+            raise PerfilOcupado('Já existe uma requisição sendo perfilada; tente novamente')
+        try:
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                resultado = funcao(*args, **kwargs)
+            finally:
+                profiler.disable()
+        finally:
+            self._lock.release()
+
+        perfil_id = uuid.uuid4().hex
+        os.makedirs(self.diretorio, exist_ok=True)
+        profiler.dump_stats(self.caminho(perfil_id))
+        self._podar()
+        return resultado, perfil_id
+
+    def caminho(self, perfil_id):
+        """Arquivo .prof de um perfil; levanta ValueError para ids inválidos"""
+        if not _RE_PERFIL_ID.match(perfil_id or ''):
+            raise ValueError('perfil_id inválido')
+        return os.path.join(self.diretorio, f'{perfil_id}.prof')
+
+    def resumo_texto(self, perfil_id, ordem='cumulative', limite=40):
+        """Relatório do pstats com as limite funções mais caras"""
+        import pstats
+
+        saida = io.StringIO()
+        estatisticas = pstats.Stats(self.caminho(perfil_id), stream=saida)
+        estatisticas.strip_dirs().sort_stats(ordem).print_stats(limite)
+        return saida.getvalue()
+
+    def _podar(self):
+        try:
+            arquivos = [
+                os.path.join(self.diretorio, nome) for nome in os.listdir(self.diretorio)
+                if nome.endswith('.prof')
+            ]
+            arquivos.sort(key=os.path.getmtime)
+            for caminho in arquivos[:-self.max_perfis]:
+                os.remove(caminho)
+        except OSError:
+            pass
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Gerador de planilhas sintéticas no formato do relatório 6500
+Usado pelos benchmarks para medir o processamento sem depender de dados reais
+"""
+
+import argparse
+import random
+
+import openpyxl
+from openpyxl.utils import get_column_letter
+
+from analise_melhorada import AnalisadorMobilizadoresMelhorado
+from plano_extracao import converter_coluna_para_indice
+
+
+def _colunas_percentuais(plano):
+    """Índices de todas as colunas varridas pelos grupos do plano"""
+    return sorted({indice for plano_grupo in plano.grupos for indice in plano_grupo.indices_busca})
+
+
+def _colunas_auxiliares(mapeamento, percentuais):
+    """Índice -> tipo das demais colunas do mapeamento (valores e categorias)"""
+    auxiliares = {}
+    for config in mapeamento.values():
+        for info in config['campos_disponiveis'].values():
+            indice = converter_coluna_para_indice(info['coluna'])
+            if indice not in percentuais and info['tipo'] != 'porcentagem':
+                auxiliares[indice] = info['tipo']
+    return auxiliares
+
+
+def _valor_percentual(rnd):
+    """Sorteia um valor de atingimento em um dos formatos vistos nos relatórios"""
+    sorteio = rnd.random()
+    if sorteio < 0.15:
+        return None
+    if sorteio < 0.55:
+        return round(rnd.uniform(0, 1.3), 4)  # decimal (0,875 = 87,5%)
+    if sorteio < 0.75:
+        return round(rnd.uniform(0, 130), 2)  # já em percentual
+    if sorteio < 0.80:
+        return ''  # célula de texto vazia
+    if sorteio < 0.85:
+        return f'{rnd.uniform(0, 130):.2f}'.replace('.', ',') + ' %'  # "87,50 %"
+    return f'{rnd.uniform(0, 130):.1f}'.replace('.', ',') + '%'  # texto "87,5%"
+
+
+def _valor_auxiliar(rnd, tipo):
+    if tipo == 'categoria':
+        return rnd.choice(['Acelerar', 'Manter', 'Atenção', 'Crítico'])
+    if rnd.random() < 0.2:
+        return f'R$ {rnd.uniform(0, 1e6):,.2f}'.replace(',', '_').replace('.', ',').replace('_', '.')
+    return round(rnd.uniform(0, 1e6), 2)
+
+
+def gerar_planilha(caminho, linhas=1000, semente=6500, mesclados=True, totais=True):
+    """Gera uma planilha sintética com o número de linhas informado
+
+    Além dos % em todos os formatos que o relatório traz, inclui linhas em
+    branco, nomes mesclados em várias linhas (só a primeira célula tem o
+    valor) e, com totais, linhas de totalização ('Total', 'Soma', 'Geral')
+    espalhadas entre as agências.
+    """
+    rnd = random.Random(semente)
+    analisador = AnalisadorMobilizadoresMelhorado()
+    colunas = _colunas_percentuais(analisador.plano)
+    auxiliares = _colunas_auxiliares(analisador.mapeamento_colunas, set(colunas))
+    max_coluna = max(colunas + list(auxiliares))
+
+    workbook = openpyxl.Workbook(write_only=True)
+    worksheet = workbook.create_sheet('Relatório 6500')
+    worksheet.append(['Mobilizador', 'Prefixo', 'Supervisão', 'Carteira'] +
+                     [get_column_letter(i) for i in range(5, max_coluna + 1)])
+
+    linha = 2
+    mesclagem_restante = 0
+    while linha < linhas + 2:
+        valores = [None] * max_coluna
+        sorteio = rnd.random()
+
+        if not mesclagem_restante and sorteio < 0.02:
+            # Linha em branco separando blocos
+            worksheet.append(valores)
+            linha += 1
+            continue
+
+        if totais and not mesclagem_restante and sorteio < 0.04:
+            valores[0] = rnd.choice(['Total', 'TOTAL', 'Soma', 'Geral'])
+            for indice in colunas:
+                valores[indice - 1] = round(rnd.uniform(0.5, 1.1), 4)
+            worksheet.append(valores)
+            linha += 1
+            continue
+
+        if mesclagem_restante:
+            # Continuação de um nome mesclado: colunas de nome vazias
+            mesclagem_restante -= 1
+        else:
+            agencia = rnd.randrange(max(linhas // 3, 1))
+            valores[0] = f'Agência {agencia:05d}'
+            valores[1] = f'{agencia % 10000:04d}'
+            valores[2] = f'Super {agencia % 40:02d}'
+            if mesclados and rnd.random() < 0.1:
+                mesclagem_restante = min(rnd.randint(1, 3), linhas + 1 - linha)
+                if mesclagem_restante:
+                    worksheet.merged_cells.add(f'A{linha}:A{linha + mesclagem_restante}')
+
+        for indice in colunas:
+            valores[indice - 1] = _valor_percentual(rnd)
+        for indice, tipo in auxiliares.items():
+            valores[indice - 1] = _valor_auxiliar(rnd, tipo)
+        worksheet.append(valores)
+        linha += 1
+
+    workbook.save(caminho)
+    return caminho
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Gera um relatório 6500 sintético')
+    parser.add_argument('caminho', help='Arquivo .xlsx de saída')
+    parser.add_argument('--linhas', type=int, default=1000, help='Linhas de dados (ex.: 1000 a 500000)')
+    parser.add_argument('--semente', type=int, default=6500)
+    parser.add_argument('--sem-mesclados', action='store_true', help='Não mesclar nomes')
+    parser.add_argument('--sem-totais', action='store_true', help='Não incluir linhas de totalização')
+    args = parser.parse_args()
+
+    gerar_planilha(args.caminho, args.linhas, args.semente,
+                   mesclados=not args.sem_mesclados, totais=not args.sem_totais)
+    print(f"✅ Planilha gerada: {args.caminho} ({args.linhas} linhas)")
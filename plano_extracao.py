@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Plano de extração do Sistema de Análise de Mobilizadores
+Compila mapeamento_colunas uma única vez em uma estrutura imutável e validada
+"""
+
+import json
+import re
+from dataclasses import dataclass
+
+# Colunas onde o nome do mobilizador pode aparecer: A, B, C, D
+COLUNAS_NOME = (1, 2, 3, 4)
+
+# Tipos de campo que podem ser usados como critério de ranking
+PARSERS = ('porcentagem',)
+
+# 'maior_por_nome' mantém o maior % de cada mobilizador; 'nenhuma' mantém todos
+DEDUPLICACOES = ('maior_por_nome', 'nenhuma')
+
+_RE_LETRA_COLUNA = re.compile(r'^[A-Z]{1,3}$')
+
+
+@dataclass(frozen=True)
+class PlanoGrupo:
+    """O que extrair de um grupo: colunas já convertidas em índices"""
+    nome: str
+    campo_ranking: str
+    parser: str
+    deduplicacao: str
+    colunas_busca: tuple        # letras, na ordem de varredura
+    indices_busca: tuple        # índices das mesmas colunas (A=1)
+    indices_consultados: tuple  # tudo que o grupo lê, incluindo as colunas de nome
+
+
+@dataclass(frozen=True)
+class PlanoExtracao:
+    """Plano completo: grupos na ordem do mapeamento e colunas a carregar"""
+    grupos: tuple
+    indices_bloco: tuple
+    assinatura: str
+
+    def grupo(self, nome):
+        for plano_grupo in self.grupos:
+            if plano_grupo.nome == nome:
+                return plano_grupo
+        raise KeyError(nome)
+
+
+def converter_coluna_para_indice(letra_coluna):
+    """Converte letra da coluna para índice numérico (A=1, B=2, etc.)"""
+    resultado = 0
+    for char in letra_coluna.upper():
+        resultado = resultado * 26 + (ord(char) - ord('A') + 1)
+    return resultado
+
+
+def _validar_letra(grupo, letra):
+    if not isinstance(letra, str) or not _RE_LETRA_COLUNA.match(letra.upper()):
+        raise ValueError(f"{grupo}: coluna inválida {letra!r}")
+    return letra.upper()
+
+
+def assinatura_mapeamento(mapeamento_colunas):
+    """Representação estável do mapeamento (para chaves de cache)
+
+    Ignora 'campos_utilizados', que versões antigas preenchiam durante o
+    processamento.
+    """
+    mapeamento = {
+        grupo: {campo: valor for campo, valor in config.items() if campo != 'campos_utilizados'}
+        for grupo, config in mapeamento_colunas.items()
+    }
+    return json.dumps(mapeamento, sort_keys=True, ensure_ascii=False)
+
+
+def _compilar_grupo(grupo, config):
+    if not isinstance(config, dict) or not isinstance(config.get('campos_disponiveis'), dict):
+        raise ValueError(f"{grupo}: 'campos_disponiveis' deve ser um objeto")
+
+    campos = config['campos_disponiveis']
+    for campo, info in campos.items():
+        if not isinstance(info, dict) or 'coluna' not in info or 'tipo' not in info:
+            raise ValueError(f"{grupo}: campo {campo!r} precisa de 'coluna' e 'tipo'")
+        _validar_letra(grupo, info['coluna'])
+
+    # Campo de ranking configurado ou, na falta dele, o primeiro de porcentagem
+    campo_ranking = config.get('campo_ranking_preferido')
+    if campo_ranking not in campos:
+        campo_ranking = next(
+            (campo for campo, info in campos.items() if info['tipo'] in PARSERS), None
+        )
+        if campo_ranking is None:
+            raise ValueError(f"{grupo}: nenhum campo de porcentagem para o ranking")
+
+    info_ranking = campos[campo_ranking]
+    if info_ranking['tipo'] not in PARSERS:
+        raise ValueError(f"{grupo}: campo de ranking {campo_ranking!r} não é de porcentagem")
+
+    # colunas_busca permite varrer várias colunas (ex.: S, T e U no Desembolso Agro)
+    colunas_busca = config.get('colunas_busca') or [info_ranking['coluna']]
+    colunas_busca = tuple(_validar_letra(grupo, letra) for letra in colunas_busca)
+
+    deduplicacao = config.get('deduplicacao', 'maior_por_nome')
+    if deduplicacao not in DEDUPLICACOES:
+        raise ValueError(f"{grupo}: deduplicação inválida {deduplicacao!r}")
+
+    indices_busca = tuple(converter_coluna_para_indice(letra) for letra in colunas_busca)
+    indices_consultados = set(COLUNAS_NOME) | set(indices_busca)
+    if config.get('coluna_principal'):
+        indices_consultados.add(converter_coluna_para_indice(_validar_letra(grupo, config['coluna_principal'])))
+    for info in campos.values():
+        indices_consultados.add(converter_coluna_para_indice(info['coluna']))
+
+    return PlanoGrupo(
+        nome=grupo,
+        campo_ranking=campo_ranking,
+        parser=info_ranking['tipo'],
+        deduplicacao=deduplicacao,
+        colunas_busca=colunas_busca,
+        indices_busca=indices_busca,
+        indices_consultados=tuple(sorted(indices_consultados)),
+    )
+
+
+def compilar_plano(mapeamento_colunas):
+    """Valida o mapeamento e gera o PlanoExtracao; levanta ValueError se inválido"""
+    if not isinstance(mapeamento_colunas, dict) or not mapeamento_colunas:
+        raise ValueError('O mapeamento de colunas deve ser um objeto com ao menos um grupo')
+
+    grupos = tuple(_compilar_grupo(grupo, config) for grupo, config in mapeamento_colunas.items())
+    indices_bloco = sorted({indice for plano_grupo in grupos for indice in plano_grupo.indices_consultados})
+
+    return PlanoExtracao(
+        grupos=grupos,
+        indices_bloco=tuple(indices_bloco),
+        assinatura=assinatura_mapeamento(mapeamento_colunas),
+    )
+
+
+def carregar_mapeamento(caminho):
+    """Lê um mapeamento de colunas de um arquivo JSON"""
+    with open(caminho, encoding='utf-8') as arquivo:
+        return json.load(arquivo)
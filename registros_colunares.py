@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Registros colunares do Sistema de Análise de Mobilizadores
+Cada análise vira um arquivo Arrow IPC com os registros extraídos, relido via memory-map
+"""
+
+import io
+import os
+import re
+import tempfile
+import time
+from datetime import datetime
+
+# 'arrow' é o formato gravado (relido sem cópia); 'parquet' é gerado sob demanda
+FORMATOS = ('arrow', 'parquet')
+
+_RE_ANALISE_ID = re.compile(r'^[0-9a-f]{32}$')
+
+
+def _schema():
+    import pyarrow as pa
+
+    # Grupo, coluna de origem e nomes se repetem muito: dicionário
+    texto_repetido = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema([
+        ('analise_id', texto_repetido),
+        ('timestamp', pa.timestamp('us')),
+        ('grupo', texto_repetido),
+        ('posicao', pa.int32()),
+        ('nome', texto_repetido),
+        ('atingimento_percentual', pa.float64()),
+        ('linha', pa.int32()),
+        ('coluna_origem', texto_repetido),
+    ])
+
+
+def tabela_registros(resultado, analise_id):
+    """Monta a tabela Arrow com um registro por item de ranking da análise
+
+    Só faz sentido para rankings completos: com top_k (resultado['top_k'])
+    a análise não tem todos os registros e gravar_registros recusa.
+    """
+    import pyarrow as pa
+
+    colunas = {nome: [] for nome in _schema().names}
+    for grupo, dados_grupo in resultado.get('rankings', {}).items():
+        for item in dados_grupo.get('ranking', []):
+            colunas['grupo'].append(grupo)
+            colunas['posicao'].append(item['posicao'])
+            colunas['nome'].append(item['nome'])
+            colunas['atingimento_percentual'].append(item['atingimento_percentual'])
+            colunas['linha'].append(item.get('linha'))
+            colunas['coluna_origem'].append(item.get('coluna_origem'))
+
+    total = len(colunas['grupo'])
+    colunas['analise_id'] = [analise_id] * total
+    colunas['timestamp'] = [datetime.fromisoformat(resultado['timestamp'])] * total
+    return pa.Table.from_pydict(colunas, schema=_schema())
+
+
+def caminho_registros(diretorio, analise_id):
+    """Caminho do arquivo de uma análise; levanta ValueError para ids inválidos"""
+    if not _RE_ANALISE_ID.match(analise_id or ''):
+        raise ValueError('analise_id inválido')
+    return os.path.join(diretorio, f'{analise_id}.arrow')
+
+
+def gravar_registros(resultado, analise_id, diretorio):
+    """Grava os registros da análise em Arrow IPC e retorna o caminho
+
+    Levanta ValueError se a análise foi truncada por top_k.
+    """
+    import pyarrow as pa
+
+    if resultado.get('top_k') is not None:
+        raise ValueError('Análise feita com top_k não tem todos os registros')
+
+    os.makedirs(diretorio, exist_ok=True)
+    caminho = caminho_registros(diretorio, analise_id)
+    tabela = tabela_registros(resultado, analise_id)
+
+    # Escrita atômica: leitores nunca veem um arquivo pela metade
+    descritor, temporario = tempfile.mkstemp(dir=diretorio, suffix='.tmp')
+    try:
+        with os.fdopen(descritor, 'wb') as arquivo:
+            with pa.ipc.new_file(arquivo, tabela.schema) as escritor:
+                escritor.write_table(tabela)
+        os.replace(temporario, caminho)
+    except BaseException:
+        os.remove(temporario)
+        raise
+    return caminho
+
+
+def podar_registros(diretorio, max_itens, ttl_segundos):
+    """Remove os arquivos expirados e os mais antigos acima de max_itens
+
+    A idade é a data de modificação de cada arquivo. Arquivos já removidos
+    por outro worker são ignorados.
+    """
+    limite = time.time() - ttl_segundos
+    arquivos = []
+    try:
+        nomes = os.listdir(diretorio)
+    except FileNotFoundError:
+        return
+    for nome_arquivo in nomes:
+        if not nome_arquivo.endswith('.arrow'):
+            continue
+        caminho = os.path.join(diretorio, nome_arquivo)
+        try:
+            arquivos.append((os.path.getmtime(caminho), caminho))
+        except OSError:
+            continue
+
+    arquivos.sort(reverse=True)
+    for indice, (modificado_em, caminho) in enumerate(arquivos):
+        if indice >= max_itens or modificado_em < limite:
+            try:
+                os.remove(caminho)
+            except OSError:
+                pass
+
+
+def carregar_registros(caminho):
+    """Lê um arquivo de registros via memory-map (sem copiar os dados)"""
+    import pyarrow as pa
+
+    with pa.memory_map(caminho, 'r') as origem:
+        return pa.ipc.open_file(origem).read_all()
+
+
+def carregar_historico(diretorio, desde=None, ate=None):
+    """Concatena os registros de todas as análises do diretório
+
+    desde/ate (datetime) filtram pelo timestamp da análise, o que permite
+    montar tendências do mês sem reabrir nenhuma planilha.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    tabelas = []
+    for nome_arquivo in sorted(os.listdir(diretorio)):
+        if nome_arquivo.endswith('.arrow'):
+            tabelas.append(carregar_registros(os.path.join(diretorio, nome_arquivo)))
+    if not tabelas:
+        return _schema().empty_table()
+
+    tabela = pa.concat_tables(tabelas, promote_options='permissive')
+    if desde is not None:
+        tabela = tabela.filter(pc.field('timestamp') >= desde)
+    if ate is not None:
+        tabela = tabela.filter(pc.field('timestamp') <= ate)
+    return tabela
+
+
+def serializar(tabela, formato='arrow'):
+    """Bytes da tabela no formato pedido ('arrow' ou 'parquet')"""
+    import pyarrow as pa
+
+    buffer = io.BytesIO()
+    if formato == 'parquet':
+        import pyarrow.parquet as pq
+        pq.write_table(tabela, buffer, compression='zstd')
+    else:
+        with pa.ipc.new_file(buffer, tabela.schema) as escritor:
+            escritor.write_table(tabela)
+    return buffer.getvalue()
@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Teste de carga da API do Sistema de Análise de Mobilizadores
+Sobe o app localmente (gunicorn ou servidor do Flask), dispara uploads em
+/api/analisar e downloads em /api/download/<grupo> em paralelo e compara
+cada resultado com o de uma execução serial, para pegar condições de corrida
+além de lentidão
+"""
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+DIRETORIO_APP = os.path.dirname(os.path.abspath(__file__))
+
+
+def _porta_livre():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def iniciar_servidor(servidor, porta, workers, diretorio, requisicoes):
+    """Sobe o app em um processo filho, com bancos e caches só deste teste"""
+    ambiente = dict(
+        os.environ,
+        PORT=str(porta),
+        ANALISES_DB=os.path.join(diretorio, 'analises.sqlite3'),
+        ANALISES_MAX=str(max(requisicoes * 2, 200)),
+        HISTORICO_DB=os.path.join(diretorio, 'historico.sqlite3'),
+        REGISTROS_DIR=os.path.join(diretorio, 'registros'),
+        WEB_CONCURRENCY=str(workers),
+    )
+    ambiente.pop('CACHE_DIR', None)
+
+    if servidor == 'gunicorn':
+        comando = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py',
+                   '--bind', f'127.0.0.1:{porta}', '--workers', str(workers), 'app:app']
+    else:
+        comando = [sys.executable, '-m', 'flask', '--app', 'app', 'run', '--port', str(porta),
+                   '--no-reload', '--no-debugger', '--with-threads']
+
+    processo = subprocess.Popen(comando, cwd=DIRETORIO_APP, env=ambiente,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{porta}'
+    limite = time.monotonic() + 120
+    while time.monotonic() < limite:
+        if processo.poll() is not None:
+            raise RuntimeError(f'O servidor terminou ao iniciar (código {processo.returncode})')
+        try:
+            with urllib.request.urlopen(f'{url}/api/status', timeout=2):
+                return processo, url
+        except OSError:
+            time.sleep(0.25)
+    processo.terminate()
+    raise RuntimeError('O servidor não respondeu em 120 s')
+
+
+def _multipart(campos, arquivo, nome_arquivo):
+    fronteira = uuid.uuid4().hex
+    partes = []
+    for nome, valor in campos.items():
+        partes.append(f'--{fronteira}\r\nContent-Disposition: form-data; name="{nome}"\r\n\r\n{valor}\r\n'.encode())
+    partes.append(
+        f'--{fronteira}\r\nContent-Disposition: form-data; name="arquivo"; filename="{nome_arquivo}"\r\n'
+        f'Content-Type: application/vnd.openxmlformats-officedocument.spreadsheetml.sheet\r\n\r\n'.encode()
+    )
+    partes.append(arquivo)
+    partes.append(f'\r\n--{fronteira}--\r\n'.encode())
+    return b''.join(partes), f'multipart/form-data; boundary={fronteira}'
+
+
+def _requisicao(url, corpo=None, tipo=None, timeout=300):
+    """(status, bytes, segundos); erros de rede viram status 0"""
+    pedido = urllib.request.Request(url, data=corpo, headers={'Content-Type': tipo} if tipo else {})
+    inicio = time.perf_counter()
+    try:
+        with urllib.request.urlopen(pedido, timeout=timeout) as resposta:
+            return resposta.status, resposta.read(), time.perf_counter() - inicio
+    except urllib.error.HTTPError as e:
+        return e.code, e.read(), time.perf_counter() - inicio
+    except OSError as e:
+        return 0, str(e).encode(), time.perf_counter() - inicio
+
+
+def analisar(url, conteudo, nome, sem_cache):
+    # Um byte a mais depois do ZIP muda o hash (o arquivo continua válido)
+    # e obriga o servidor a processar de verdade
+    if sem_cache:
+        conteudo = conteudo + uuid.uuid4().bytes
+    corpo, tipo = _multipart({}, conteudo, nome)
+    status, dados, segundos = _requisicao(f'{url}/api/analisar', corpo, tipo)
+    resultado = None
+    if status == 200:
+        try:
+            resultado = json.loads(dados)
+        except ValueError:
+            status = -1
+    return status, resultado, segundos
+
+
+def baixar(url, grupo, analise_id, dpi):
+    consulta = urllib.parse.urlencode({'analise_id': analise_id, 'dpi': dpi})
+    status, dados, segundos = _requisicao(f'{url}/api/download/{urllib.parse.quote(grupo)}?{consulta}')
+    if status == 200 and not dados.startswith(b'\x89PNG'):
+        status = -1
+    return status, segundos
+
+
+def _processos_do_servidor(pid_mestre):
+    """pid do servidor e de todos os seus filhos (workers do gunicorn)"""
+    pids = [pid_mestre]
+    for entrada in os.listdir('/proc'):
+        if not entrada.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entrada}/stat') as arquivo:
+                # O nome do processo vem entre parênteses e pode ter espaços
+                campos = arquivo.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        if int(campos[1]) == pid_mestre:
+            pids.append(int(entrada))
+    return pids
+
+
+def _memoria_processo(pid):
+    """VmRSS e VmHWM (pico) em MB, lidos de /proc/<pid>/status"""
+    memoria = {}
+    try:
+        with open(f'/proc/{pid}/status') as arquivo:
+            for linha in arquivo:
+                if linha.startswith(('VmRSS:', 'VmHWM:')):
+                    chave, valor = linha.split(':', 1)
+                    memoria[chave] = int(valor.split()[0]) / 1024
+    except OSError:
+        return None
+    return {'rss_mb': memoria.get('VmRSS'), 'pico_mb': memoria.get('VmHWM')}
+
+
+class MonitorMemoria(threading.Thread):
+    """Amostra a memória do servidor e de cada worker durante o teste"""
+
+    def __init__(self, pid_mestre, intervalo=0.5):
+        super().__init__(daemon=True)
+        self.pid_mestre = pid_mestre
+        self.intervalo = intervalo
+        self.maximos = {}   # pid -> maior RSS visto (MB)
+        self.ultimas = {}   # pid -> última leitura
+        self._parar = threading.Event()
+
+    def run(self):
+        while not self._parar.is_set():
+            self.amostrar()
+            self._parar.wait(self.intervalo)
+
+    def amostrar(self):
+        if not os.path.isdir('/proc'):
+            return
+        for pid in _processos_do_servidor(self.pid_mestre):
+            memoria = _memoria_processo(pid)
+            if memoria and memoria['rss_mb'] is not None:
+                self.ultimas[pid] = memoria
+                self.maximos[pid] = max(self.maximos.get(pid, 0), memoria['rss_mb'])
+
+    def parar(self):
+        self._parar.set()
+        self.join()
+        self.amostrar()
+        return {
+            pid: {'rss_max_mb': self.maximos[pid], 'pico_kernel_mb': self.ultimas[pid]['pico_mb']}
+            for pid in self.maximos
+        }
+
+
+def percentil(valores, p):
+    """Percentil pelo método nearest-rank (valores já ordenados)"""
+    if not valores:
+        return None
+    indice = max(0, min(len(valores) - 1, int(round(p / 100 * len(valores) + 0.5)) - 1))
+    return valores[indice]
+
+
+def _resumo_latencias(amostras, duracao):
+    latencias = sorted(segundos for status, segundos in amostras if status == 200)
+    erros = sum(1 for status, _ in amostras if status != 200)
+    return {
+        'requisicoes': len(amostras),
+        'erros': erros,
+        'taxa_erro': erros / len(amostras) if amostras else 0.0,
+        'vazao_rps': len(amostras) / duracao if duracao else None,
+        'p50_s': percentil(latencias, 50),
+        'p95_s': percentil(latencias, 95),
+        'p99_s': percentil(latencias, 99),
+        'max_s': latencias[-1] if latencias else None,
+    }
+
+
+def _diferencas(esperado, obtido, limite=3):
+    """Primeiras diferenças entre os rankings de duas análises"""
+    diferencas = []
+    for grupo in sorted(set(esperado) | set(obtido)):
+        if esperado.get(grupo) == obtido.get(grupo):
+            continue
+        itens_esperados = (esperado.get(grupo) or {}).get('ranking', [])
+        itens_obtidos = (obtido.get(grupo) or {}).get('ranking', [])
+        posicao = next((i for i, (a, b) in enumerate(zip(itens_esperados, itens_obtidos)) if a != b),
+                       min(len(itens_esperados), len(itens_obtidos)))
+        diferencas.append(f'{grupo}: primeira diferença na posição {posicao + 1} '
+                          f'({len(itens_esperados)} itens esperados, {len(itens_obtidos)} obtidos)')
+        if len(diferencas) >= limite:
+            break
+    return diferencas
+
+
+def executar_teste(args):
+    from planilha_sintetica import gerar_planilha
+
+    with tempfile.TemporaryDirectory() as diretorio:
+        planilhas = {}
+        for linhas in args.linhas:
+            caminho = os.path.join(diretorio, f'relatorio_{linhas}.xlsx')
+            gerar_planilha(caminho, linhas)
+            with open(caminho, 'rb') as arquivo:
+                planilhas[f'relatorio_{linhas}.xlsx'] = arquivo.read()
+        print(f"📦 Planilhas: {', '.join(f'{nome} ({len(c) / 1024:.0f} KB)' for nome, c in planilhas.items())}")
+
+        porta = args.porta or _porta_livre()
+        processo, url = iniciar_servidor(args.servidor, porta, args.workers, diretorio, args.requisicoes)
+        print(f"🚀 {args.servidor} em {url} (pid {processo.pid})")
+        try:
+            return _rodar_cenarios(args, url, processo, planilhas)
+        finally:
+            processo.terminate()
+            try:
+                processo.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                processo.kill()
+
+
+def _rodar_cenarios(args, url, processo, planilhas):
+    # Referência: cada planilha analisada uma vez, sem concorrência
+    referencias = {}
+    for nome, conteudo in planilhas.items():
+        status, resultado, segundos = analisar(url, conteudo, nome, args.sem_cache)
+        if status != 200 or not resultado.get('sucesso'):
+            raise RuntimeError(f'A análise serial de {nome} falhou (HTTP {status})')
+        referencias[nome] = resultado['rankings']
+        print(f"🔹 Serial {nome}: {segundos:.2f}s")
+
+    nomes = list(planilhas)
+    grupos = {nome: list(referencias[nome]) for nome in nomes}
+    amostras = {'analisar': [], 'download': []}
+    divergencias = []
+    lock = threading.Lock()
+
+    def usuario(indice):
+        nome = nomes[indice % len(nomes)]
+        status, resultado, segundos = analisar(url, planilhas[nome], nome, args.sem_cache)
+        with lock:
+            amostras['analisar'].append((status, segundos))
+        if status != 200 or not resultado.get('sucesso'):
+            return
+        if resultado['rankings'] != referencias[nome]:
+            with lock:
+                divergencias.append({'requisicao': indice, 'planilha': nome,
+                                     'diferencas': _diferencas(referencias[nome], resultado['rankings'])})
+        for grupo in grupos[nome][:args.downloads]:
+            status_download, segundos = baixar(url, grupo, resultado['analise_id'], args.dpi)
+            with lock:
+                amostras['download'].append((status_download, segundos))
+
+    monitor = MonitorMemoria(processo.pid)
+    monitor.start()
+    print(f"⚡ {args.requisicoes} uploads com concorrência {args.concorrencia}...")
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concorrencia) as executor:
+        list(executor.map(usuario, range(args.requisicoes)))
+    duracao = time.perf_counter() - inicio
+    memoria = monitor.parar()
+
+    relatorio = {
+        'servidor': args.servidor,
+        'workers': args.workers,
+        'concorrencia': args.concorrencia,
+        'sem_cache': args.sem_cache,
+        'duracao_s': duracao,
+        'analisar': _resumo_latencias(amostras['analisar'], duracao),
+        'download': _resumo_latencias(amostras['download'], duracao),
+        'memoria_por_processo': memoria,
+        'divergencias': divergencias,
+    }
+    _imprimir(relatorio)
+    return relatorio
+
+
+def _imprimir(relatorio):
+    print(f"\n⏱️ Duração: {relatorio['duracao_s']:.1f}s")
+    for operacao in ('analisar', 'download'):
+        dados = relatorio[operacao]
+        if not dados['requisicoes']:
+            continue
+        latencias = '  '.join(
+            f"{rotulo} {dados[chave]:.2f}s" if dados[chave] is not None else f'{rotulo} -'
+            for rotulo, chave in (('p50', 'p50_s'), ('p95', 'p95_s'), ('p99', 'p99_s'), ('máx', 'max_s'))
+        )
+        print(f"📊 {operacao:9s} {dados['requisicoes']:5d} req  {dados['vazao_rps']:6.2f} req/s  "
+              f"erros {dados['taxa_erro']:.1%}  {latencias}")
+
+    for pid, memoria in sorted(relatorio['memoria_por_processo'].items()):
+        pico = memoria['pico_kernel_mb']
+        print(f"🧠 pid {pid}: RSS máx {memoria['rss_max_mb']:.0f} MB"
+              + (f", pico (VmHWM) {pico:.0f} MB" if pico is not None else ''))
+
+    if relatorio['divergencias']:
+        print(f"❌ {len(relatorio['divergencias'])} resultados concorrentes diferentes do serial:")
+        for divergencia in relatorio['divergencias'][:5]:
+            print(f"   requisição {divergencia['requisicao']} ({divergencia['planilha']}):")
+            for diferenca in divergencia['diferencas']:
+                print(f"      {diferenca}")
+    else:
+        print("✅ Todos os resultados concorrentes iguais ao serial")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Teste de carga de /api/analisar e /api/download')
+    parser.add_argument('--servidor', choices=('gunicorn', 'flask'), default='gunicorn')
+    parser.add_argument('--workers', type=int, default=2, help='Workers do gunicorn')
+    parser.add_argument('--porta', type=int, help='Padrão: uma porta livre')
+    parser.add_argument('--linhas', type=int, nargs='+', default=[1000, 5000],
+                        help='Tamanhos das planilhas sintéticas (usadas em rodízio)')
+    parser.add_argument('--requisicoes', type=int, default=40, help='Total de uploads')
+    parser.add_argument('--concorrencia', type=int, default=8, help='Uploads simultâneos')
+    parser.add_argument('--downloads', type=int, default=2, help='Downloads de PNG após cada upload')
+    parser.add_argument('--dpi', type=int, default=100)
+    parser.add_argument('--com-cache', dest='sem_cache', action='store_false',
+                        help='Reenviar os mesmos bytes (mede o cache em vez do processamento)')
+    parser.add_argument('--max-taxa-erro', type=float, default=0.0,
+                        help='Taxa de erro aceita antes de falhar (código de saída 1)')
+    parser.add_argument('--saida', help='Grava o relatório em JSON')
+    args = parser.parse_args()
+
+    relatorio = executar_teste(args)
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as arquivo:
+            json.dump(relatorio, arquivo, ensure_ascii=False, indent=2)
+        print(f"✅ Relatório gravado em {args.saida}")
+
+    falhou = relatorio['divergencias'] or any(
+        relatorio[operacao]['taxa_erro'] > args.max_taxa_erro for operacao in ('analisar', 'download')
+    )
+    sys.exit(1 if falhou else 0)
+
+
+if __name__ == '__main__':
+    main()
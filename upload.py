@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Recebimento de planilhas enviadas ao Sistema de Análise de Mobilizadores
+O upload vai para um arquivo temporário uma única vez e é mapeado em memória (mmap);
+hash, detecção de formato e leitura da planilha usam o mesmo buffer, sem cópias
+"""
+
+import errno
+import io
+import mmap
+import os
+import shutil
+import tempfile
+
+# Assinaturas (magic bytes) dos formatos do Excel
+ASSINATURA_XLSX = b'PK\x03\x04'                          # pacote ZIP (Office Open XML)
+ASSINATURA_XLS = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'     # OLE2 (Excel 97-2003)
+
+MENSAGENS_FORMATO = {
+    'xls': 'Arquivos .xls (Excel 97-2003) não são suportados. Abra no Excel e salve como .xlsx',
+    None: 'O arquivo não é uma planilha .xlsx válida',
+}
+
+
+def detectar_formato(cabecalho):
+    """'xlsx', 'xls' ou None a partir dos primeiros bytes do arquivo"""
+    cabecalho = bytes(cabecalho[:len(ASSINATURA_XLS)])
+    if cabecalho.startswith(ASSINATURA_XLSX):
+        return 'xlsx'
+    if cabecalho.startswith(ASSINATURA_XLS):
+        return 'xls'
+    return None
+
+
+class LeitorBuffer(io.RawIOBase):
+    """Arquivo somente leitura sobre um buffer (memoryview), com posição própria
+
+    Cada leitor tem seu cursor, então vários podem ler o mesmo mmap ao
+    mesmo tempo; read devolve só o trecho pedido.
+    """
+
+    def __init__(self, buffer):
+        super().__init__()
+        self._buffer = memoryview(buffer)
+        self._posicao = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._posicao
+
+    def seek(self, deslocamento, origem=io.SEEK_SET):
+        if origem == io.SEEK_CUR:
+            deslocamento += self._posicao
+        elif origem == io.SEEK_END:
+            deslocamento += len(self._buffer)
+        if deslocamento < 0:
+            # Como nos arquivos do io: o zipfile trata OSError como arquivo curto demais
+            raise OSError(errno.EINVAL, 'posição negativa')
+        self._posicao = deslocamento
+        return self._posicao
+
+    def read(self, tamanho=-1):
+        if tamanho is None or tamanho < 0:
+            fim = len(self._buffer)
+        else:
+            fim = min(self._posicao + tamanho, len(self._buffer))
+        trecho = self._buffer[self._posicao:fim].tobytes() if fim > self._posicao else b''
+        self._posicao = max(self._posicao, fim)
+        return trecho
+
+    def readinto(self, destino):
+        trecho = self.read(len(destino))
+        destino[:len(trecho)] = trecho
+        return len(trecho)
+
+    def close(self):
+        # Libera a referência ao buffer para que o mmap possa ser fechado
+        self._buffer.release()
+        super().close()
+
+
+class PlanilhaRecebida:
+    """
+    Upload em disco, mapeado em memória
+
+    Uploads grandes já chegam do Werkzeug em um arquivo temporário, que é
+    mapeado direto; os pequenos (em memória) são gravados uma vez em um
+    temporário. O arquivo não tem nome no disco: some ao fechar. Quem
+    recebe a planilha deve chamar fechar() (ou usar with) quando terminar,
+    inclusive em jobs que continuam depois da requisição.
+    """
+
+    def __init__(self, descritor, tamanho):
+        self._descritor = descritor
+        self.tamanho = tamanho
+        self._mapa = mmap.mmap(descritor, 0, access=mmap.ACCESS_READ) if tamanho else None
+        self.buffer = memoryview(self._mapa) if self._mapa is not None else memoryview(b'')
+
+    @classmethod
+    def receber(cls, origem, diretorio=None):
+        """Cria a partir de um stream (ex.: FileStorage.stream do Flask)"""
+        try:
+            # Dados ainda no buffer do Python precisam chegar ao arquivo antes do mmap
+            origem.flush()
+            descritor = os.dup(origem.fileno())
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            descritor = None
+
+        if descritor is None:
+            temporario = tempfile.TemporaryFile(dir=diretorio)
+            origem.seek(0)
+            shutil.copyfileobj(origem, temporario, 1024 * 1024)
+            temporario.flush()
+            descritor = os.dup(temporario.fileno())
+            temporario.close()
+        return cls(descritor, os.fstat(descritor).st_size)
+
+    @property
+    def formato(self):
+        return detectar_formato(self.buffer)
+
+    def abrir(self):
+        """Arquivo somente leitura sobre o buffer mapeado (um por consumidor)"""
+        return LeitorBuffer(self.buffer)
+
+    def fechar(self):
+        if self._descritor is None:
+            return
+        self.buffer.release()
+        if self._mapa is not None:
+            try:
+                self._mapa.close()
+            except BufferError:
+                pass  # algum leitor ainda aberto: o mapa é desfeito quando ele for coletado
+        os.close(self._descritor)
+        self._descritor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excecao):
+        self.fechar()